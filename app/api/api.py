@@ -1,6 +1,6 @@
-from fastapi import APIRouter, Depends
-from app.api.v1.controller import ecommerce_controller
-from app.middlewares.authentication import auth_middleware
+from fastapi import APIRouter, Security
+from app.api.v1.controller import ecommerce_controller, system_controller
+from app.middlewares.authentication import api_key_header
 
 api_router = APIRouter()
 
@@ -8,5 +8,12 @@ api_router.include_router(
     ecommerce_controller.router,
     prefix="/ecommerce",
     tags=["Ecommerce"],
-    dependencies=[Depends(auth_middleware)]
+    dependencies=[Security(api_key_header)]
+)
+
+api_router.include_router(
+    system_controller.router,
+    prefix="/system",
+    tags=["System"],
+    dependencies=[Security(api_key_header)]
 )
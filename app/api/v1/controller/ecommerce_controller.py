@@ -1,11 +1,23 @@
-from typing import List
-from app.api.v1.models.base import get_db
-from app.api.v1.schemas.ecommerce import OrderResponse, OrderCreate, ProductResponse, ProductCreate
-from app.core.config import setup_logging
-from fastapi import APIRouter, Depends, Query
-from sqlalchemy.orm import Session
+from datetime import datetime
+from typing import List, Literal, Optional
+from app.api.v1.models.base import get_async_db, get_async_session_factory
+from app.api.v1.models.search import SearchFilters
+from app.api.v1.schemas.ecommerce import (OrderResponse, OrderCreate, ProductResponse, ProductCreate,
+                                          OrderBatchCreate, OrderBatchResponse, ProductImportReport,
+                                          ProductStockShards, OrderDetail, TopProduct, HourlySales,
+                                          LowStockItem, OrderQuote, PricingRuleCreate, PricingRuleResponse)
+from app.core.config import setup_logging, settings
+from app.core.http_cache import etag_matches, make_etag
+from app.core.responses import json_response_class
+from fastapi import APIRouter, Depends, Header, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from app.api.v1.repositories.analytics import AnalyticsRepository
 from app.api.v1.repositories.product import ProductRepository
 from app.api.v1.repositories.order import OrderRepository
+from app.api.v1.repositories.pricing import PricingRepository
+from app.api.v1.repositories.product_export import ProductExportRepository, MEDIA_TYPES
+from app.api.v1.repositories.product_import import ProductImportRepository
 
 
 logger = setup_logging(__name__)
@@ -14,25 +26,184 @@ router = APIRouter()
 product_repository = ProductRepository()
 order_repository = OrderRepository()
 
+# Product reads are plain dicts already shaped like ProductResponse, they are rendered directly
+# instead of being validated row by row against the response model
+JSONResponse = json_response_class()
+
+
+def product_etag(products, *extra):
+    return make_etag([*(tuple(product.values()) for product in products), *extra])
+
+
+def cached_json(request: Request, content, etag, headers=None):
+    """
+    Render content with validators and caching headers, bodiless 304 when the client already holds this representation
+    """
+    # Responses depend on the API key, a shared cache must not answer one client with another's response
+    headers = {**(headers or {}), "ETag": etag, "Cache-Control": settings.PRODUCT_CACHE_CONTROL, "Vary": "X-API-KEY"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content, headers=headers)
+
+
+def cursor_headers(next_cursor):
+    return {"X-Next-Cursor": next_cursor} if next_cursor else {}
+
 
 @router.get("/products", response_model=List[ProductResponse])
-def get_products(db: Session = Depends(get_db),
-                 skip: int = Query(0, ge=0, description="Number of items to skip"),
-                 limit: int = Query(10, ge=1, le=100, description="Max number of items to return (1-100)")
+async def get_products(request: Request, db: AsyncSession = Depends(get_async_db),
+                       skip: int = Query(0, ge=0, description="Number of items to skip"),
+                       limit: int = Query(10, ge=1, le=100, description="Max number of items to return (1-100)"),
+                       after: Optional[str] = Query(None, description="Cursor from the X-Next-Cursor header of the "
+                                                                       "previous page, takes precedence over skip"),
+                       sort: Literal["id", "name", "price"] = Query("id", description="Sort order of the pages")
     ):
-    return product_repository.get_products(db, skip, limit)
+    products, next_cursor = await product_repository.get_products(db, skip, limit, after, sort)
+    return cached_json(request, products, product_etag(products, next_cursor), cursor_headers(next_cursor))
+
+
+@router.get("/products/search", response_model=List[ProductResponse])
+async def search_products(db: AsyncSession = Depends(get_async_db),
+                          q: str = Query(..., min_length=1, max_length=200, description="Words to search for, "
+                                                                                        "the last one as a prefix"),
+                          min_price: Optional[float] = Query(None, ge=0),
+                          max_price: Optional[float] = Query(None, ge=0),
+                          in_stock: bool = Query(False, description="Only products with stock left"),
+                          limit: int = Query(10, ge=1, le=100, description="Max number of items to return (1-100)"),
+                          after: Optional[str] = Query(None, description="Cursor from the X-Next-Cursor header of "
+                                                                          "the previous page")):
+    """Products ranked by relevance of name and description"""
+    products, next_cursor = await product_repository.search_products(
+        db, q, SearchFilters(min_price, max_price, in_stock), limit, after)
+    return JSONResponse(products, headers=cursor_headers(next_cursor))
+
+
+@router.get("/products/{product_id}", response_model=ProductResponse)
+async def get_product(product_id: int, request: Request, db: AsyncSession = Depends(get_async_db)):
+    product = await product_repository.get_product(db, product_id)
+    return cached_json(request, product, product_etag([product]))
 
 
 @router.post("/products", response_model=ProductResponse)
-def create_product(product_data: ProductCreate, db: Session = Depends(get_db)):
-    return product_repository.add_product(db, product_data)
+async def create_product(product_data: ProductCreate, db: AsyncSession = Depends(get_async_db)):
+    return await product_repository.add_product(db, product_data)
+
+
+@router.post("/products/{product_id}/stock:shard", response_model=ProductStockShards)
+async def shard_product_stock(product_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Spread the stock of a hot product over STOCK_SHARDS counters so that concurrent orders lock different rows"""
+    return await product_repository.shard_stock(db, product_id, sharded=True)
+
+
+@router.post("/products/{product_id}/stock:merge", response_model=ProductStockShards)
+async def merge_product_stock(product_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Move the stock of a sharded product back into its product row"""
+    return await product_repository.shard_stock(db, product_id, sharded=False)
+
+
+@router.post("/products:import", response_model=ProductImportReport)
+async def import_products(request: Request, db: AsyncSession = Depends(get_async_db),
+                          format: Literal["ndjson", "csv"] = Query("ndjson", description="Format of the request body"),
+                          mode: Optional[Literal["upsert", "copy"]] = Query(None, description="Write strategy")):
+    """Stream a NDJSON or CSV catalog in the request body, products with a known sku are updated"""
+    return await ProductImportRepository.import_products(db, request.stream(), format, mode)
+
+
+@router.get("/products:export")
+async def export_products(session_factory: async_sessionmaker = Depends(get_async_session_factory),
+                          format: Literal["ndjson", "csv"] = Query("ndjson", description="Format of the export"),
+                          since: Optional[datetime] = Query(None, description="Only products updated after this time")):
+    """Stream the whole catalog in one response, read through a server-side cursor"""
+    return StreamingResponse(ProductExportRepository.export_products(session_factory, format, since),
+                             media_type=MEDIA_TYPES[format],
+                             headers={"Content-Disposition": f'attachment; filename="products.{format}"'})
 
 
 @router.post("/orders", response_model=OrderResponse)
-def create_order(order_data: OrderCreate, db: Session = Depends(get_db)):
-    try:
-        order = order_repository.place_order(db, order_data)
-        return OrderResponse(id=order.id, total_price=order.total_price, status=order.status,
-                             products=order_data.products)
-    except Exception as err:
-        raise err
+async def create_order(order_data: OrderCreate, request: Request, db: AsyncSession = Depends(get_async_db),
+                       idempotency_key: Optional[str] = Header(None, min_length=1, max_length=255,
+                                                               description="Retries with the same key are answered "
+                                                                           "with the first response")):
+    if idempotency_key is None:
+        order = await order_repository.place_order(db, order_data)
+        return order_repository.order_response(order, order_data)
+
+    status_code, body, replayed = await order_repository.place_order_once(db, order_data, idempotency_key,
+                                                                          request.state.api_key.key_hash)
+    return JSONResponse(body, status_code=status_code, headers={"Idempotent-Replayed": str(replayed).lower()})
+
+
+@router.post("/orders:quote", response_model=OrderQuote)
+async def quote_order(order_data: OrderCreate, db: AsyncSession = Depends(get_async_db)):
+    """Price an order with the promotions in force, stock is neither checked nor reserved"""
+    return JSONResponse(await order_repository.quote_order(db, order_data))
+
+
+@router.get("/orders", response_model=List[OrderDetail])
+async def get_orders(db: AsyncSession = Depends(get_async_db),
+                     status: Optional[Literal["placed", "completed"]] = Query(None, description="Only orders in "
+                                                                                                "this status"),
+                     created_after: Optional[datetime] = Query(None, description="Only orders created at or after "
+                                                                                 "this time"),
+                     created_before: Optional[datetime] = Query(None, description="Only orders created before "
+                                                                                  "this time"),
+                     items: bool = Query(True, description="Include the products of each order, otherwise only "
+                                                           "summaries are returned"),
+                     limit: int = Query(10, ge=1, le=100, description="Max number of items to return (1-100)"),
+                     after: Optional[str] = Query(None, description="Cursor from the X-Next-Cursor header of the "
+                                                                    "previous page")):
+    """Orders newest first"""
+    orders, next_cursor = await order_repository.get_orders(db, limit, status, created_after, created_before,
+                                                            after, items)
+    return JSONResponse(orders, headers=cursor_headers(next_cursor))
+
+
+@router.get("/orders/{order_id}", response_model=OrderDetail)
+async def get_order(order_id: int, db: AsyncSession = Depends(get_async_db)):
+    return JSONResponse(await order_repository.get_order(db, order_id))
+
+
+@router.post("/orders:batch", response_model=OrderBatchResponse)
+async def create_orders_batch(batch_data: OrderBatchCreate, db: AsyncSession = Depends(get_async_db)):
+    return await order_repository.place_orders(db, batch_data.orders)
+
+
+@router.get("/analytics/top-products", response_model=List[TopProduct])
+async def get_top_products(db: AsyncSession = Depends(get_async_db),
+                           limit: int = Query(10, ge=1, le=100, description="Max number of items to return (1-100)")):
+    """Best selling products by units sold"""
+    return await AnalyticsRepository.top_products(db, limit)
+
+
+@router.get("/analytics/sales-by-hour", response_model=List[HourlySales])
+async def get_sales_by_hour(db: AsyncSession = Depends(get_async_db),
+                            hours: int = Query(24, ge=1, le=24 * 90, description="Hours to return, the current "
+                                                                                 "one included")):
+    """Orders, units and revenue per hour, hours without orders are left out"""
+    return await AnalyticsRepository.sales_by_hour(db, hours)
+
+
+@router.get("/analytics/low-stock", response_model=List[LowStockItem])
+async def get_low_stock(db: AsyncSession = Depends(get_async_db),
+                        limit: int = Query(100, ge=1, le=1000, description="Max number of items to return")):
+    """Ordered products with LOW_STOCK_THRESHOLD or less stock, lowest first"""
+    return await AnalyticsRepository.low_stock(db, limit)
+
+
+@router.post("/pricing-rules", response_model=PricingRuleResponse)
+async def create_pricing_rule(rule_data: PricingRuleCreate, db: AsyncSession = Depends(get_async_db)):
+    """Add a promotion, it applies to orders placed from its start on"""
+    return await PricingRepository.create_rule(db, rule_data)
+
+
+@router.get("/pricing-rules", response_model=List[PricingRuleResponse])
+async def get_pricing_rules(db: AsyncSession = Depends(get_async_db),
+                            include_inactive: bool = Query(False, description="Include deactivated rules")):
+    """Promotions, newest first"""
+    return await PricingRepository.get_rules(db, include_inactive)
+
+
+@router.post("/pricing-rules/{rule_id}:deactivate", response_model=PricingRuleResponse)
+async def deactivate_pricing_rule(rule_id: int, db: AsyncSession = Depends(get_async_db)):
+    """End a promotion, rules are not edited: deactivate one and create its replacement"""
+    return await PricingRepository.deactivate_rule(db, rule_id)
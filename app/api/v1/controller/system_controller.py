@@ -0,0 +1,18 @@
+from app.api.v1.models.database import get_pool_stats
+from app.api.v1.models.product_cache import product_cache
+from app.core.config import setup_logging
+from fastapi import APIRouter
+
+
+logger = setup_logging(__name__)
+router = APIRouter()
+
+
+@router.get("/pool")
+async def get_pool():
+    return get_pool_stats()
+
+
+@router.get("/cache")
+async def get_cache():
+    return product_cache.stats()
@@ -0,0 +1,139 @@
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import List
+from sqlalchemy import case, delete, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.api.v1.models.base import (Product, product_stock, Order, OrderItem, ProductSales, SalesByHour,
+                                    LowStockProduct)
+from app.core.config import settings
+from app.core.money import from_minor, to_minor
+
+
+def hour_bucket(created_at: datetime) -> datetime:
+    """Start of the UTC hour of a timestamp, sqlite hands back naive timestamps which are UTC"""
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return created_at.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+class AnalyticsDBLayer:
+    """
+    Sales aggregates maintained incrementally: finished orders are folded into per product and per hour counters
+    in the transaction that marks their outbox events finished, so every order is counted once and dashboards
+    read a handful of precomputed rows instead of scanning orders.
+    """
+
+    async def aggregate_orders(self, db: AsyncSession, order_ids: List[int]):
+        """
+        Add orders to the sales aggregates and refresh the low stock watchlist for their products. Nothing is
+        committed here.
+        :param db:
+        :param order_ids: orders not aggregated yet
+        :return:
+        """
+        rows = (await db.execute(
+            select(Order.id, Order.created_at, Order.total_price, OrderItem.product_id, OrderItem.quantity)
+            .join(OrderItem, OrderItem.order_id == Order.id).filter(Order.id.in_(order_ids))
+        )).all()
+        if not rows:
+            return
+
+        products = defaultdict(lambda: {"units": 0, "orders": 0, "last_order_at": None})
+        hours = defaultdict(lambda: {"orders": 0, "units": 0, "revenue": 0})  # revenue in minor units
+        counted = set()
+        for row in rows:
+            product = products[row.product_id]
+            product["units"] += row.quantity
+            product["orders"] += 1
+            if product["last_order_at"] is None or row.created_at > product["last_order_at"]:
+                product["last_order_at"] = row.created_at
+            hour = hours[hour_bucket(row.created_at)]
+            hour["units"] += row.quantity
+            if row.id not in counted:
+                counted.add(row.id)
+                hour["orders"] += 1
+                hour["revenue"] += to_minor(row.total_price)
+
+        dialect_insert = postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+        # Rows are upserted in key order so that concurrent dispatchers lock them in the same order
+        query = dialect_insert(ProductSales).values([{"product_id": product_id, **products[product_id]}
+                                                     for product_id in sorted(products)])
+        await db.execute(query.on_conflict_do_update(index_elements=[ProductSales.product_id], set_={
+            "units": ProductSales.units + query.excluded.units,
+            "orders": ProductSales.orders + query.excluded.orders,
+            "last_order_at": case((ProductSales.last_order_at > query.excluded.last_order_at,
+                                   ProductSales.last_order_at), else_=query.excluded.last_order_at),
+        }))
+        query = dialect_insert(SalesByHour).values([{**hours[bucket], "bucket": bucket,
+                                                     "revenue": from_minor(hours[bucket]["revenue"])}
+                                                    for bucket in sorted(hours)])
+        await db.execute(query.on_conflict_do_update(index_elements=[SalesByHour.bucket], set_={
+            "orders": SalesByHour.orders + query.excluded.orders,
+            "units": SalesByHour.units + query.excluded.units,
+            "revenue": SalesByHour.revenue + query.excluded.revenue,
+        }))
+        await self.refresh_low_stock(db, list(products))
+
+    async def refresh_low_stock(self, db: AsyncSession, product_ids: List[int]):
+        """
+        Re-check the stock of the given products and of the products listed already, which drops restocked
+        products from the watchlist. Nothing is committed here.
+        :param db:
+        :param product_ids:
+        :return:
+        """
+        listed = set((await db.execute(select(LowStockProduct.product_id))).scalars())
+        rows = (await db.execute(select(Product.id, Product.name, product_stock().label("stock"))
+                                 .filter(Product.id.in_(listed | set(product_ids))).order_by(Product.id))).all()
+        low = [row for row in rows if row.stock <= settings.LOW_STOCK_THRESHOLD]
+        restocked = listed - {row.id for row in low}
+        if restocked:
+            await db.execute(delete(LowStockProduct).where(LowStockProduct.product_id.in_(restocked)))
+        if low:
+            dialect_insert = postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+            query = dialect_insert(LowStockProduct).values([{"product_id": row.id, "name": row.name,
+                                                            "stock": row.stock} for row in low])
+            await db.execute(query.on_conflict_do_update(index_elements=[LowStockProduct.product_id], set_={
+                "name": query.excluded.name, "stock": query.excluded.stock, "updated_at": func.now(),
+            }))
+
+    async def top_products(self, db: AsyncSession, limit):
+        """
+        Best selling products by units, read from the head of ix_product_sales_units
+        :param db:
+        :param limit:
+        :return: rows
+        """
+        result = await db.execute(
+            select(ProductSales.product_id, Product.name, ProductSales.units, ProductSales.orders,
+                   ProductSales.last_order_at)
+            .join(Product, Product.id == ProductSales.product_id)
+            .order_by(ProductSales.units.desc(), ProductSales.product_id.desc()).limit(limit)
+        )
+        return result.all()
+
+    async def sales_by_hour(self, db: AsyncSession, hours):
+        """
+        Hourly sales of the last hours, hours without orders are not stored
+        :param db:
+        :param hours:
+        :return: rows
+        """
+        since = hour_bucket(datetime.now(timezone.utc)) - timedelta(hours=hours - 1)
+        result = await db.execute(select(SalesByHour.bucket, SalesByHour.orders, SalesByHour.units,
+                                         SalesByHour.revenue)
+                                  .filter(SalesByHour.bucket >= since).order_by(SalesByHour.bucket))
+        return result.all()
+
+    async def low_stock(self, db: AsyncSession, limit):
+        """
+        Watchlist of low stock products, lowest stock first
+        :param db:
+        :param limit:
+        :return: rows
+        """
+        result = await db.execute(select(LowStockProduct.product_id, LowStockProduct.name, LowStockProduct.stock,
+                                         LowStockProduct.updated_at)
+                                  .order_by(LowStockProduct.stock, LowStockProduct.product_id).limit(limit))
+        return result.all()
@@ -0,0 +1,145 @@
+import asyncio
+import hashlib
+import json
+import math
+import secrets
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from app.api.v1.models.base import ApiKey, get_async_session_factory
+from app.core.config import settings, setup_logging
+
+logger = setup_logging(__name__)
+
+
+class ApiKeyRecord(NamedTuple):
+    name: str
+    key_hash: str
+    rate: float = 0.0  # requests per second, 0 is unlimited
+    burst: int = 0
+    expires_at: Optional[float] = None  # unix time
+
+
+def hash_api_key(key: str) -> str:
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def generate_api_key() -> str:
+    return secrets.token_urlsafe(32)
+
+
+def _timestamp(value) -> Optional[float]:
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.timestamp()
+
+
+class ApiKeyRegistry:
+    """
+    API keys by SHA-256 digest, held in memory and reloaded from their source every refresh_seconds, so that
+    lookups are served from memory while a reload runs. Presented keys are hashed before the lookup: the map only
+    ever compares digests, so response time does not tell a client how much of a valid key it guessed.
+    """
+
+    def __init__(self, source, path, refresh_seconds, default_key=None, default_rate=0.0, default_burst=0,
+                 session_factory: Optional[async_sessionmaker] = None):
+        """
+        :param source: settings, file or database
+        :param path: JSON file of the file source
+        :param refresh_seconds: seconds the loaded keys are served before the source is read again
+        :param default_key: accepted as key "default" with every source
+        :param default_rate: requests per second of keys without their own limit, 0 is unlimited
+        :param default_burst: bucket size of keys without their own, 0 allows one second of requests
+        :param session_factory: sessions of the database source, defaults to the app's
+        """
+        if source not in ("settings", "file", "database"):
+            raise ValueError(f"Unknown API key source: {source}")
+        self.source = source
+        self.path = Path(path)
+        self.refresh_seconds = refresh_seconds
+        self.default_key = default_key
+        self.default_rate = default_rate
+        self.default_burst = default_burst
+        self.session_factory = session_factory
+        self._keys: Dict[str, ApiKeyRecord] = {}
+        self._loaded_at: Optional[float] = None
+        self._refresh_task: Optional[asyncio.Future] = None
+
+    def _record(self, name, key_hash, rate=None, burst=None, expires_at=None) -> ApiKeyRecord:
+        rate = self.default_rate if rate is None else rate
+        burst = burst or self.default_burst or max(math.ceil(rate), 1)
+        return ApiKeyRecord(name, key_hash, rate, burst, expires_at)
+
+    async def refresh(self):
+        keys = {}
+        if self.default_key:
+            record = self._record("default", hash_api_key(self.default_key))
+            keys[record.key_hash] = record
+        try:
+            if self.source == "file":
+                keys.update(self._load_file())
+            elif self.source == "database":
+                keys.update(await self._load_database())
+        except Exception:
+            # The default key does not depend on the source, it is accepted even when the first load fails
+            self._keys = {**self._keys, **keys}
+            raise
+        self._keys = keys
+        self._loaded_at = time.monotonic()
+
+    def _load_file(self) -> Dict[str, ApiKeyRecord]:
+        """[{"name": .., "key_hash": <sha256 hex> or "key": <plain key>, "rate": .., "burst": .., "expires_at": ..}]"""
+        keys = {}
+        for entry in json.loads(self.path.read_text()):
+            key_hash = entry.get("key_hash") or hash_api_key(entry["key"])
+            keys[key_hash] = self._record(entry["name"], key_hash, entry.get("rate"), entry.get("burst"),
+                                          _timestamp(entry.get("expires_at")))
+        return keys
+
+    async def _load_database(self) -> Dict[str, ApiKeyRecord]:
+        async with (self.session_factory or get_async_session_factory())() as db:
+            rows = (await db.execute(select(ApiKey.name, ApiKey.key_hash, ApiKey.rate_limit, ApiKey.burst,
+                                            ApiKey.expires_at).where(ApiKey.status == "active"))).all()
+        return {row.key_hash: self._record(row.name, row.key_hash, row.rate_limit, row.burst,
+                                           _timestamp(row.expires_at)) for row in rows}
+
+    async def _refresh_in_background(self):
+        try:
+            await self.refresh()
+        except Exception as err:
+            # Keep serving the keys loaded last and try again after another refresh period
+            self._loaded_at = time.monotonic()
+            logger.error(f"API key refresh failed | source - {self.source} | {err}")
+        finally:
+            self._refresh_task = None
+
+    async def _refresh_if_stale(self):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.refresh_seconds:
+            return
+        task = self._refresh_task
+        started = task is None
+        if started:
+            task = self._refresh_task = asyncio.ensure_future(self._refresh_in_background())
+        # The request that started the reload waits for it, so do requests arriving before any keys were loaded;
+        # the others are served the current keys meanwhile. A cancelled request does not cancel the reload.
+        if started or self._loaded_at is None:
+            await asyncio.shield(task)
+
+    async def lookup(self, key: str) -> Optional[ApiKeyRecord]:
+        """Record of a presented key, None when it is unknown, revoked or expired"""
+        await self._refresh_if_stale()
+        record = self._keys.get(hash_api_key(key))
+        if record is None:
+            return None
+        if record.expires_at is not None and record.expires_at <= time.time():
+            return None
+        return record
+
+
+api_key_registry = ApiKeyRegistry(settings.API_KEYS_SOURCE, settings.API_KEYS_FILE, settings.API_KEYS_REFRESH_SECONDS,
+                                  settings.API_KEY, settings.API_RATE_LIMIT, settings.API_RATE_LIMIT_BURST)
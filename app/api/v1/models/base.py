@@ -1,15 +1,48 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, TIMESTAMP
-from sqlalchemy.sql import func
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
+from functools import lru_cache
+from sqlalchemy import Column, DDL, Integer, String, Float, ForeignKey, Index, Text, TIMESTAMP, event, select
+from sqlalchemy.sql import func, literal_column, text
+# Registers the typed full text functions (to_tsvector) before product_search_vector builds them
+import sqlalchemy.dialects.postgresql  # noqa: F401
+from sqlalchemy.orm import relationship, sessionmaker
+from sqlalchemy.ext.asyncio import async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
+from app.api.v1.models.database import build_engine, build_async_engine
 from app.core.config import settings
+from app.core.money import Money
 
-engine = create_engine(settings.DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
 
+# Engines connect on first use: importing the models opens no connection, the schema is managed by migrations
+@lru_cache(maxsize=None)
+def get_engine():
+    return build_engine(settings.DATABASE_URL)
+
+
+@lru_cache(maxsize=None)
+def get_async_engine():
+    return build_async_engine(settings.DATABASE_URL)
+
+
+@lru_cache(maxsize=None)
+def get_session_factory():
+    return sessionmaker(autocommit=False, autoflush=False, bind=get_engine())
+
+
+@lru_cache(maxsize=None)
+def get_async_session_factory():
+    """Session factory for streaming responses, which outlive the request scoped session of get_async_db"""
+    return async_sessionmaker(bind=get_async_engine(), autoflush=False, expire_on_commit=False)
+
+
+async def dispose_engines():
+    """Close the pools of the engines built so far"""
+    if get_async_engine.cache_info().currsize:
+        await get_async_engine().dispose()
+    if get_engine.cache_info().currsize:
+        get_engine().dispose()
+
+
 class BaseFields(Base):
     __abstract__ = True
     created_at = Column(TIMESTAMP(timezone=True),
@@ -19,35 +52,215 @@ class BaseFields(Base):
                         onupdate=func.current_timestamp())
 
 
+def trigram_enabled(*args, **kwargs):
+    return settings.SEARCH_TRIGRAM_ENABLED
+
+
+def _ts_vector(config, document):
+    return func.to_tsvector(literal_column(f"'{config}'::regconfig"), func.coalesce(document, literal_column("''")))
+
+
+def product_search_vector(name, description):
+    """
+    Full text document of a product: stemmed name (weight A) and description (weight B) for ranking, plus unstemmed
+    words so a partially typed last word can prefix match. The search query must use this exact expression to hit
+    the GIN index, constants are inlined so the planner can match it against parameterized statements.
+    """
+    return (
+        func.setweight(_ts_vector("english", name), literal_column("'A'"))
+        .op("||")(func.setweight(_ts_vector("english", description), literal_column("'B'")))
+        .op("||")(_ts_vector("simple", name))
+        .op("||")(_ts_vector("simple", description))
+    )
+
+
 class Product(BaseFields):
     __tablename__ = "products"
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    sku = Column(String, unique=True, nullable=True)  # supplier key used by bulk upserts
     name = Column(String, index=True)
     description = Column(String)
-    price = Column(Float)
+    category = Column(String)  # targeted by category sales
+    price = Column(Money)
     stock = Column(Integer)
 
+    __table_args__ = (
+        # Keyset pagination seeks on (sort key, id)
+        Index("ix_products_price_id", "price", "id"),
+        Index("ix_products_name_id", "name", "id"),
+        # Incremental exports scan products changed since a timestamp
+        Index("ix_products_updated_at_id", "updated_at", "id"),
+        # Product search: full text and trigram (prefix/typo) matching
+        Index("ix_products_search_vector", product_search_vector(name, description),
+              postgresql_using="gin").ddl_if(dialect="postgresql"),
+        Index("ix_products_name_trgm", "name", postgresql_using="gin",
+              postgresql_ops={"name": "gin_trgm_ops"}).ddl_if(dialect="postgresql", callable_=trigram_enabled),
+    )
+
+
+PRODUCT_SEARCH_VECTOR = product_search_vector(Product.name, Product.description)
+event.listen(Product.__table__, "before_create",
+             DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql",
+                                                                       callable_=trigram_enabled))
+
+
+class ProductStockShard(Base):
+    """Stock of a hot product split over counters, orders deduct from a random one instead of the product row"""
+    __tablename__ = "product_stock_shards"
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    shard = Column(Integer, primary_key=True)
+    stock = Column(Integer, nullable=False, default=0)
+
+
+def product_stock():
+    """
+    Available stock of a product as a column expression: the product row's counter, plus its shard counters
+    when stock sharding is on. Built per statement, STOCK_SHARDS may change while the app runs.
+    """
+    if not settings.STOCK_SHARDS:
+        return Product.stock
+    shards = (select(func.coalesce(func.sum(ProductStockShard.stock), 0))
+              .where(ProductStockShard.product_id == Product.id).scalar_subquery())
+    return Product.stock + shards
+
 
 class Order(BaseFields):
     __tablename__ = "orders"
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
-    total_price = Column(Float)
+    total_price = Column(Money)
     status = Column(String) # placed, completed
+    item_count = Column(Integer, nullable=False, server_default="0")  # order lines, summaries skip order_items
+    # Loaded explicitly with selectinload, a lazy load per order would be an N+1
+    items = relationship("OrderItem", lazy="raise", order_by="OrderItem.product_id")
+
+    __table_args__ = (
+        # Order listings seek on (created_at, id) newest first, optionally within a status. The summary columns
+        # are carried in the status index so that summary pages are answered from the index alone on Postgres.
+        Index("ix_orders_status_created_at_id", "status", "created_at", "id",
+              postgresql_include=["total_price", "item_count"]),
+        Index("ix_orders_created_at_id", "created_at", "id"),
+    )
 
 
 class OrderItem(Base):
     __tablename__ = "order_items"
-    order_id = Column(Integer, ForeignKey("orders.id"), primary_key=True, index=True)
+    order_id = Column(Integer, ForeignKey("orders.id"), primary_key=True)
     product_id = Column(Integer, ForeignKey("products.id"), primary_key=True, index=True)
     quantity = Column(Integer)
 
+    __table_args__ = (
+        # Items of a page of orders in one index-only range scan. The primary key already leads with order_id,
+        # sqlite keeps using it.
+        Index("ix_order_items_order_id_covering", "order_id", "product_id",
+              postgresql_include=["quantity"]).ddl_if(dialect="postgresql"),
+    )
+
+
+class OrderOutbox(Base):
+    """Events of placed orders, written in the order transaction and drained by the outbox dispatcher"""
+    __tablename__ = "order_outbox"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    order_id = Column(Integer, ForeignKey("orders.id"), nullable=False, index=True)
+    event = Column(String, nullable=False)  # order_placed
+    payload = Column(Text, nullable=False)
+    status = Column(String, nullable=False, default="pending")  # pending, done, dead
+    attempts = Column(Integer, nullable=False, default=0)
+    available_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())  # next attempt
+    last_error = Column(Text)
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
+    dispatched_at = Column(TIMESTAMP(timezone=True))
+
+    __table_args__ = (
+        # The dispatcher only ever scans pending events that are due
+        Index("ix_order_outbox_pending", "available_at", "id",
+              postgresql_where=text("status = 'pending'"), sqlite_where=text("status = 'pending'")),
+    )
+
+
+class ProductSales(Base):
+    """Units sold per product, folded in by the outbox dispatcher as order events are finished"""
+    __tablename__ = "product_sales"
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    units = Column(Integer, nullable=False, default=0)
+    orders = Column(Integer, nullable=False, default=0)
+    last_order_at = Column(TIMESTAMP(timezone=True))
+
+    __table_args__ = (
+        # Top sellers read the first rows of this index
+        Index("ix_product_sales_units", "units", "product_id"),
+    )
+
+
+class SalesByHour(Base):
+    """Orders, units and revenue per hour the orders were placed in"""
+    __tablename__ = "sales_by_hour"
+    bucket = Column(TIMESTAMP(timezone=True), primary_key=True)  # start of the hour, UTC
+    orders = Column(Integer, nullable=False, default=0)
+    units = Column(Integer, nullable=False, default=0)
+    revenue = Column(Money, nullable=False, default=0)
 
-Base.metadata.create_all(bind=engine)
+
+class LowStockProduct(Base):
+    """Watchlist of ordered products whose stock fell to LOW_STOCK_THRESHOLD or below"""
+    __tablename__ = "low_stock_products"
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    name = Column(String)
+    stock = Column(Integer, nullable=False)
+    updated_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
+
+
+class PricingRule(BaseFields):
+    """
+    Promotion applied to order lines by the pricing engine. Rules are not edited: a promotion is changed by
+    deactivating its rule and creating a new one, which keeps the rule set version a pair of counts.
+    """
+    __tablename__ = "pricing_rules"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String, nullable=False)
+    kind = Column(String, nullable=False)  # percent, fixed, buy_x_get_y
+    # Lines the rule applies to: one product, one category, or every line when both are null
+    product_id = Column(Integer, ForeignKey("products.id"))
+    category = Column(String)
+    percent = Column(Float)  # percent: share of the line amount taken off, 15 is 15%
+    amount = Column(Money)  # fixed: taken off each unit, at most the unit price
+    buy_quantity = Column(Integer)  # buy_x_get_y: of every buy + free units, free units cost nothing
+    free_quantity = Column(Integer)
+    starts_at = Column(TIMESTAMP(timezone=True))  # null starts at once
+    ends_at = Column(TIMESTAMP(timezone=True))  # null never ends
+    status = Column(String, nullable=False, default="active")  # active, inactive
+
+
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    key = Column(String, primary_key=True)
+    fingerprint = Column(String, nullable=False)  # hash of the request, a key cannot be reused for another request
+    status_code = Column(Integer)  # null while the first request is in flight
+    response = Column(Text)
+    expires_at = Column(TIMESTAMP(timezone=True), nullable=False, index=True)
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
+
+
+class ApiKey(Base):
+    """API keys issued to clients, only the SHA-256 digest of a key is stored"""
+    __tablename__ = "api_keys"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String, nullable=False)  # client or tenant the key was issued to
+    key_hash = Column(String, nullable=False, unique=True)
+    rate_limit = Column(Float)  # requests per second, null uses API_RATE_LIMIT
+    burst = Column(Integer)  # null uses API_RATE_LIMIT_BURST
+    status = Column(String, nullable=False, default="active")  # active, revoked
+    expires_at = Column(TIMESTAMP(timezone=True))
+    created_at = Column(TIMESTAMP(timezone=True), nullable=False, server_default=func.now())
 
 
 def get_db():
-    db = SessionLocal()
+    db = get_session_factory()()
     try:
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with get_async_session_factory()() as db:
+        yield db
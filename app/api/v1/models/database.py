@@ -1,20 +1,199 @@
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
+import time
+from typing import Dict
+from sqlalchemy import create_engine, event
+from sqlalchemy import exc as sa_exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 from app.core.config import settings
+from app.core.metrics import DB_QUERY_DURATION, registry
+from app.core.profiling import current_profile
 
-engine = create_engine(settings.DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
+# Async drivers used for each sync database backend
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
 
+# Engines built by this module, keyed by name, used to report live pool stats
+ENGINES = {}
 
-def create_schema():
-    Base.metadata.create_all(bind=engine)
 
+class PoolStats:
+    """Counters collected by an instrumented connection pool"""
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.waiting = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def record_wait(self, elapsed):
+        self.checkouts += 1
+        self.wait_time_total += elapsed
+        if elapsed > self.wait_time_max:
+            self.wait_time_max = elapsed
+
+    def as_dict(self):
+        return {
+            "checkouts": self.checkouts,
+            "timeouts": self.timeouts,
+            "waiting": self.waiting,
+            "wait_time_total": round(self.wait_time_total, 6),
+            "wait_time_avg": round(self.wait_time_total / self.checkouts, 6) if self.checkouts else 0.0,
+            "wait_time_max": round(self.wait_time_max, 6),
+        }
+
+
+class InstrumentedPoolMixin:
+    """Time every checkout of a queue pool, including time spent waiting for a free connection"""
+    stats: PoolStats
+
+    def _do_get(self):
+        self.stats.waiting += 1
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except sa_exc.TimeoutError:
+            self.stats.timeouts += 1
+            raise
+        finally:
+            self.stats.waiting -= 1
+            self.stats.record_wait(time.perf_counter() - start)
+
+
+def instrumented_pool_class(pool_class, stats: PoolStats):
+    """
+    Build a pool class bound to its stats, pool.recreate() reuses the class so the counters survive dispose()
+    :param pool_class:
+    :param stats:
+    :return: pool class
+    """
+    return type(f"Instrumented{pool_class.__name__}", (InstrumentedPoolMixin, pool_class), {"stats": stats})
+
+
+def statement_operation(statement: str) -> str:
+    operation = statement.lstrip()[:6].upper()
+    return operation if operation in ("SELECT", "INSERT", "UPDATE", "DELETE") else "OTHER"
+
+
+def instrument_queries(engine, name):
+    """
+    Time every statement sent over a sync engine (or the sync_engine of an async one) into the query histogram,
+    and into the SQL profile of the current request when profiling is on
+    :param engine:
+    :param name: engine label of the samples
+    """
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context._query_started_at = time.perf_counter()
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._query_started_at
+        DB_QUERY_DURATION.labels(name, statement_operation(statement)).observe(elapsed)
+        profile = current_profile.get()
+        if profile is not None:
+            profile.record(statement, elapsed, conn, parameters, executemany)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+
+def to_async_database_url(database_url):
+    """
+    Convert a sync database url into its async driver equivalent
+    :param database_url:
+    :return: url
+    """
+    url = make_url(database_url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername))
+
+
+def pool_options(url):
+    """
+    Pool parameters from settings, in-memory sqlite keeps its single connection pool
+    :param url:
+    :return: dict
+    """
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return {}
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+
+
+def build_engine(database_url, name="sync"):
+    """
+    Create a sync engine with the configured, instrumented pool
+    :param database_url:
+    :param name: key under which pool stats are reported
+    :return: engine
+    """
+    url = make_url(database_url)
+    options = pool_options(url)
+    if options:
+        options["poolclass"] = instrumented_pool_class(QueuePool, PoolStats())
+    engine = create_engine(url, **options)
+    instrument_queries(engine, name)
+    ENGINES[name] = engine
+    return engine
+
+
+def build_async_engine(database_url, name="async"):
+    """
+    Create an async engine with the configured, instrumented pool
+    :param database_url:
+    :param name: key under which pool stats are reported
+    :return: async engine
+    """
+    url = to_async_database_url(database_url)
+    options = pool_options(url)
+    if options:
+        options["poolclass"] = instrumented_pool_class(AsyncAdaptedQueuePool, PoolStats())
+    engine = create_async_engine(url, **options)
+    instrument_queries(engine.sync_engine, name)
+    ENGINES[name] = engine.sync_engine
+    return engine
+
+
+def get_pool_stats() -> Dict:
+    """
+    Live pool stats of every engine built by the factory
+    :return: dict
+    """
+    pools = {}
+    for name, engine in ENGINES.items():
+        pool = engine.pool
+        if not isinstance(pool, InstrumentedPoolMixin):
+            pools[name] = {"pool": pool.status()}
+            continue
+        pools[name] = {
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": max(pool.overflow(), 0),
+            "max_overflow": pool._max_overflow,
+            **pool.stats.as_dict(),
+        }
+    return pools
+
+
+def _pool_metric(*fields):
+    """Scrape time reader of pool stats, one sample per engine and field"""
+    def collect():
+        return {(name, field): stats[field] for name, stats in get_pool_stats().items()
+                for field in fields if field in stats}
+    return collect
+
+
+registry.callback("db_pool_connections", "Connections of each pool by state", ("engine", "state"),
+                  _pool_metric("checked_in", "checked_out", "overflow", "waiting"))
+registry.callback("db_pool_checkouts_total", "Connection checkouts and checkout timeouts", ("engine", "result"),
+                  _pool_metric("checkouts", "timeouts"), type="counter")
+registry.callback("db_pool_wait_seconds_total", "Time spent waiting for a connection", ("engine",),
+                  lambda: {(name,): stats["wait_time_total"] for name, stats in get_pool_stats().items()
+                           if "wait_time_total" in stats}, type="counter")
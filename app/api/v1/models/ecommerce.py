@@ -1,23 +1,72 @@
+import json
+import random
 import traceback
-from typing import Dict
-from sqlalchemy.orm import Session
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List
+from sqlalchemy import case, delete, func, insert, select, text, tuple_, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased, selectinload
 from sqlalchemy.exc import SQLAlchemyError
-from app.api.v1.models.base import Product, Order, OrderItem, Base
+from app.api.v1.models.analytics import AnalyticsDBLayer
+from app.api.v1.models.base import Product, ProductStockShard, Order, OrderItem, OrderOutbox, Base
 from app.api.v1.schemas.ecommerce import ProductCreate, OrderCreate
+from app.core.config import settings
 from app.core.exception import CustomHTTPException
+from app.core.money import basis_points, from_minor, order_totals, to_decimal, to_minor
+
+
+# Product columns written by bulk imports
+PRODUCT_IMPORT_COLUMNS = ("sku", "name", "description", "price", "stock", "category")
+# Import columns an existing product keeps when the imported row leaves them out
+OPTIONAL_IMPORT_COLUMNS = ("category",)
+UPSERT_BATCH_ROWS = 1000
+# Order listing columns answered without order_items, covered by ix_orders_status_created_at_id on Postgres
+ORDER_SUMMARY_COLUMNS = (Order.id, Order.total_price, Order.status, Order.item_count, Order.created_at)
 
 
 class EcommerceDBLayer:
-    def get_all(self, db: Session, model: Base, skip, limit):
+    analytics = AnalyticsDBLayer()
+
+    async def get_all(self, db: AsyncSession, model: Base, skip, limit, order_by=None, columns=None):
         """
         Get all objects from Model
         :param db:
         :param model:
+        :param order_by: sort column, id is always used as tie breaker for a stable order
+        :param columns: load these columns as plain rows instead of model objects
+        :return:
+        """
+        order = [model.id] if order_by is None or order_by is model.id else [order_by, model.id]
+        result = await db.execute(self._select(model, columns).order_by(*order).offset(skip).limit(limit))
+        return result.all() if columns else result.scalars().all()
+
+    async def get_page_after(self, db: AsyncSession, model: Base, order_by, key, last_id, limit, columns=None):
+        """
+        Keyset page: rows strictly after (key, last_id) in (order_by, id) order, served by an index seek
+        :param db:
+        :param model:
+        :param order_by: sort column
+        :param key: sort column value of the last row of the previous page
+        :param last_id: id of the last row of the previous page
+        :param limit:
+        :param columns: load these columns as plain rows instead of model objects
         :return:
         """
-        return db.query(model).offset(skip).limit(limit).all()
+        query = self._select(model, columns)
+        if order_by is model.id:
+            query = query.filter(model.id > last_id).order_by(model.id)
+        else:
+            query = query.filter(tuple_(order_by, model.id) > tuple_(key, last_id)).order_by(order_by, model.id)
+        result = await db.execute(query.limit(limit))
+        return result.all() if columns else result.scalars().all()
 
-    def get_item_from_model(self, db: Session, model: Base, item_id):
+    @staticmethod
+    def _select(model: Base, columns=None):
+        return select(*columns) if columns else select(model)
+
+    async def get_item_from_model(self, db: AsyncSession, model: Base, item_id):
         """
         Get item from model by id
         :param db:
@@ -25,9 +74,10 @@ class EcommerceDBLayer:
         :param model:
         :return:
         """
-        return db.query(model).filter(model.id == item_id).first()
+        result = await db.execute(select(model).filter(model.id == item_id))
+        return result.scalars().first()
 
-    def filter_by_item_ids(self, db: Session, model: Base, item_ids):
+    async def filter_by_item_ids(self, db: AsyncSession, model: Base, item_ids):
         """
         Filter expression to get items by list of ids
         :param db:
@@ -35,9 +85,167 @@ class EcommerceDBLayer:
         :param item_ids:
         :return:
         """
-        return db.query(model).filter(model.id.in_(item_ids)).all()
+        result = await db.execute(select(model).filter(model.id.in_(item_ids)))
+        return result.scalars().all()
+
+    async def filter_columns_by_item_ids(self, db: AsyncSession, model: Base, columns, item_ids):
+        """
+        Load only the given columns for a list of ids
+        :param db:
+        :param model:
+        :param columns:
+        :param item_ids:
+        :return: row mappings
+        """
+        result = await db.execute(select(*columns).filter(model.id.in_(item_ids)))
+        return result.mappings().all()
+
+    async def reserve_stock(self, db: AsyncSession, quantities: Dict[int, int]):
+        """
+        Atomically deduct stock for every product in one conditional UPDATE ... RETURNING.
+        A row is only updated if it still holds enough stock, so concurrent orders cannot oversell,
+        and the caller compares the returned ids with the requested ones. Nothing is committed here.
+        With stock sharding on, products the product row could not serve are deducted from their shard counters.
+        :param db:
+        :param quantities: requested quantity by product id
+        :return: {product id: remaining stock} of the reserved products, of the shard for sharded products
+        """
+        quantity = case(quantities, value=Product.id)
+        if len(quantities) > 1 and db.bind.dialect.name == "postgresql":
+            # The UPDATE locks rows in scan order, orders sharing products could lock them in opposite orders and
+            # deadlock. Taking the locks in id order first makes every order wait at its first common product.
+            await db.execute(select(Product.id).where(Product.id.in_(quantities)).order_by(Product.id)
+                             .with_for_update())
+        result = await db.execute(
+            update(Product)
+            .where(Product.id.in_(quantities), Product.stock >= quantity)
+            .values(stock=Product.stock - quantity)
+            .returning(Product.id, Product.stock)
+            .execution_options(synchronize_session=False)
+        )
+        reserved = {row.id: row.stock for row in result}
+        if settings.STOCK_SHARDS:
+            for product_id in sorted(set(quantities) - set(reserved)):
+                remaining = await self._reserve_shard(db, product_id, quantities[product_id])
+                if remaining is not None:
+                    reserved[product_id] = remaining
+        return reserved
+
+    async def _reserve_shard(self, db: AsyncSession, product_id, quantity):
+        """
+        Deduct from one shard, probed from a random offset, so that concurrent orders of a hot product lock
+        different rows. Postgres skips shards locked by other orders instead of waiting for them: a blocked
+        conditional UPDATE would keep the row locked even when it matches nothing, and deadlock with the pooling
+        below. When no free shard holds enough stock, the stock of all shards is pooled and spread evenly again.
+        :return: remaining stock, None when the product has no shards or not enough stock
+        """
+        offset = random.randrange(settings.STOCK_SHARDS)
+        shard = (select(ProductStockShard.shard)
+                 .where(ProductStockShard.product_id == product_id, ProductStockShard.stock >= quantity)
+                 .order_by((ProductStockShard.shard + offset) % settings.STOCK_SHARDS)
+                 .limit(1))
+        if db.bind.dialect.name == "postgresql":
+            shard = shard.with_for_update(skip_locked=True)
+        result = await db.execute(
+            update(ProductStockShard)
+            .where(ProductStockShard.product_id == product_id, ProductStockShard.shard == shard.scalar_subquery())
+            .values(stock=ProductStockShard.stock - quantity)
+            .returning(ProductStockShard.stock)
+            .execution_options(synchronize_session=False)
+        )
+        remaining = result.scalar()
+        if remaining is not None:
+            await self._touch_product(db, product_id)
+            return remaining
+
+        shards = (await db.execute(
+            select(ProductStockShard.shard, ProductStockShard.stock)
+            .where(ProductStockShard.product_id == product_id)
+            .order_by(ProductStockShard.shard)
+            .with_for_update()
+        )).all()
+        remaining = sum(shard.stock for shard in shards) - quantity
+        if not shards or remaining < 0:
+            return None
+        spread = self._spread(remaining, len(shards))
+        await db.execute(
+            update(ProductStockShard)
+            .where(ProductStockShard.product_id == product_id)
+            .values(stock=case({shard.shard: stock for shard, stock in zip(shards, spread)},
+                               value=ProductStockShard.shard))
+            .execution_options(synchronize_session=False)
+        )
+        await self._touch_product(db, product_id)
+        return remaining
+
+    async def _touch_product(self, db: AsyncSession, product_id):
+        """
+        Move updated_at of a product whose shard stock changed, so that exports since a timestamp pick it up.
+        Postgres leaves the product alone while another order holds its row: that order is touching it as well,
+        and waiting for it would make the product row the hot spot the shards are there to avoid.
+        """
+        product = select(Product.id).where(Product.id == product_id)
+        if db.bind.dialect.name == "postgresql":
+            product = product.with_for_update(skip_locked=True)
+        await db.execute(
+            update(Product)
+            .where(Product.id == product.scalar_subquery())
+            .values(updated_at=func.now())
+            .execution_options(synchronize_session=False)
+        )
+
+    @staticmethod
+    def _spread(stock, shards):
+        return [stock // shards + (1 if index < stock % shards else 0) for index in range(shards)]
+
+    async def shard_stock(self, db: AsyncSession, product_id, shards):
+        """
+        Move the whole stock of a product into `shards` even counters, or back into the product row when 0
+        :param db:
+        :param product_id:
+        :param shards: number of shards, 0 merges
+        :return: (total stock, stock per shard), None when the product does not exist
+        """
+        product = (await db.execute(select(Product).filter(Product.id == product_id).with_for_update())).scalar()
+        if product is None:
+            return None
+        sharded = (await db.execute(
+            select(ProductStockShard.stock)
+            .where(ProductStockShard.product_id == product_id)
+            .order_by(ProductStockShard.shard)
+            .with_for_update()
+        )).scalars().all()
+        stock = product.stock + sum(sharded)
+        await db.execute(delete(ProductStockShard).where(ProductStockShard.product_id == product_id))
+        spread = self._spread(stock, shards) if shards else []
+        if shards:
+            await db.execute(insert(ProductStockShard), [{"product_id": product_id, "shard": index, "stock": value}
+                                                         for index, value in enumerate(spread)])
+        product.stock = 0 if shards else stock
+        product.updated_at = func.now()
+        await db.commit()
+        return stock, spread
+
+    async def stream_products(self, db: AsyncSession, columns, since=None, batch_size=1000):
+        """
+        Read products through a server-side cursor, yielding batches of rows so memory stays constant.
+        Ordered by id, or by (updated_at, id) for incremental reads of products changed after `since`.
+        :param db:
+        :param columns:
+        :param since: only products updated strictly after this timestamp
+        :param batch_size: rows fetched per round trip
+        :return: async iterator of row batches
+        """
+        query = select(*columns)
+        if since is not None:
+            query = query.filter(Product.updated_at > since).order_by(Product.updated_at, Product.id)
+        else:
+            query = query.order_by(Product.id)
+        result = await db.stream(query.execution_options(yield_per=batch_size))
+        async for rows in result.partitions():
+            yield rows
 
-    def add(self, db: Session, model_obj: Base):
+    async def add(self, db: AsyncSession, model_obj: Base):
         """
         Add model object
         :param db:
@@ -45,11 +253,11 @@ class EcommerceDBLayer:
         :return:
         """
         db.add(model_obj)
-        db.commit()
-        db.refresh(model_obj)
+        await db.commit()
+        await db.refresh(model_obj)
         return model_obj
 
-    def create_product(self, db: Session, product: ProductCreate):
+    async def create_product(self, db: AsyncSession, product: ProductCreate):
         """
         Add new product
         :param db:
@@ -57,42 +265,278 @@ class EcommerceDBLayer:
         :return: dict
         """
         product = Product(**product.dict())
-        return self.add(db, product)
+        return await self.add(db, product)
 
-    def create_order(self, db: Session, order_data: OrderCreate, products: Dict):
+    async def upsert_products(self, db: AsyncSession, rows: List[Dict]):
         """
-        Create order
+        Insert products in one multi-row statement, rows with a known sku update the existing product
+        (INSERT ... ON CONFLICT (sku) DO UPDATE). Skus must be unique within rows. Nothing is committed here.
+        :param db:
+        :param rows: product column values, rows may leave out OPTIONAL_IMPORT_COLUMNS
+        :return: ids of the inserted or updated products
+        """
+        dialect_insert = postgresql.insert if db.bind.dialect.name == "postgresql" else sqlite.insert
+        stock = {}
+        # Rows of one statement share their columns, an update only sets the columns its row gave
+        groups = defaultdict(list)
+        for row in rows:
+            groups[tuple(column for column in PRODUCT_IMPORT_COLUMNS if column in row)].append(row)
+        for columns, group in groups.items():
+            # Bounded statement size keeps bind parameters under the driver limits
+            for start in range(0, len(group), UPSERT_BATCH_ROWS):
+                query = dialect_insert(Product).values(group[start:start + UPSERT_BATCH_ROWS])
+                query = query.on_conflict_do_update(
+                    index_elements=[Product.sku],
+                    set_={column: query.excluded[column] for column in columns if column != "sku"}
+                    | {"updated_at": func.now()},
+                )
+                result = await db.execute(query.returning(Product.id, Product.stock))
+                stock.update(result.tuples().all())
+        await self._spread_imported_stock(db, stock)
+        return list(stock)
+
+    async def _spread_imported_stock(self, db: AsyncSession, stock: Dict[int, int]):
+        """
+        Imported stock of products with stock shards replaces the stock of their shards: it is spread over the
+        shards again and the product row's counter is emptied, so the stock is not counted twice
+        :param db:
+        :param stock: imported stock by product id
+        """
+        if not stock:
+            return
+        shard_counts = dict((await db.execute(
+            select(ProductStockShard.product_id, func.count())
+            .where(ProductStockShard.product_id.in_(stock))
+            .group_by(ProductStockShard.product_id)
+        )).tuples().all())
+        if not shard_counts:
+            return
+        sharded = sorted(shard_counts)
+        await db.execute(delete(ProductStockShard).where(ProductStockShard.product_id.in_(sharded)))
+        await db.execute(insert(ProductStockShard), [
+            {"product_id": product_id, "shard": index, "stock": value}
+            for product_id in sharded
+            for index, value in enumerate(self._spread(stock[product_id], shard_counts[product_id]))
+        ])
+        await db.execute(update(Product).where(Product.id.in_(sharded)).values(stock=0)
+                         .execution_options(synchronize_session=False))
+
+    async def copy_products(self, db: AsyncSession, rows: List[Dict]):
+        """
+        Postgres (asyncpg) bulk load: COPY rows into a temporary staging table, then upsert them into products
+        with an INSERT ... SELECT ... ON CONFLICT per set of given columns. Falls back to upsert_products on other
+        drivers.
+        :param db:
+        :param rows: product column values, skus must be unique within rows, rows may leave out
+            OPTIONAL_IMPORT_COLUMNS
+        :return: ids of the inserted or updated products
+        """
+        if db.bind.dialect.driver != "asyncpg":
+            return await self.upsert_products(db, rows)
+
+        await db.execute(text(
+            "CREATE TEMP TABLE IF NOT EXISTS product_import_staging "
+            "(sku text, name text, description text, price numeric(12, 2), stock integer, category text, "
+            "optional_given boolean) ON COMMIT DELETE ROWS"
+        ))
+        optional_given = [all(column in row for column in OPTIONAL_IMPORT_COLUMNS) for row in rows]
+        connection = await (await db.connection()).get_raw_connection()
+        await connection.driver_connection.copy_records_to_table(
+            "product_import_staging", columns=list(PRODUCT_IMPORT_COLUMNS) + ["optional_given"],
+            records=[tuple(to_decimal(row[column]) if column == "price" and row[column] is not None
+                           else row.get(column) for column in PRODUCT_IMPORT_COLUMNS) + (given,)
+                     for row, given in zip(rows, optional_given)],
+        )
+        stock = {}
+        for group in set(optional_given):
+            given = [column for column in PRODUCT_IMPORT_COLUMNS if group or column not in OPTIONAL_IMPORT_COLUMNS]
+            columns = ", ".join(given)
+            updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in given if column != "sku")
+            result = await db.execute(text(
+                f"INSERT INTO products ({columns}) SELECT {columns} FROM product_import_staging "
+                f"WHERE optional_given = :optional_given "
+                f"ON CONFLICT (sku) DO UPDATE SET {updates}, updated_at = now() RETURNING id, stock"
+            ), {"optional_given": group})
+            stock.update(result.tuples().all())
+        await self._spread_imported_stock(db, stock)
+        return list(stock)
+
+    async def create_order(self, db: AsyncSession, order_data: OrderCreate, products: Dict, before_commit=None,
+                           discounts: Dict[int, int] = None):
+        """
+        Create order and its items and commit them, together with the stock reserved earlier, in one transaction
         :param db:
         :param order_data:
+        :param products: catalog fields by product id
+        :param before_commit: async callable receiving the order list, its writes are part of the order transaction
+        :param discounts: discount of each line in minor units by product id
         :return: order obj
         """
-        try:
-            total_price = 0.0
-            order_items = []
+        orders = await self.create_orders(db, [order_data], products, before_commit,
+                                          [discounts] if discounts is not None else None)
+        return orders[0]
 
-            for item in order_data.products:
-                product = products[item.product_id]
-
-                # Calculate total price
-                total_price += product.price * item.quantity
-                product.stock -= item.quantity  # Deduct stock
+    async def create_orders(self, db: AsyncSession, orders_data: List[OrderCreate], products: Dict,
+                            before_commit=None, discounts: List[Dict[int, int]] = None):
+        """
+        Create orders and their items and commit them, together with the stock reserved earlier, in one transaction.
+        Order ids come back from INSERT ... RETURNING and all items are written in one multi-row INSERT,
+        so orders are never re-read.
+        :param db:
+        :param orders_data:
+        :param products: catalog fields by product id
+        :param before_commit: async callable receiving the order list, its writes are part of the order transaction
+        :param discounts: per order, discount of each line in minor units by product id, from the pricing engine
+        :return: order objs in the order of orders_data
+        """
+        try:
+            # Totals of all orders in one pass over their lines in minor units, stock has already been reserved
+            # in this transaction
+            unit_prices = {product_id: to_minor(product["price"]) for product_id, product in products.items()}
+            prices, quantities, line_discounts, offsets = [], [], [], []
+            for index, order_data in enumerate(orders_data):
+                offsets.append(len(prices))
+                order_discounts = discounts[index] if discounts is not None else {}
+                for item in order_data.products:
+                    prices.append(unit_prices[item.product_id])
+                    quantities.append(item.quantity)
+                    line_discounts.append(order_discounts.get(item.product_id, 0))
+            totals = order_totals(prices, quantities, offsets, line_discounts if discounts is not None else None,
+                                  tax_basis_points=basis_points(settings.ORDER_TAX_RATE))
+            total_prices = [from_minor(total) for total in totals]
 
-            # Step 1: Create Order
-            order_obj = Order(total_price=total_price, status="placed")  # Remove `products` argument
-            order = self.add(db, order_obj)
+            # Step 1: Create Orders
+            result = await db.execute(insert(Order).returning(Order.id, sort_by_parameter_order=True),
+                                      [{"total_price": total_price, "status": "placed",
+                                        "item_count": len(order_data.products)}
+                                       for total_price, order_data in zip(total_prices, orders_data)])
+            order_ids = list(result.scalars())
 
             # Step 2: Create Order Items
-            for item in order_data.products:
-                order_items.append(OrderItem(order_id=order.id, product_id=item.product_id, quantity=item.quantity))
+            await db.execute(insert(OrderItem), [
+                {"order_id": order_id, "product_id": item.product_id, "quantity": item.quantity}
+                for order_id, order_data in zip(order_ids, orders_data)
+                for item in order_data.products
+            ])
 
-            db.bulk_save_objects(order_items)
-            db.commit()
-            db.refresh(order)
+            # Step 3: Queue post-processing, the dispatcher sees the event only once the order is committed
+            await db.execute(insert(OrderOutbox), [
+                {"order_id": order_id, "event": "order_placed", "status": "pending", "attempts": 0,
+                 "payload": json.dumps({"order_id": order_id, "total_price": total_price,
+                                        "products": [item.dict() for item in order_data.products]})}
+                for order_id, total_price, order_data in zip(order_ids, total_prices, orders_data)
+            ])
+            orders = [Order(id=order_id, total_price=total_price, status="placed",
+                            item_count=len(order_data.products))
+                      for order_id, total_price, order_data in zip(order_ids, total_prices, orders_data)]
+            if before_commit is not None:
+                await before_commit(orders)
+            await db.commit()
 
-            return order
+            return orders
 
         except SQLAlchemyError as e:
-            db.rollback()
+            await db.rollback()
             traceback.print_exc()
             raise CustomHTTPException(status_code=500, detail="An error occurred while processing the order",
                                       errors=str(e))
+
+    async def get_order(self, db: AsyncSession, order_id):
+        """
+        Get an order with its items, loaded by a second IN query instead of a lazy load
+        :param db:
+        :param order_id:
+        :return: order obj or None
+        """
+        result = await db.execute(select(Order).options(selectinload(Order.items)).filter(Order.id == order_id))
+        return result.scalars().first()
+
+    async def get_orders(self, db: AsyncSession, limit, status=None, created_after=None, created_before=None,
+                         after_id=None, with_items=True):
+        """
+        Keyset page of orders, newest first, served by a seek on (status, created_at, id) or (created_at, id)
+        :param db:
+        :param limit:
+        :param status: only orders in this status
+        :param created_after: only orders created at or after this time
+        :param created_before: only orders created before this time
+        :param after_id: id of the last order of the previous page
+        :param with_items: load the items of the page with one IN query, otherwise only the summary columns
+        :return: order objs, or summary rows without items
+        """
+        query = select(Order).options(selectinload(Order.items)) if with_items else select(*ORDER_SUMMARY_COLUMNS)
+        if status is not None:
+            query = query.filter(Order.status == status)
+        if created_after is not None:
+            query = query.filter(Order.created_at >= created_after)
+        if created_before is not None:
+            query = query.filter(Order.created_at < created_before)
+        if after_id is not None:
+            # The position is read back from the last order instead of carrying its timestamp in the cursor, so
+            # the seek compares stored values only (sqlite stores timestamps as text in more than one format)
+            last = aliased(Order)
+            position = select(last.created_at, last.id).filter(last.id == after_id).scalar_subquery()
+            query = query.filter(tuple_(Order.created_at, Order.id) < position)
+        result = await db.execute(query.order_by(Order.created_at.desc(), Order.id.desc()).limit(limit))
+        return result.scalars().all() if with_items else result.all()
+
+    async def claim_outbox_events(self, db: AsyncSession, limit, lease_seconds):
+        """
+        Claim due outbox events: they are hidden from other dispatchers for lease_seconds, so an event whose
+        dispatcher died is retried once its lease expires. Postgres skips rows locked by a concurrent claim.
+        :param db:
+        :param limit:
+        :param lease_seconds:
+        :return: list of event rows
+        """
+        now = datetime.now(timezone.utc)
+        query = (select(OrderOutbox.id, OrderOutbox.order_id, OrderOutbox.event, OrderOutbox.payload,
+                        OrderOutbox.attempts)
+                 .filter(OrderOutbox.status == "pending", OrderOutbox.available_at <= now)
+                 .order_by(OrderOutbox.available_at, OrderOutbox.id).limit(limit))
+        if db.bind.dialect.name == "postgresql":
+            query = query.with_for_update(skip_locked=True)
+        rows = (await db.execute(query)).all()
+        if rows:
+            await db.execute(update(OrderOutbox).where(OrderOutbox.id.in_([row.id for row in rows]))
+                             .values(attempts=OrderOutbox.attempts + 1,
+                                     available_at=now + timedelta(seconds=lease_seconds))
+                             .execution_options(synchronize_session=False))
+        await db.commit()
+        return rows
+
+    async def finish_outbox_events(self, db: AsyncSession, done: Dict[int, int], failed: Dict[int, tuple]):
+        """
+        Record dispatch results in one transaction, orders whose events were dispatched are completed and orders
+        whose events are finished (done or dead) are added to the sales analytics
+        :param db:
+        :param done: order id by event id
+        :param failed: (error, retry time or None to give up) by event id
+        :return:
+        """
+        now = datetime.now(timezone.utc)
+        # Orders whose event is finished by this call, an event finished already by a dispatcher that re-claimed
+        # it after its lease expired is not pending anymore and is skipped
+        finished = []
+        if done:
+            result = await db.execute(update(OrderOutbox)
+                                      .where(OrderOutbox.id.in_(list(done)), OrderOutbox.status == "pending")
+                                      .values(status="done", dispatched_at=now, last_error=None)
+                                      .returning(OrderOutbox.order_id)
+                                      .execution_options(synchronize_session=False))
+            finished += result.scalars()
+            await db.execute(update(Order).where(Order.id.in_(list(done.values())))
+                             .values(status="completed").execution_options(synchronize_session=False))
+        for event_id, (error, retry_at) in failed.items():
+            values = {"last_error": error}
+            values.update({"available_at": retry_at} if retry_at is not None else {"status": "dead"})
+            result = await db.execute(update(OrderOutbox)
+                                      .where(OrderOutbox.id == event_id, OrderOutbox.status == "pending")
+                                      .values(**values).returning(OrderOutbox.order_id)
+                                      .execution_options(synchronize_session=False))
+            if retry_at is None:
+                finished += result.scalars()
+        if settings.ANALYTICS_ENABLED and finished:
+            # The sales counters move in the same transaction as the events, each order is counted exactly once
+            await self.analytics.aggregate_orders(db, finished)
+        await db.commit()
@@ -0,0 +1,214 @@
+import asyncio
+import hashlib
+import json
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta, timezone
+from typing import Dict, NamedTuple, Optional
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.api.v1.models.base import IdempotencyKey
+from app.core.config import settings
+from app.core.exception import CustomHTTPException
+
+
+class IdempotencyRecord(NamedTuple):
+    fingerprint: str
+    status_code: Optional[int] = None  # None while the first request is in flight
+    body: Optional[Dict] = None
+
+    @property
+    def completed(self):
+        return self.status_code is not None
+
+
+def fingerprint(payload) -> str:
+    """Stable hash of a JSON serializable request"""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+class IdempotencyStore(ABC):
+    """Responses by idempotency key, a key is claimed by the first request and completed with its response"""
+
+    @abstractmethod
+    async def claim(self, db: AsyncSession, key, fingerprint, lock_ttl) -> Optional[IdempotencyRecord]:
+        """
+        Claim a key for a new request
+        :return: None when the key was claimed, else the record of the request holding it
+        """
+
+    @abstractmethod
+    async def complete(self, db: AsyncSession, key, status_code, body, ttl):
+        """Store the response of a claimed key, the database store writes it in the caller's transaction"""
+
+    @abstractmethod
+    async def release(self, db: AsyncSession, key):
+        """Drop a claimed key so that the request can be retried"""
+
+
+class MemoryIdempotencyStore(IdempotencyStore):
+    """In-process store, only deduplicates requests served by the same worker"""
+
+    PURGE_INTERVAL = 1.0
+
+    def __init__(self):
+        self._records: Dict[str, tuple] = {}  # key -> (expires_at, record)
+        self._purged_at = time.monotonic()
+
+    def _purge(self, now):
+        if now - self._purged_at < self.PURGE_INTERVAL:
+            return
+        self._purged_at = now
+        for key in [key for key, (expires_at, _) in self._records.items() if expires_at <= now]:
+            del self._records[key]
+
+    async def claim(self, db, key, fingerprint, lock_ttl):
+        now = time.monotonic()
+        self._purge(now)
+        expires_at, record = self._records.get(key, (0, None))
+        if record is not None and expires_at > now:
+            return record
+        self._records[key] = (now + lock_ttl, IdempotencyRecord(fingerprint))
+        return None
+
+    async def complete(self, db, key, status_code, body, ttl):
+        _, record = self._records.get(key, (0, None))
+        if record is None:
+            return  # the lock expired and was purged, a retry runs the request again
+        self._records[key] = (time.monotonic() + ttl, IdempotencyRecord(record.fingerprint, status_code, body))
+
+    async def release(self, db, key):
+        self._records.pop(key, None)
+
+
+class DatabaseIdempotencyStore(IdempotencyStore):
+    """Store backed by the idempotency_keys table, the primary key makes claims atomic across workers"""
+
+    PURGE_INTERVAL = 60.0
+
+    def __init__(self):
+        self._purged_at = 0.0
+
+    async def _purge(self, db: AsyncSession, now):
+        """Delete every expired key in a session of its own, the caller's transaction is left alone"""
+        async with AsyncSession(db.bind) as purge_db, purge_db.begin():
+            await purge_db.execute(delete(IdempotencyKey).where(IdempotencyKey.expires_at < now))
+
+    async def claim(self, db, key, fingerprint, lock_ttl):
+        now = datetime.now(timezone.utc)
+        if time.monotonic() - self._purged_at > self.PURGE_INTERVAL:
+            self._purged_at = time.monotonic()
+            await self._purge(db, now)
+        else:
+            # Expired responses and locks of dead requests are taken over
+            await db.execute(delete(IdempotencyKey).where(IdempotencyKey.key == key, IdempotencyKey.expires_at < now))
+        try:
+            await db.execute(insert(IdempotencyKey).values(key=key, fingerprint=fingerprint,
+                                                           expires_at=now + timedelta(seconds=lock_ttl)))
+            await db.commit()
+            return None
+        except IntegrityError:
+            await db.rollback()
+
+        row = (await db.execute(select(IdempotencyKey.fingerprint, IdempotencyKey.status_code,
+                                       IdempotencyKey.response)
+                                .where(IdempotencyKey.key == key))).first()
+        await db.commit()
+        if row is None:
+            # Released in between, reported as in flight so that the caller claims again
+            return IdempotencyRecord(fingerprint)
+        return IdempotencyRecord(row.fingerprint, row.status_code,
+                                 json.loads(row.response) if row.response is not None else None)
+
+    async def complete(self, db, key, status_code, body, ttl):
+        await db.execute(update(IdempotencyKey).where(IdempotencyKey.key == key).values(
+            status_code=status_code, response=json.dumps(body),
+            expires_at=datetime.now(timezone.utc) + timedelta(seconds=ttl)))
+
+    async def release(self, db, key):
+        await db.rollback()
+        await db.execute(delete(IdempotencyKey).where(IdempotencyKey.key == key))
+        await db.commit()
+
+
+class IdempotencyGuard:
+    """
+    Runs each request at most once per key: the first request claims the key, duplicates wait for it to finish
+    and are answered with its stored response. Waiters of the same worker are woken up as soon as the response
+    is stored, other workers poll the store.
+    """
+
+    def __init__(self, store: IdempotencyStore, ttl, lock_ttl, wait_timeout, poll_interval):
+        self.store = store
+        self.ttl = ttl
+        self.lock_ttl = lock_ttl
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self._in_flight: Dict[str, asyncio.Event] = {}
+
+    async def begin(self, db: AsyncSession, key, fingerprint) -> Optional[IdempotencyRecord]:
+        """
+        Claim the key or wait for the request holding it
+        :return: None when the caller owns the key and must run the request, else the completed record to replay
+        """
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            record = await self.store.claim(db, key, fingerprint, self.lock_ttl)
+            if record is None:
+                self._in_flight[key] = asyncio.Event()
+                return None
+            if record.fingerprint != fingerprint:
+                raise CustomHTTPException(status_code=422,
+                                          detail="Idempotency-Key was already used for a different request")
+            if record.completed:
+                return record
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise CustomHTTPException(status_code=409,
+                                          detail="A request with this Idempotency-Key is still in progress")
+            await self._wait(key, min(self.poll_interval, remaining))
+
+    async def _wait(self, key, timeout):
+        event = self._in_flight.get(key)
+        if event is None:
+            await asyncio.sleep(timeout)
+            return
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def complete(self, db: AsyncSession, key, status_code, body):
+        await self.store.complete(db, key, status_code, body, self.ttl)
+
+    async def fail(self, db: AsyncSession, key, exc: Exception, body=None):
+        """
+        Client errors are stored and replayed like any response, anything else releases the key so that a retry
+        runs the request again
+        """
+        status_code = getattr(exc, "status_code", 500)
+        if body is not None and status_code < 500:
+            await db.rollback()
+            await self.store.complete(db, key, status_code, body, self.ttl)
+            await db.commit()
+        else:
+            await self.store.release(db, key)
+
+    def finish(self, key):
+        event = self._in_flight.pop(key, None)
+        if event is not None:
+            event.set()
+
+
+def build_idempotency_store(backend) -> IdempotencyStore:
+    if backend == "memory":
+        return MemoryIdempotencyStore()
+    if backend == "database":
+        return DatabaseIdempotencyStore()
+    raise ValueError(f"Unknown idempotency backend: {backend}")
+
+
+idempotency_guard = IdempotencyGuard(build_idempotency_store(settings.IDEMPOTENCY_BACKEND), settings.IDEMPOTENCY_TTL,
+                                     settings.IDEMPOTENCY_LOCK_TTL, settings.IDEMPOTENCY_WAIT_TIMEOUT,
+                                     settings.IDEMPOTENCY_POLL_INTERVAL)
@@ -0,0 +1,163 @@
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+from inspect import iscoroutinefunction
+from typing import Callable, Dict, List, Optional
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from app.api.v1.models.ecommerce import EcommerceDBLayer
+from app.core.config import settings, setup_logging
+from app.core.profiling import background_task
+
+logger = setup_logging(__name__)
+db_layer = EcommerceDBLayer()
+
+
+# Placeholders of the real integrations, they only log the event
+async def send_confirmation_email(payload: Dict):
+    logger.info(f"Order confirmation email queued | order - {payload['order_id']}")
+
+
+async def publish_analytics_event(payload: Dict):
+    logger.info(f"Order analytics event published | order - {payload['order_id']}, "
+                f"total - {payload['total_price']}")
+
+
+async def notify_warehouse(payload: Dict):
+    logger.info(f"Warehouse notified | order - {payload['order_id']}, lines - {len(payload['products'])}")
+
+
+# Handlers run at least once per event, a retry runs all handlers of the event again so they must be idempotent.
+# Coroutine functions run on the event loop, plain functions in the loop's default thread pool.
+ORDER_EVENT_HANDLERS: Dict[str, List[Callable]] = {
+    "order_placed": [send_confirmation_email, publish_analytics_event, notify_warehouse],
+}
+
+
+class OutboxDispatcher:
+    """
+    Drains the order outbox in the background: a fetcher claims due events in batches into a bounded queue
+    served by a pool of workers, and records their results in batches. The fetcher only claims as many events
+    as the queue has room for, so a slow handler slows down claiming instead of piling up events in memory.
+    Failed events are retried with exponential backoff until max_attempts, then marked dead.
+    """
+
+    def __init__(self, handlers: Dict[str, List[Callable]], batch_size, workers, queue_size, max_attempts,
+                 retry_backoff, poll_interval, lease_seconds):
+        self.handlers = handlers
+        self.batch_size = batch_size
+        self.workers = workers
+        self.queue_size = queue_size
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.session_factory: Optional[async_sessionmaker] = None
+        self._task: Optional[asyncio.Task] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._stopping = False
+        self._done: Dict[int, int] = {}
+        self._failed: Dict[int, tuple] = {}
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self, session_factory: async_sessionmaker):
+        if self.running:
+            return
+        self.session_factory = session_factory
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run(), name="order-outbox-dispatcher")
+
+    async def stop(self, timeout=10.0):
+        """Stop claiming, give queued events up to timeout seconds to finish and record their results"""
+        if not self.running:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+        self._task = None
+
+    def notify(self):
+        """Wake the fetcher up, called after orders were committed"""
+        if self.running:
+            self._wakeup.set()
+
+    async def _run(self):
+        background_task.set("order_outbox")
+        workers = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+        try:
+            while not self._stopping:
+                claimed = 0
+                try:
+                    await self._flush()
+                    claimed = await self._claim()
+                except Exception as err:
+                    logger.error(f"Order outbox dispatch failed | {err}")
+                if claimed < self.batch_size or self._queue.full():
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    self._wakeup.clear()
+            await self._queue.join()
+            await self._flush()
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+    async def _claim(self):
+        room = min(self.batch_size, self.queue_size - self._queue.qsize())
+        if room <= 0:
+            return 0
+        async with self.session_factory() as db:
+            events = await db_layer.claim_outbox_events(db, room, self.lease_seconds)
+        for event in events:
+            self._queue.put_nowait(event)
+        return len(events)
+
+    async def _flush(self):
+        if not self._done and not self._failed:
+            return
+        done, failed = self._done, self._failed
+        self._done, self._failed = {}, {}
+        async with self.session_factory() as db:
+            await db_layer.finish_outbox_events(db, done, failed)
+
+    async def _work(self):
+        while True:
+            event = await self._queue.get()
+            try:
+                await self._dispatch(event.event, json.loads(event.payload))
+                self._done[event.id] = event.order_id
+            except Exception as err:
+                self._failed[event.id] = (str(err), self._retry_at(event.attempts + 1))
+                logger.error(f"Order event failed | event - {event.id}, order - {event.order_id}, "
+                             f"attempt - {event.attempts + 1} | {err}")
+            finally:
+                self._queue.task_done()
+                self._wakeup.set()
+
+    async def _dispatch(self, event_name, payload):
+        loop = asyncio.get_running_loop()
+        for handler in self.handlers.get(event_name, []):
+            if iscoroutinefunction(handler):
+                await handler(payload)
+            else:
+                await loop.run_in_executor(None, handler, payload)
+
+    def _retry_at(self, attempts):
+        if attempts >= self.max_attempts:
+            return None
+        return datetime.now(timezone.utc) + timedelta(seconds=self.retry_backoff * 2 ** (attempts - 1))
+
+
+order_outbox = OutboxDispatcher(ORDER_EVENT_HANDLERS, settings.OUTBOX_BATCH_SIZE, settings.OUTBOX_WORKERS,
+                                settings.OUTBOX_QUEUE_SIZE, settings.OUTBOX_MAX_ATTEMPTS, settings.OUTBOX_RETRY_BACKOFF,
+                                settings.OUTBOX_POLL_INTERVAL, settings.OUTBOX_LEASE_SECONDS)
@@ -0,0 +1,246 @@
+import math
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from sqlalchemy import case, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.api.v1.models.base import PricingRule
+from app.api.v1.schemas.ecommerce import OrderItemBase
+from app.core.config import settings
+from app.core.money import BASIS_POINTS, basis_points, to_minor
+
+RULE_KINDS = ("percent", "fixed", "buy_x_get_y")
+
+
+class CompiledRule(NamedTuple):
+    """Pricing rule reduced to what evaluating it needs, amounts in minor units and times in unix time"""
+    id: int
+    kind: str
+    product_id: Optional[int]
+    category: Optional[str]
+    percent: int  # basis points
+    amount: int
+    buy_quantity: int
+    free_quantity: int
+    starts_at: float
+    ends_at: float
+
+
+class LinePrice(NamedTuple):
+    """Price of an order line in minor units, rule_id is the rule that gave the discount"""
+    product_id: int
+    quantity: int
+    unit_price: int
+    discount: int
+    rule_id: Optional[int]
+
+
+def _unix_time(value: Optional[datetime], default: float) -> float:
+    if value is None:
+        return default
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)  # sqlite hands back naive timestamps which are UTC
+    return value.timestamp()
+
+
+def compile_rule(row) -> CompiledRule:
+    return CompiledRule(row.id, row.kind, row.product_id, row.category,
+                        basis_points(row.percent / 100) if row.percent is not None else 0,
+                        to_minor(row.amount) if row.amount is not None else 0,
+                        row.buy_quantity or 0, row.free_quantity or 0,
+                        _unix_time(row.starts_at, -math.inf), _unix_time(row.ends_at, math.inf))
+
+
+def rule_discount(rule: CompiledRule, unit_price: int, quantity: int) -> int:
+    """Discount of a rule on a line in minor units, not capped"""
+    if rule.kind == "percent":
+        return (unit_price * quantity * rule.percent + BASIS_POINTS // 2) // BASIS_POINTS
+    if rule.kind == "fixed":
+        return min(rule.amount, unit_price) * quantity
+    return quantity // (rule.buy_quantity + rule.free_quantity) * rule.free_quantity * unit_price
+
+
+def dominant_rules(rules: List[CompiledRule]) -> Tuple[CompiledRule, ...]:
+    """
+    Rules of a group that can give a line its largest discount: the largest percent, the largest fixed amount and
+    one rule per buy/free pair, the oldest rule among equals
+    """
+    best = {}
+    for rule in sorted(rules, key=lambda rule: rule.id):
+        if rule.kind == "percent":
+            key, value = "percent", rule.percent
+        elif rule.kind == "fixed":
+            key, value = "fixed", rule.amount
+        else:
+            key, value = (rule.buy_quantity, rule.free_quantity), 0
+        if key not in best or value > best[key][0]:
+            best[key] = (value, rule)
+    return tuple(rule for _, rule in best.values())
+
+
+class PriceIndex:
+    """
+    Rules in force during one time window, indexed by the product id and the category they target and reduced to
+    the rules that can win, so a line only meets a handful of rules. The index is rebuilt once valid_until has
+    passed.
+    """
+
+    def __init__(self, rules: List[CompiledRule], now: float):
+        by_product: Dict[int, List[CompiledRule]] = defaultdict(list)
+        by_category: Dict[str, List[CompiledRule]] = defaultdict(list)
+        everywhere = []
+        self.valid_from = -math.inf
+        self.valid_until = math.inf
+        for rule in rules:
+            if rule.starts_at > now:
+                self.valid_until = min(self.valid_until, rule.starts_at)
+                continue
+            if rule.ends_at <= now:
+                self.valid_from = max(self.valid_from, rule.ends_at)
+                continue
+            self.valid_from = max(self.valid_from, rule.starts_at)
+            self.valid_until = min(self.valid_until, rule.ends_at)
+            if rule.product_id is not None:
+                by_product[rule.product_id].append(rule)
+            elif rule.category is not None:
+                by_category[rule.category].append(rule)
+            else:
+                everywhere.append(rule)
+        self.by_product = {product_id: dominant_rules(rules) for product_id, rules in by_product.items()}
+        self.by_category = {category: dominant_rules(rules) for category, rules in by_category.items()}
+        self.everywhere = dominant_rules(everywhere)
+        self.empty = not (self.by_product or self.by_category or self.everywhere)
+
+    def covers(self, now: float) -> bool:
+        return self.valid_from <= now < self.valid_until
+
+    def price_lines(self, items: List[OrderItemBase], products: Dict[int, Dict]) -> List[LinePrice]:
+        """
+        Price the lines of an order: each line gets the rule with the largest discount among the rules of its
+        product, of its category and of every product, capped at the line amount
+        :param items: order lines
+        :param products: catalog fields by product id, lines of unknown products are left out
+        :return: line prices in the order of items
+        """
+        lines = []
+        for item in items:
+            product = products.get(item.product_id)
+            if product is None:
+                continue
+            unit_price = to_minor(product["price"])
+            discount, rule_id = 0, None
+            if not self.empty:
+                for rules in (self.by_product.get(item.product_id, ()),
+                              self.by_category.get(product.get("category"), ()), self.everywhere):
+                    for rule in rules:
+                        rule_value = rule_discount(rule, unit_price, item.quantity)
+                        if rule_value > discount:
+                            discount, rule_id = rule_value, rule.id
+            lines.append(LinePrice(item.product_id, item.quantity, unit_price,
+                                   min(discount, unit_price * item.quantity), rule_id))
+        return lines
+
+
+class PricingDBLayer:
+
+    async def rules_version(self, db: AsyncSession) -> Tuple[int, int]:
+        """
+        Version of the rule set: rules are only ever created or deactivated, so every change moves the count of
+        rules or the count of inactive rules
+        :param db:
+        :return: (rules, inactive rules)
+        """
+        row = (await db.execute(select(func.count(), func.count(case((PricingRule.status != "active", 1))))
+                                .select_from(PricingRule))).one()
+        return row[0], row[1]
+
+    async def active_rules(self, db: AsyncSession):
+        """
+        Active rules, ended ones included: the rule set is small and PriceIndex leaves them out
+        :param db:
+        :return: rule objs
+        """
+        result = await db.execute(select(PricingRule).filter(PricingRule.status == "active").order_by(PricingRule.id))
+        return result.scalars().all()
+
+    async def create_rule(self, db: AsyncSession, values: Dict):
+        """
+        Add a pricing rule and commit it
+        :param db:
+        :param values: rule column values
+        :return: rule obj
+        """
+        rule = PricingRule(status="active", **values)
+        db.add(rule)
+        await db.commit()
+        await db.refresh(rule)
+        return rule
+
+    async def get_rules(self, db: AsyncSession, include_inactive=False):
+        """
+        Pricing rules, newest first
+        :param db:
+        :param include_inactive:
+        :return: rule objs
+        """
+        query = select(PricingRule).order_by(PricingRule.id.desc())
+        if not include_inactive:
+            query = query.filter(PricingRule.status == "active")
+        return (await db.execute(query)).scalars().all()
+
+    async def deactivate_rule(self, db: AsyncSession, rule_id):
+        """
+        Deactivate a rule and commit
+        :param db:
+        :param rule_id:
+        :return: rule obj, None when there is no such rule
+        """
+        await db.execute(update(PricingRule).where(PricingRule.id == rule_id, PricingRule.status == "active")
+                         .values(status="inactive"))
+        await db.commit()
+        return await db.get(PricingRule, rule_id, populate_existing=True)
+
+
+class PricingEngine:
+    """
+    Promotions of a worker, compiled from the pricing rules into a PriceIndex held in memory. The rules table is
+    checked for a new version at most every refresh_seconds and reloaded only when it changed, the index is
+    rebuilt from the loaded rules when a rule starts or ends, so pricing an order is plain dictionary lookups.
+    """
+
+    def __init__(self, refresh_seconds, db_layer: PricingDBLayer = None):
+        self.refresh_seconds = refresh_seconds
+        self.db_layer = db_layer or PricingDBLayer()
+        self._rules: Optional[List[CompiledRule]] = None
+        self._version = None
+        self._checked_at: Optional[float] = None
+        self._index: Optional[PriceIndex] = None
+
+    def invalidate(self):
+        """Check the rules table on the next use, rule writes of this worker are seen at once"""
+        self._checked_at = None
+
+    async def get_index(self, db: AsyncSession) -> PriceIndex:
+        """
+        Index of the rules in force now, reloaded first when the rule set changed
+        :param db:
+        :return: PriceIndex
+        """
+        if not settings.PRICING_ENABLED:
+            return PriceIndex([], 0.0)
+        if self._checked_at is None or time.monotonic() - self._checked_at >= self.refresh_seconds:
+            # The version is read before the rules: a change in between reloads them once more next time
+            version = await self.db_layer.rules_version(db)
+            if self._rules is None or version != self._version:
+                self._rules = [compile_rule(row) for row in await self.db_layer.active_rules(db)]
+                self._version = version
+                self._index = None
+            self._checked_at = time.monotonic()
+        now = time.time()
+        if self._index is None or not self._index.covers(now):
+            self._index = PriceIndex(self._rules, now)
+        return self._index
+
+
+pricing_engine = PricingEngine(settings.PRICING_REFRESH_SECONDS)
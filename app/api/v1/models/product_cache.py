@@ -0,0 +1,125 @@
+import time
+from typing import Dict, List
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.api.v1.models.base import Product, product_stock
+from app.api.v1.models.ecommerce import EcommerceDBLayer
+from app.core.cache import CacheBackend, build_cache
+from app.core.config import settings
+from app.core.metrics import registry
+from app.core.responses import compile_row_serializer
+
+# Catalog fields rarely change and are cached long, stock is volatile and cached separately
+CATALOG_FIELDS = ("id", "sku", "name", "description", "category", "price")
+PRODUCT_FIELDS = CATALOG_FIELDS + ("stock",)
+product_row_to_dict = compile_row_serializer(PRODUCT_FIELDS)
+
+db_layer = EcommerceDBLayer()
+
+
+def product_columns():
+    """Columns of PRODUCT_FIELDS, built per statement like product_stock"""
+    return [getattr(Product, field) for field in CATALOG_FIELDS] + [product_stock().label("stock")]
+
+
+def product_to_dict(product) -> Dict:
+    return {field: getattr(product, field) for field in PRODUCT_FIELDS}
+
+
+class ProductCache:
+    """
+    Read-through product cache in front of EcommerceDBLayer.
+    Keys: catalog:<id>, stock:<id>, page:<generation>:<page key> (list of ids), catalog:generation.
+    """
+
+    def __init__(self, backend: CacheBackend, catalog_ttl, stock_ttl):
+        self.backend = backend
+        self.catalog_ttl = catalog_ttl
+        self.stock_ttl = stock_ttl
+
+    async def _generation(self):
+        generation = await self.backend.get("catalog:generation")
+        if generation is None:
+            # Expired or evicted, start a new generation so pages cached under an older one are never served
+            generation = await self.invalidate_catalog()
+        return generation
+
+    async def page_key(self, *parts):
+        """Page keys embed the catalog generation, so bumping it drops every cached page at once"""
+        return f"page:{await self._generation()}:" + ":".join(str(part) for part in parts)
+
+    async def get_page(self, key):
+        return await self.backend.get(key)
+
+    async def set_page(self, key, ids: List[int]):
+        await self.backend.set(key, ids, self.catalog_ttl)
+
+    async def put_products(self, products: List[Dict]):
+        await self.backend.set_many({f"catalog:{p['id']}": {f: p[f] for f in CATALOG_FIELDS} for p in products},
+                                    self.catalog_ttl)
+        await self.backend.set_many({f"stock:{p['id']}": p["stock"] for p in products}, self.stock_ttl)
+
+    async def get_catalog(self, db: AsyncSession, ids) -> Dict[int, Dict]:
+        """
+        Catalog fields by id, misses are loaded in one query, unknown ids are left out
+        :param db:
+        :param ids:
+        :return: {id: catalog dict}
+        """
+        cached = await self.backend.get_many([f"catalog:{product_id}" for product_id in ids])
+        catalog = {entry["id"]: entry for entry in cached.values()}
+        missing = [product_id for product_id in ids if product_id not in catalog]
+        if missing:
+            columns = [getattr(Product, field) for field in CATALOG_FIELDS]
+            rows = [dict(row) for row in await db_layer.filter_columns_by_item_ids(db, Product, columns, missing)]
+            await self.backend.set_many({f"catalog:{row['id']}": row for row in rows}, self.catalog_ttl)
+            catalog.update({row["id"]: row for row in rows})
+        return catalog
+
+    async def get_products(self, db: AsyncSession, ids) -> List[Dict]:
+        """
+        Products with stock in the order of ids, stock is refreshed from the database once its short TTL ran out
+        :param db:
+        :param ids:
+        :return: list of product dicts
+        """
+        catalog = await self.get_catalog(db, ids)
+        cached = await self.backend.get_many([f"stock:{product_id}" for product_id in catalog])
+        stock = {int(key.split(":", 1)[1]): value for key, value in cached.items()}
+        missing = [product_id for product_id in catalog if product_id not in stock]
+        if missing:
+            rows = await db_layer.filter_columns_by_item_ids(db, Product, [Product.id, product_stock().label("stock")],
+                                                            missing)
+            fresh = {row["id"]: row["stock"] for row in rows}
+            await self.backend.set_many({f"stock:{product_id}": value for product_id, value in fresh.items()},
+                                        self.stock_ttl)
+            stock.update(fresh)
+        return [{**catalog[product_id], "stock": stock[product_id]} for product_id in ids if product_id in stock]
+
+    async def invalidate_catalog(self):
+        """A product was added, cached pages no longer reflect the catalog"""
+        generation = time.time_ns()
+        await self.backend.set("catalog:generation", generation, self.catalog_ttl)
+        return generation
+
+    async def invalidate_stock(self, ids):
+        await self.backend.delete_many([f"stock:{product_id}" for product_id in ids])
+
+    async def invalidate_products(self, ids):
+        await self.backend.delete_many([f"catalog:{product_id}" for product_id in ids])
+        await self.invalidate_stock(ids)
+        await self.invalidate_catalog()
+
+    def stats(self):
+        return self.backend.stats()
+
+
+product_cache = ProductCache(
+    build_cache(settings.PRODUCT_CACHE_BACKEND, settings.PRODUCT_CACHE_SIZE, settings.PRODUCT_CACHE_TTL,
+                settings.REDIS_URL),
+    catalog_ttl=settings.PRODUCT_CACHE_TTL,
+    stock_ttl=settings.PRODUCT_STOCK_CACHE_TTL,
+)
+
+registry.callback("product_cache_events_total", "Product cache lookups and removals by event", ("event",),
+                  lambda: {(event,): value for event, value in product_cache.stats().items()
+                           if event in ("hits", "misses", "evictions", "expirations")}, type="counter")
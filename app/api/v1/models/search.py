@@ -0,0 +1,188 @@
+import re
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+from sqlalchemy import and_, func, literal_column, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.api.v1.models.base import Product, PRODUCT_SEARCH_VECTOR, product_stock
+from app.core.config import settings
+
+TOKEN = re.compile(r"\w+")
+
+# Keyset sort orders of search results: full text rank, trigram similarity, in-memory score
+FTS, TRIGRAM, MEMORY = "fts", "trgm", "mem"
+
+
+def tokenize(text) -> List[str]:
+    return TOKEN.findall((text or "").lower())
+
+
+class SearchFilters:
+    """Price range and stock filters applied on top of the text match"""
+
+    def __init__(self, min_price: Optional[float] = None, max_price: Optional[float] = None, in_stock=False):
+        self.min_price = min_price
+        self.max_price = max_price
+        self.in_stock = in_stock
+
+    def clauses(self):
+        clauses = []
+        if self.min_price is not None:
+            clauses.append(Product.price >= self.min_price)
+        if self.max_price is not None:
+            clauses.append(Product.price <= self.max_price)
+        if self.in_stock:
+            clauses.append(product_stock() > 0)
+        return clauses
+
+
+def after_clause(score, key, last_id):
+    """Rows ranked after (key, last_id) in (score desc, id asc) order"""
+    return or_(score < key, and_(score == key, Product.id > last_id))
+
+
+class PostgresSearchEngine:
+    """
+    Full text search on the GIN indexed tsvector of name and description, every word but the last must match its
+    stemmed form and the last one matches as a prefix of an unstemmed word. Queries without full text matches fall
+    back to trigram similarity on name, which tolerates typos.
+    """
+    sorts = (FTS, TRIGRAM)
+
+    async def search(self, db: AsyncSession, text, filters: SearchFilters, limit, after: Optional[Tuple] = None):
+        """
+        :param db:
+        :param text: raw query
+        :param filters:
+        :param limit: rows to return
+        :param after: (sort, key, last_id) of the previous page
+        :return: (sort, [(product, score)])
+        """
+        tokens = tokenize(text)
+        sort = after[0] if after else FTS
+        if sort == FTS:
+            ts_query = func.to_tsquery(literal_column("'simple'::regconfig"), tokens[-1] + ":*")
+            if len(tokens) > 1:
+                words = func.to_tsquery(literal_column("'english'::regconfig"), " & ".join(tokens[:-1]))
+                ts_query = words.op("&&")(ts_query)
+            score = func.ts_rank_cd(PRODUCT_SEARCH_VECTOR, ts_query)
+            rows = await self._ranked(db, score, PRODUCT_SEARCH_VECTOR.op("@@")(ts_query), filters, limit, after)
+            if rows or after or not settings.SEARCH_TRIGRAM_ENABLED:
+                return FTS, rows
+            sort = TRIGRAM
+
+        query_text = " ".join(tokens)
+        score = func.similarity(Product.name, query_text)
+        rows = await self._ranked(db, score, score >= settings.SEARCH_TRIGRAM_THRESHOLD, filters, limit, after)
+        return TRIGRAM, rows
+
+    async def _ranked(self, db: AsyncSession, score, match, filters: SearchFilters, limit, after):
+        # Matches are cut to SEARCH_MAX_CANDIDATES by id before ranking, so a broad query scores a bounded number of
+        # rows. The cut does not depend on the score, every page is ranked from the same candidates
+        candidates = (select(Product.id).filter(match, *filters.clauses())
+                      .order_by(Product.id).limit(settings.SEARCH_MAX_CANDIDATES).subquery())
+        query = select(Product, score.label("score")).join(candidates, Product.id == candidates.c.id)
+        if after:
+            query = query.filter(after_clause(score, after[1], after[2]))
+        result = await db.execute(query.order_by(score.desc(), Product.id).limit(limit))
+        return [(row.Product, row.score) for row in result]
+
+
+class InMemorySearchEngine:
+    """
+    Inverted index of product name and description tokens for SQLite and tests. The index follows the products
+    table incrementally through updated_at, so products written by any process become searchable.
+    Every query word must match a token, the last one as a prefix. Name matches weigh twice description matches.
+    """
+    sorts = (MEMORY,)
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[int, float]] = defaultdict(dict)  # token -> {product id: weight}
+        self.documents: Dict[int, Set[str]] = {}  # product id -> indexed tokens
+        self.vocabulary: List[str] = []  # sorted tokens for prefix lookups
+        self.vocabulary_stale = False
+        self.watermark = None
+
+    async def refresh(self, db: AsyncSession):
+        query = select(Product.id, Product.name, Product.description, Product.updated_at)
+        if self.watermark is not None:
+            # Timestamps may be second resolution, re-indexing rows at the watermark is idempotent
+            query = query.filter(Product.updated_at >= self.watermark)
+        rows = (await db.execute(query)).all()
+        for row in rows:
+            self.index(row.id, row.name, row.description)
+            if self.watermark is None or row.updated_at > self.watermark:
+                self.watermark = row.updated_at
+        if self.vocabulary_stale:
+            self.vocabulary = sorted(self.postings)
+            self.vocabulary_stale = False
+
+    def index(self, product_id, name, description):
+        for token in self.documents.pop(product_id, ()):
+            self.postings[token].pop(product_id, None)
+            if not self.postings[token]:
+                del self.postings[token]
+                self.vocabulary_stale = True
+        weights = defaultdict(float)
+        for token in tokenize(name):
+            weights[token] += 2.0
+        for token in tokenize(description):
+            weights[token] += 1.0
+        for token, weight in weights.items():
+            if token not in self.postings:
+                self.vocabulary_stale = True
+            self.postings[token][product_id] = weight
+        self.documents[product_id] = set(weights)
+
+    def _expand_prefix(self, prefix) -> List[str]:
+        start = bisect_left(self.vocabulary, prefix)
+        end = start
+        while end < len(self.vocabulary) and self.vocabulary[end].startswith(prefix):
+            end += 1
+        return self.vocabulary[start:end]
+
+    def match(self, tokens) -> Dict[int, float]:
+        scores = None
+        for position, token in enumerate(tokens):
+            terms = self._expand_prefix(token) if position == len(tokens) - 1 else [token]
+            matches = defaultdict(float)
+            for term in terms:
+                for product_id, weight in self.postings.get(term, {}).items():
+                    matches[product_id] += weight
+            scores = matches if scores is None else {product_id: score + matches[product_id]
+                                                     for product_id, score in scores.items() if product_id in matches}
+            if not scores:
+                return {}
+        return scores
+
+    async def search(self, db: AsyncSession, text, filters: SearchFilters, limit, after: Optional[Tuple] = None):
+        await self.refresh(db)
+        scores = self.match(tokenize(text))
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        if after:
+            _, key, last_id = after
+            ranked = [(product_id, score) for product_id, score in ranked
+                      if score < key or (score == key and product_id > last_id)]
+
+        rows = []
+        # Filters are evaluated by the database on a window of candidates at a time, in rank order
+        window = max(limit * 4, 100)
+        for start in range(0, len(ranked), window):
+            candidates = dict(ranked[start:start + window])
+            result = await db.execute(select(Product).filter(Product.id.in_(candidates), *filters.clauses()))
+            products = sorted(result.scalars(), key=lambda product: (-candidates[product.id], product.id))
+            rows += [(product, candidates[product.id]) for product in products]
+            if len(rows) >= limit:
+                break
+        return MEMORY, rows[:limit]
+
+
+search_engines = {}
+
+
+def get_search_engine(dialect_name):
+    """Search engine for a database dialect, created once per process"""
+    if dialect_name not in search_engines:
+        search_engines[dialect_name] = (PostgresSearchEngine() if dialect_name == "postgresql"
+                                        else InMemorySearchEngine())
+    return search_engines[dialect_name]
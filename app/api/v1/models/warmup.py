@@ -0,0 +1,101 @@
+import asyncio
+import time
+from typing import Dict, Optional
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from app.api.v1.models.api_keys import api_key_registry
+from app.api.v1.models.base import Product
+from app.api.v1.models.ecommerce import EcommerceDBLayer
+from app.api.v1.models.pricing import pricing_engine
+from app.api.v1.models.product_cache import product_columns, product_cache, product_row_to_dict
+from app.core.config import settings, setup_logging
+
+logger = setup_logging(__name__)
+db_layer = EcommerceDBLayer()
+
+
+class Readiness:
+    """Lifecycle of the worker reported by /health/ready: starting, warming_up, ready, stopping"""
+
+    def __init__(self):
+        self.start()
+
+    @property
+    def ready(self):
+        return self.state == "ready"
+
+    def start(self):
+        self.state = "starting"
+        self.started_at = time.monotonic()
+        self.ready_after: Optional[float] = None  # seconds from start to ready
+        self.steps: Dict[str, float] = {}  # warm-up step -> ms
+        self.error: Optional[str] = None
+
+    def set_ready(self):
+        self.state = "ready"
+        self.error = None
+        self.ready_after = round(time.monotonic() - self.started_at, 3)
+
+    def as_dict(self):
+        return {"status": self.state, "ready_after_s": self.ready_after, "warm_up_ms": self.steps,
+                "error": self.error}
+
+
+async def open_connections(session_factory: async_sessionmaker, count):
+    """Check out `count` pool connections at once so that the pool holds them before traffic arrives"""
+    engine = session_factory.kw["bind"]
+    connections = []
+    try:
+        for connection in await asyncio.gather(*(engine.connect() for _ in range(count)), return_exceptions=True):
+            if isinstance(connection, BaseException):
+                raise connection
+            connections.append(connection)
+        for connection in connections:
+            await connection.execute(text("SELECT 1"))
+    finally:
+        for connection in connections:
+            await connection.close()
+
+
+async def prime_product_cache(session_factory: async_sessionmaker, limit):
+    """Load the first products of the catalog into the product cache"""
+    async with session_factory() as db:
+        rows = await db_layer.get_all(db, Product, 0, limit, columns=product_columns())
+    if rows:
+        await product_cache.put_products([product_row_to_dict(row) for row in rows])
+
+
+async def compile_pricing_rules(session_factory: async_sessionmaker):
+    """Compile the pricing rules so that the first order does not pay for it"""
+    async with session_factory() as db:
+        await pricing_engine.get_index(db)
+
+
+async def warm_up(session_factory: async_sessionmaker, readiness: Readiness, retry_interval=1.0, max_interval=10.0):
+    """
+    Prepare the worker for traffic, retried until it succeeds (the database may not be up yet), then mark it ready
+    """
+    steps = [
+        ("database", lambda: open_connections(session_factory, settings.WARMUP_POOL_CONNECTIONS)),
+        ("api_keys", api_key_registry.refresh),
+        ("product_cache", lambda: prime_product_cache(session_factory, settings.WARMUP_PRODUCTS)),
+        ("pricing_rules", lambda: compile_pricing_rules(session_factory)),
+    ]
+    readiness.state = "warming_up"
+    while True:
+        try:
+            for name, step in steps:
+                start = time.perf_counter()
+                await step()
+                readiness.steps[name] = round((time.perf_counter() - start) * 1000, 3)
+            break
+        except Exception as err:
+            readiness.error = f"{name}: {err}"
+            logger.error(f"Warm-up failed, retrying in {retry_interval:.0f}s | {readiness.error}")
+            await asyncio.sleep(retry_interval)
+            retry_interval = min(retry_interval * 2, max_interval)
+    readiness.set_ready()
+    logger.info(f"Worker ready after {readiness.ready_after}s | {readiness.steps}")
+
+
+readiness = Readiness()
@@ -0,0 +1,21 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.api.v1.models.analytics import AnalyticsDBLayer
+
+
+db_layer = AnalyticsDBLayer()
+
+
+class AnalyticsRepository:
+    """Dashboard reads, served from the precomputed analytics tables only"""
+
+    @classmethod
+    async def top_products(cls, db: AsyncSession, limit):
+        return [row._asdict() for row in await db_layer.top_products(db, limit)]
+
+    @classmethod
+    async def sales_by_hour(cls, db: AsyncSession, hours):
+        return [row._asdict() for row in await db_layer.sales_by_hour(db, hours)]
+
+    @classmethod
+    async def low_stock(cls, db: AsyncSession, limit):
+        return [row._asdict() for row in await db_layer.low_stock(db, limit)]
@@ -1,40 +1,300 @@
-from sqlalchemy.orm import Session
-from app.api.v1.models.base import Product
+from collections import Counter
+from typing import Dict, List, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.api.v1.models.base import Order, Product, product_stock
 from app.api.v1.models.ecommerce import EcommerceDBLayer
-from app.core.exception import CustomHTTPException
-from app.api.v1.schemas.ecommerce import OrderCreate
+from app.api.v1.models.idempotency import fingerprint, idempotency_guard
+from app.api.v1.models.outbox import order_outbox
+from app.api.v1.models.pricing import PriceIndex, pricing_engine
+from app.api.v1.models.product_cache import product_cache
+from app.core.config import settings
+from app.core.exception import CustomHTTPException, error_content
+from app.core.money import basis_points, from_minor, order_totals
+from app.core.pagination import decode_cursor, encode_cursor
+from app.core.metrics import ORDERS_PLACED, ORDERS_REJECTED, STOCK_RESERVATION_FAILURES, STOCK_RESERVED_UNITS
+from app.api.v1.schemas.ecommerce import (OrderCreate, OrderItemBase, OrderResponse, OrderBatchResult,
+                                          OrderBatchResponse)
 
 
 db_layer = EcommerceDBLayer()
 
+# A batch is re-allocated from a fresh stock snapshot when concurrent orders changed stock in between
+BATCH_RESERVATION_ATTEMPTS = 3
+
 
 class OrderRepository:
 
     @classmethod
-    def place_order(cls, db: Session, order_data: OrderCreate):
+    def _merge_lines(cls, order_data: OrderCreate) -> Counter:
+        """
+        Validate order lines and merge lines for the same product, an order item is unique per product
+        :return: quantity by product id
+        """
         if not order_data.products:
             raise CustomHTTPException(status_code=400, detail="Order must contain at least one product")
 
-        errors = []
-        request_products = {item.product_id: item for item in order_data.products}
-        product_ids = [item.product_id for item in order_data.products]
+        if any(item.quantity <= 0 for item in order_data.products):
+            raise CustomHTTPException(status_code=400, detail="Invalid details supplied for product",
+                                      payload=order_data.dict(),
+                                      errors=["Product quantitiy cannot be less than or equals 0"])
 
-        # Fetch all products in one query (Optimized)
-        products = {product.id: product for product in db_layer.filter_by_item_ids(db, Product, product_ids)}
+        quantities = Counter()
+        for item in order_data.products:
+            quantities[item.product_id] += item.quantity
+        return quantities
 
-        if len(products) != len(request_products):
-            missing_products = set(request_products) - set(products.keys())
-            errors.append(f"Products not found: {missing_products}")
+    @classmethod
+    def _to_order(cls, quantities: Dict[int, int]) -> OrderCreate:
+        return OrderCreate(products=[OrderItemBase(product_id=product_id, quantity=quantity)
+                                     for product_id, quantity in quantities.items()])
 
-        for product_id, product in products.items():
-            if request_products[product_id].quantity <= 0:
-                errors.append(f"Product quantitiy cannot be less than or equals 0")
-            if product.stock < request_products[product_id].quantity:
-                errors.append(f"Insufficient stock for product - {product.id}, name - {product.name}, "
-                              f"stock - {product.stock}")
+    @classmethod
+    def order_response(cls, order, order_data: OrderCreate) -> OrderResponse:
+        return OrderResponse(id=order.id, total_price=order.total_price, status=order.status,
+                             products=order_data.products)
+
+    @classmethod
+    def order_to_dict(cls, order) -> Dict:
+        """Order row or object as an OrderDetail shaped dict, with its products when they were loaded"""
+        content = {"id": order.id, "total_price": order.total_price, "status": order.status,
+                   "item_count": order.item_count, "created_at": order.created_at.isoformat()}
+        if isinstance(order, Order):
+            content["products"] = [{"product_id": item.product_id, "quantity": item.quantity} for item in order.items]
+        return content
+
+    @classmethod
+    async def get_order(cls, db: AsyncSession, order_id):
+        order = await db_layer.get_order(db, order_id)
+        if order is None:
+            raise CustomHTTPException(status_code=404, detail="Order not found")
+        return cls.order_to_dict(order)
+
+    @classmethod
+    async def get_orders(cls, db: AsyncSession, limit, status=None, created_after=None, created_before=None,
+                         after=None, with_items=True):
+        """
+        Page through orders newest first with a keyset cursor
+        :return: (orders, next_cursor)
+        """
+        after_id = decode_cursor(after, "created_at")[1] if after is not None else None
+        # Fetch one extra row to know whether a next page exists
+        orders = await db_layer.get_orders(db, limit + 1, status, created_after, created_before, after_id, with_items)
+        next_cursor = None
+        if len(orders) > limit:
+            orders = orders[:limit]
+            # The seek reads the position of the last order back from its row, the cursor only carries its id
+            next_cursor = encode_cursor("created_at", None, orders[-1].id)
+        return [cls.order_to_dict(order) for order in orders], next_cursor
+
+    @classmethod
+    async def place_order(cls, db: AsyncSession, order_data: OrderCreate, before_commit=None):
+        try:
+            quantities = cls._merge_lines(order_data)
+        except CustomHTTPException:
+            ORDERS_REJECTED.labels("invalid").inc()
+            raise
+        order_data = cls._to_order(quantities)
+
+        # Catalog fields come from the product cache, stock is checked and deducted by the database
+        products = await product_cache.get_catalog(db, list(quantities))
+        # Priced before any product row is locked, orders with unknown products fail their reservation below
+        price_index = await pricing_engine.get_index(db)
+        discounts = cls._discounts(price_index, order_data, products)
+        reserved = await db_layer.reserve_stock(db, quantities)
+        if len(reserved) != len(quantities):
+            await db.rollback()
+            ORDERS_REJECTED.labels("stock").inc()
+            STOCK_RESERVATION_FAILURES.inc(len(quantities) - len(reserved))
+            raise CustomHTTPException(status_code=400, detail="Invalid details supplied for product",
+                                      payload=order_data.dict(),
+                                      errors=await cls._reservation_errors(db, quantities, reserved))
+
+        order = await db_layer.create_order(db, order_data, products, before_commit, discounts)
+        order_outbox.notify()
+        await product_cache.invalidate_stock(list(quantities))
+        ORDERS_PLACED.inc()
+        STOCK_RESERVED_UNITS.inc(sum(quantities.values()))
+        return order
+
+    @classmethod
+    def _discounts(cls, price_index: PriceIndex, order_data: OrderCreate, products: Dict[int, Dict]) -> Dict[int, int]:
+        """Discount of each line in minor units by product id"""
+        return {line.product_id: line.discount for line in price_index.price_lines(order_data.products, products)}
 
-        if errors:
+    @classmethod
+    async def quote_order(cls, db: AsyncSession, order_data: OrderCreate) -> Dict:
+        """
+        Price an order as placing it would, without reserving stock
+        :return: OrderQuote shaped dict
+        """
+        quantities = cls._merge_lines(order_data)
+        products = await product_cache.get_catalog(db, list(quantities))
+        missing_products = {product_id for product_id in quantities if product_id not in products}
+        if missing_products:
             raise CustomHTTPException(status_code=400, detail="Invalid details supplied for product",
-                                      payload=order_data.dict(), errors=errors)
+                                      payload=order_data.dict(), errors=[f"Products not found: {missing_products}"])
+
+        price_index = await pricing_engine.get_index(db)
+        lines = price_index.price_lines(cls._to_order(quantities).products, products)
+        # Every line is totaled as an order of its own, so line totals add up to the order total
+        totals = order_totals([line.unit_price for line in lines], [line.quantity for line in lines],
+                              list(range(len(lines))), [line.discount for line in lines],
+                              tax_basis_points=basis_points(settings.ORDER_TAX_RATE))
+        subtotal = sum(line.unit_price * line.quantity for line in lines)
+        discount = sum(line.discount for line in lines)
+        return {
+            "products": [{"product_id": line.product_id, "quantity": line.quantity,
+                          "unit_price": from_minor(line.unit_price), "discount": from_minor(line.discount),
+                          "rule_id": line.rule_id, "total_price": from_minor(total)}
+                         for line, total in zip(lines, totals)],
+            "subtotal": from_minor(subtotal),
+            "discount": from_minor(discount),
+            "tax": from_minor(sum(totals) - subtotal + discount),
+            "total_price": from_minor(sum(totals)),
+        }
+
+    @classmethod
+    async def place_order_once(cls, db: AsyncSession, order_data: OrderCreate, idempotency_key,
+                               client_id) -> Tuple[int, Dict, bool]:
+        """
+        Place an order at most once per Idempotency-Key of a client. The response is stored in the order
+        transaction, retries and concurrent duplicates get the stored response without touching products or orders.
+        :param client_id: identifies the API key, clients choose their Idempotency-Keys independently
+        :return: (status_code, response body, replayed)
+        """
+        key = f"orders:{client_id}:{idempotency_key}"
+        record = await idempotency_guard.begin(db, key, fingerprint(order_data.model_dump()))
+        if record is not None:
+            return record.status_code, record.body, True
+
+        response = {}
+
+        async def store_response(orders):
+            response.update(cls.order_response(orders[0], order_data).model_dump())
+            await idempotency_guard.complete(db, key, 200, response)
+
+        try:
+            await cls.place_order(db, order_data, before_commit=store_response)
+            return 200, response, False
+        except CustomHTTPException as err:
+            await idempotency_guard.fail(db, key, err, error_content(err))
+            raise
+        except Exception as err:
+            await idempotency_guard.fail(db, key, err)
+            raise
+        finally:
+            idempotency_guard.finish(key)
+
+    @classmethod
+    async def place_orders(cls, db: AsyncSession, orders_data: List[OrderCreate]) -> OrderBatchResponse:
+        """
+        Place a batch of orders with one product query, one stock reservation, multi-row inserts and one commit.
+        Orders are allocated stock in the order they were sent, orders that cannot be served are rejected
+        individually without failing the batch.
+        """
+        if len(orders_data) > settings.ORDER_BATCH_MAX_SIZE:
+            raise CustomHTTPException(status_code=400,
+                                      detail=f"Batch cannot contain more than {settings.ORDER_BATCH_MAX_SIZE} orders")
+
+        results = {}
+        candidates = {}
+        for index, order_data in enumerate(orders_data):
+            try:
+                candidates[index] = cls._merge_lines(order_data)
+            except CustomHTTPException as err:
+                results[index] = OrderBatchResult(index=index, status="rejected", errors=err.errors or [err.detail])
 
-        return db_layer.create_order(db, order_data, products)
+        product_ids = sorted({product_id for quantities in candidates.values() for product_id in quantities})
+        # Rules are loaded, when they changed, before any product row is locked
+        price_index = await pricing_engine.get_index(db)
+        accepted, products, totals = {}, {}, Counter()
+        for _ in range(BATCH_RESERVATION_ATTEMPTS):
+            rows = await db_layer.filter_columns_by_item_ids(
+                db, Product,
+                [Product.id, Product.name, Product.category, Product.price, product_stock().label("stock")],
+                product_ids)
+            products = {row["id"]: row for row in rows}
+            accepted, rejected = cls._allocate(candidates, products)
+            totals = Counter()
+            for index in accepted:
+                totals.update(candidates[index])
+            if not totals:
+                break
+            reserved = await db_layer.reserve_stock(db, totals)
+            if len(reserved) == len(totals):
+                break
+            # Stock changed since the snapshot was read, undo the partial reservation and allocate again
+            await db.rollback()
+        else:
+            rejected.update({index: ["Stock changed while the batch was processed, retry the order"]
+                             for index in accepted})
+            accepted = {}
+
+        results.update({index: OrderBatchResult(index=index, status="rejected", errors=errors)
+                        for index, errors in rejected.items()})
+        ORDERS_REJECTED.labels("invalid").inc(len(orders_data) - len(candidates))
+        ORDERS_REJECTED.labels("stock").inc(len(rejected))
+        if accepted:
+            indexes = sorted(accepted)
+            accepted_orders = [cls._to_order(candidates[index]) for index in indexes]
+            orders = await db_layer.create_orders(db, accepted_orders, products, discounts=[
+                cls._discounts(price_index, order_data, products) for order_data in accepted_orders])
+            order_outbox.notify()
+            await product_cache.invalidate_stock(list(totals))
+            ORDERS_PLACED.inc(len(orders))
+            STOCK_RESERVED_UNITS.inc(sum(totals.values()))
+            for index, order in zip(indexes, orders):
+                results[index] = OrderBatchResult(
+                    index=index, status=order.status,
+                    order=OrderResponse(id=order.id, total_price=order.total_price, status=order.status,
+                                        products=orders_data[index].products))
+        else:
+            await db.rollback()
+
+        return OrderBatchResponse(placed=len(accepted), rejected=len(orders_data) - len(accepted),
+                                  results=[results[index] for index in range(len(orders_data))])
+
+    @classmethod
+    def _allocate(cls, candidates: Dict[int, Counter], products: Dict[int, Dict]):
+        """
+        Allocate stock from a snapshot to orders in arrival order
+        :return: (accepted {index: True}, rejected {index: errors})
+        """
+        stock = {product_id: row["stock"] for product_id, row in products.items()}
+        accepted, rejected = {}, {}
+        for index in sorted(candidates):
+            quantities = candidates[index]
+            errors = []
+            missing_products = {product_id for product_id in quantities if product_id not in stock}
+            if missing_products:
+                errors.append(f"Products not found: {missing_products}")
+            for product_id, quantity in quantities.items():
+                if product_id in stock and stock[product_id] < quantity:
+                    errors.append(f"Insufficient stock for product - {product_id}, "
+                                  f"name - {products[product_id]['name']}, stock - {stock[product_id]}, "
+                                  f"requested - {quantity}")
+            if errors:
+                rejected[index] = errors
+                continue
+            for product_id, quantity in quantities.items():
+                stock[product_id] -= quantity
+            accepted[index] = True
+        return accepted, rejected
+
+    @classmethod
+    async def _reservation_errors(cls, db: AsyncSession, quantities, reserved):
+        """Explain which lines could not be reserved, only runs on the failure path"""
+        failed = [product_id for product_id in quantities if product_id not in reserved]
+        stock = {row["id"]: row for row in await db_layer.filter_columns_by_item_ids(
+            db, Product, [Product.id, Product.name, product_stock().label("stock")], failed)}
+
+        errors = []
+        missing_products = {product_id for product_id in failed if product_id not in stock}
+        if missing_products:
+            errors.append(f"Products not found: {missing_products}")
+        for product_id in failed:
+            if product_id in stock:
+                row = stock[product_id]
+                errors.append(f"Insufficient stock for product - {product_id}, name - {row['name']}, "
+                              f"stock - {row['stock']}, requested - {quantities[product_id]}")
+        return errors
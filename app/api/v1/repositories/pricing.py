@@ -0,0 +1,66 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.api.v1.models.base import Product
+from app.api.v1.models.pricing import PricingDBLayer, pricing_engine
+from app.api.v1.schemas.ecommerce import PricingRuleCreate
+from app.core.exception import CustomHTTPException
+from app.core.money import to_minor
+
+
+db_layer = PricingDBLayer()
+
+# Columns a rule of each kind needs, the others must be left out
+KIND_FIELDS = {
+    "percent": ("percent",),
+    "fixed": ("amount",),
+    "buy_x_get_y": ("buy_quantity", "free_quantity"),
+}
+
+
+class PricingRepository:
+    """Promotion rules, every write makes this worker's pricing engine reload them"""
+
+    @classmethod
+    def validate_rule(cls, rule_data: PricingRuleCreate):
+        errors = []
+        for kind, fields in KIND_FIELDS.items():
+            for field in fields:
+                given = getattr(rule_data, field) is not None
+                if kind == rule_data.kind and not given:
+                    errors.append(f"{field} is required by {kind} rules")
+                elif kind != rule_data.kind and given:
+                    errors.append(f"{field} does not apply to {rule_data.kind} rules")
+        if rule_data.product_id is not None and rule_data.category is not None:
+            errors.append("A rule targets a product or a category, not both")
+        if rule_data.percent is not None and not 0 < rule_data.percent <= 100:
+            errors.append("percent must be greater than 0 and at most 100")
+        if rule_data.amount is not None and to_minor(rule_data.amount) <= 0:
+            errors.append("amount must be greater than zero")
+        if any(quantity is not None and quantity <= 0
+               for quantity in (rule_data.buy_quantity, rule_data.free_quantity)):
+            errors.append("buy_quantity and free_quantity must be greater than zero")
+        if rule_data.starts_at and rule_data.ends_at and rule_data.ends_at <= rule_data.starts_at:
+            errors.append("ends_at must be after starts_at")
+        if errors:
+            raise CustomHTTPException(status_code=400, detail="Invalid pricing rule", payload=rule_data.dict(),
+                                      errors=errors)
+
+    @classmethod
+    async def create_rule(cls, db: AsyncSession, rule_data: PricingRuleCreate):
+        cls.validate_rule(rule_data)
+        if rule_data.product_id is not None and await db.get(Product, rule_data.product_id) is None:
+            raise CustomHTTPException(status_code=404, detail="Product not found")
+        rule = await db_layer.create_rule(db, rule_data.dict())
+        pricing_engine.invalidate()
+        return rule
+
+    @classmethod
+    async def get_rules(cls, db: AsyncSession, include_inactive=False):
+        return await db_layer.get_rules(db, include_inactive)
+
+    @classmethod
+    async def deactivate_rule(cls, db: AsyncSession, rule_id):
+        rule = await db_layer.deactivate_rule(db, rule_id)
+        if rule is None:
+            raise CustomHTTPException(status_code=404, detail="Pricing rule not found")
+        pricing_engine.invalidate()
+        return rule
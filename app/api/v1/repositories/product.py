@@ -1,26 +1,127 @@
-from sqlalchemy.orm import Session
-from app.api.v1.models.base import Product
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.api.v1.models.base import Product, product_stock
 from app.api.v1.models.ecommerce import EcommerceDBLayer
+from app.api.v1.models.product_cache import product_cache, product_to_dict, product_row_to_dict, product_columns
+from app.api.v1.models.search import SearchFilters, get_search_engine, tokenize
 from app.api.v1.schemas.ecommerce import ProductCreate
+from app.core.config import settings
 from app.core.exception import CustomHTTPException
+from app.core.money import to_minor
+from app.core.pagination import encode_cursor, decode_cursor, decode_cursor_any
 
 
 db_layer = EcommerceDBLayer()
 
+# Columns products can be ordered by, each backed by a (column, id) index
+SORT_COLUMNS = {
+    "id": Product.id,
+    "name": Product.name,
+    "price": Product.price,
+}
+
 
 class ProductRepository:
 
     @classmethod
-    def get_products(cls, db: Session, skip, limit):
-        products = db_layer.get_all(db, Product, skip, limit)
-        if not products:
+    async def get_products(cls, db: AsyncSession, skip, limit, after=None, sort="id"):
+        """
+        Page through products with skip/limit, or with a keyset cursor when `after` is supplied
+        :return: (products, next_cursor)
+        """
+        page_key = await product_cache.page_key(sort, f"after={after}" if after is not None else f"skip={skip}",
+                                                limit)
+        page_ids = await product_cache.get_page(page_key)
+        if page_ids is not None:
+            products = await product_cache.get_products(db, page_ids)
+        else:
+            products = await cls._load_page(db, skip, limit, after, sort)
+            if products:
+                await product_cache.put_products(products)
+                await product_cache.set_page(page_key, [product["id"] for product in products])
+
+        if not products and after is None:
             raise CustomHTTPException(status_code=404, detail="No products available")
-        return products
+
+        next_cursor = None
+        if len(products) > limit:
+            products = products[:limit]
+            last = products[-1]
+            next_cursor = encode_cursor(sort, last[sort], last["id"])
+        return products, next_cursor
+
+    @classmethod
+    async def _load_page(cls, db: AsyncSession, skip, limit, after, sort):
+        order_by = SORT_COLUMNS[sort]
+        # Fetch one extra row to know whether a next page exists
+        if after is not None:
+            key, last_id = decode_cursor(after, sort)
+            rows = await db_layer.get_page_after(db, Product, order_by, key, last_id, limit + 1,
+                                                 columns=product_columns())
+        else:
+            rows = await db_layer.get_all(db, Product, skip, limit + 1, order_by=order_by, columns=product_columns())
+        return [product_row_to_dict(row) for row in rows]
+
+    @classmethod
+    async def get_product(cls, db: AsyncSession, product_id):
+        products = await product_cache.get_products(db, [product_id])
+        if not products:
+            raise CustomHTTPException(status_code=404, detail="Product not found")
+        return products[0]
+
+    @classmethod
+    async def search_products(cls, db: AsyncSession, text, filters: SearchFilters, limit, after=None):
+        """
+        Ranked product search, paged with a keyset cursor on (score, id)
+        :return: (products, next_cursor)
+        """
+        if not tokenize(text):
+            raise CustomHTTPException(status_code=400, detail="Search query must contain at least one word")
+        engine = get_search_engine(db.bind.dialect.name)
+        cursor = decode_cursor_any(after, engine.sorts) if after is not None else None
+
+        # Fetch one extra row to know whether a next page exists
+        sort, rows = await engine.search(db, text, filters, limit + 1, cursor)
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last, score = rows[-1]
+            next_cursor = encode_cursor(sort, score, last.id)
+        products = [product_to_dict(product) for product, _ in rows]
+        if settings.STOCK_SHARDS and products:
+            # Sharded products keep part of their stock outside of the product row
+            rows = await db_layer.filter_columns_by_item_ids(db, Product, [Product.id, product_stock().label("stock")],
+                                                             [product["id"] for product in products])
+            stock = {row["id"]: row["stock"] for row in rows}
+            for product in products:
+                product["stock"] = stock.get(product["id"], product["stock"])
+        return products, next_cursor
 
     @classmethod
-    def add_product(cls, db: Session, product_data: ProductCreate):
-        if product_data.price <= 0:
+    def validate_product(cls, product_data: ProductCreate):
+        # Prices are stored in cents, a price rounding to zero cents is no price either
+        if to_minor(product_data.price) <= 0:
             raise CustomHTTPException(status_code=400, detail="Price must be greater than zero")
         if product_data.stock < 0:
             raise CustomHTTPException(status_code=400, detail="Stock cannot be negative")
-        return db_layer.create_product(db, product_data)
+
+    @classmethod
+    async def add_product(cls, db: AsyncSession, product_data: ProductCreate):
+        cls.validate_product(product_data)
+        product = await db_layer.create_product(db, product_data)
+        await product_cache.invalidate_catalog()
+        return product
+
+    @classmethod
+    async def shard_stock(cls, db: AsyncSession, product_id, sharded: bool):
+        """
+        Split the stock of a hot product over STOCK_SHARDS counters, or merge it back into the product row. Merging
+        works with sharding off, so that shards left over from when it was on can be folded back.
+        """
+        if sharded and not settings.STOCK_SHARDS:
+            raise CustomHTTPException(status_code=400, detail="Stock sharding is disabled")
+        result = await db_layer.shard_stock(db, product_id, settings.STOCK_SHARDS if sharded else 0)
+        if result is None:
+            raise CustomHTTPException(status_code=404, detail="Product not found")
+        await product_cache.invalidate_stock([product_id])
+        stock, shards = result
+        return {"product_id": product_id, "stock": stock, "shards": shards}
@@ -0,0 +1,51 @@
+import csv
+import io
+from datetime import datetime
+from typing import AsyncIterator, Optional
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from app.api.v1.models.base import Product, product_stock
+from app.api.v1.models.ecommerce import EcommerceDBLayer
+from app.core.config import settings
+from app.core.responses import compile_row_serializer, dumps
+
+
+db_layer = EcommerceDBLayer()
+
+EXPORT_COLUMNS = ("id", "sku", "name", "description", "price", "stock", "updated_at")
+MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+export_row_to_dict = compile_row_serializer(EXPORT_COLUMNS)
+
+
+class ProductExportRepository:
+
+    @classmethod
+    async def export_products(cls, session_factory: async_sessionmaker, fmt="ndjson",
+                              since: Optional[datetime] = None) -> AsyncIterator[bytes]:
+        """
+        Serialize the whole catalog (or the products updated after `since`) batch by batch.
+        The generator owns its session since it keeps reading after the request handler returned.
+        :param session_factory:
+        :param fmt: ndjson or csv
+        :param since:
+        :return: async iterator of encoded chunks
+        """
+        columns = [product_stock().label(column) if column == "stock" else getattr(Product, column)
+                   for column in EXPORT_COLUMNS]
+        async with session_factory() as db:
+            if fmt == "csv":
+                yield cls._csv_chunk([EXPORT_COLUMNS])
+            async for rows in db_layer.stream_products(db, columns, since, settings.PRODUCT_EXPORT_BATCH_SIZE):
+                if fmt == "csv":
+                    yield cls._csv_chunk([row[:-1] + (row.updated_at.isoformat(),) for row in rows])
+                else:
+                    yield b"".join(dumps({**export_row_to_dict(row), "updated_at": row.updated_at.isoformat()}) + b"\n"
+                                   for row in rows)
+
+    @classmethod
+    def _csv_chunk(cls, rows) -> bytes:
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerows(rows)
+        return buffer.getvalue().encode()
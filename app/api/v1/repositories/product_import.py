@@ -0,0 +1,100 @@
+from typing import AsyncIterator, Dict, List
+from pydantic import ValidationError
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.api.v1.models.ecommerce import EcommerceDBLayer, OPTIONAL_IMPORT_COLUMNS, PRODUCT_IMPORT_COLUMNS
+from app.api.v1.models.product_cache import product_cache
+from app.api.v1.repositories.product import ProductRepository
+from app.api.v1.schemas.ecommerce import ProductCreate, ProductImportReport, ProductImportRejectedRow
+from app.core.config import settings, setup_logging
+from app.core.exception import CustomHTTPException
+from app.core.streaming import iter_csv_records, iter_ndjson_records
+
+
+logger = setup_logging(__name__)
+db_layer = EcommerceDBLayer()
+
+PARSERS = {
+    "ndjson": iter_ndjson_records,
+    "csv": iter_csv_records,
+}
+
+
+class ProductImportRepository:
+
+    @classmethod
+    async def import_products(cls, db: AsyncSession, chunks: AsyncIterator[bytes], fmt="ndjson", mode=None):
+        """
+        Stream products from NDJSON or CSV into the catalog. Rows are validated with ProductCreate and written
+        chunk by chunk, one transaction per chunk, so memory stays flat whatever the file size.
+        Progress is logged after every chunk.
+        :param db:
+        :param chunks: raw file content
+        :param fmt: ndjson or csv
+        :param mode: upsert (INSERT ... ON CONFLICT) or copy (Postgres COPY into a staging table)
+        :return: ProductImportReport
+        """
+        if fmt not in PARSERS:
+            raise CustomHTTPException(status_code=400, detail=f"Unsupported import format: {fmt}")
+        mode = mode or settings.PRODUCT_IMPORT_MODE
+        if mode not in ("upsert", "copy"):
+            raise CustomHTTPException(status_code=400, detail=f"Unsupported import mode: {mode}")
+
+        report = ProductImportReport()
+        chunk: Dict = {}  # sku (or line number when there is none) -> row, a later row for a sku wins
+        async for line, record in PARSERS[fmt](chunks):
+            report.processed += 1
+            row = cls._validate(line, record, report)
+            if row is None:
+                continue
+            chunk[row["sku"] if row["sku"] is not None else f"#{line}"] = row
+            if len(chunk) >= settings.PRODUCT_IMPORT_CHUNK_SIZE:
+                await cls._write_chunk(db, list(chunk.values()), mode, report)
+                chunk = {}
+        if chunk:
+            await cls._write_chunk(db, list(chunk.values()), mode, report)
+        return report
+
+    @classmethod
+    def _validate(cls, line, record, report: ProductImportReport):
+        errors = []
+        if isinstance(record, ValueError):
+            errors.append(f"Malformed row - {record}")
+        else:
+            try:
+                values = {column: record.get(column) for column in PRODUCT_IMPORT_COLUMNS}
+                # An empty CSV cell is no value
+                values["sku"] = values["sku"] or None
+                values["category"] = values["category"] or None
+                product = ProductCreate(**values)
+                ProductRepository.validate_product(product)
+                # Optional columns the row does not have are left as they are on existing products
+                return product.dict(include={column for column in PRODUCT_IMPORT_COLUMNS
+                                             if column in record or column not in OPTIONAL_IMPORT_COLUMNS})
+            except ValidationError as err:
+                errors += [f'Field "{".".join(map(str, e["loc"]))}" - {e["msg"]}' for e in err.errors()]
+            except CustomHTTPException as err:
+                errors.append(err.detail)
+
+        report.rejected += 1
+        if len(report.rejected_rows) < settings.PRODUCT_IMPORT_MAX_REPORTED_REJECTS:
+            report.rejected_rows.append(ProductImportRejectedRow(line=line, errors=errors))
+        return None
+
+    @classmethod
+    async def _write_chunk(cls, db: AsyncSession, rows: List[Dict], mode, report: ProductImportReport):
+        try:
+            if mode == "copy":
+                ids = await db_layer.copy_products(db, rows)
+            else:
+                ids = await db_layer.upsert_products(db, rows)
+            await db.commit()
+        except SQLAlchemyError as e:
+            await db.rollback()
+            raise CustomHTTPException(status_code=500, detail="An error occurred while importing products",
+                                      payload=report.dict(), errors=str(e))
+
+        await product_cache.invalidate_products(ids)
+        report.imported += len(ids)
+        logger.info(f"Product import: {report.processed} rows processed, {report.imported} imported, "
+                    f"{report.rejected} rejected")
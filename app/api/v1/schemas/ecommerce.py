@@ -1,5 +1,6 @@
+from datetime import datetime
 from pydantic import BaseModel
-from typing import List
+from typing import List, Literal, Optional
 
 
 # Pydantic Schemas
@@ -8,6 +9,8 @@ class ProductBase(BaseModel):
     description: str
     price: float
     stock: int
+    sku: Optional[str] = None
+    category: Optional[str] = None
 
 
 class ProductCreate(ProductBase):
@@ -21,6 +24,24 @@ class ProductResponse(ProductBase):
         from_attributes = True
 
 
+class ProductStockShards(BaseModel):
+    product_id: int
+    stock: int
+    shards: List[int] = []
+
+
+class ProductImportRejectedRow(BaseModel):
+    line: int
+    errors: List[str]
+
+
+class ProductImportReport(BaseModel):
+    processed: int = 0
+    imported: int = 0
+    rejected: int = 0
+    rejected_rows: List[ProductImportRejectedRow] = []
+
+
 class OrderItemBase(BaseModel):
     product_id: int
     quantity: int
@@ -38,3 +59,93 @@ class OrderResponse(BaseModel):
 
     class Config:
         from_attributes = True
+
+
+class OrderSummary(BaseModel):
+    id: int
+    total_price: float
+    status: str
+    item_count: int
+    created_at: datetime
+
+
+class OrderDetail(OrderSummary):
+    products: Optional[List[OrderItemBase]] = None  # left out of summary listings
+
+
+class OrderBatchCreate(BaseModel):
+    orders: List[OrderCreate]
+
+
+class OrderBatchResult(BaseModel):
+    index: int
+    status: str  # placed, rejected
+    order: Optional[OrderResponse] = None
+    errors: Optional[List[str]] = None
+
+
+class OrderBatchResponse(BaseModel):
+    placed: int
+    rejected: int
+    results: List[OrderBatchResult]
+
+
+class TopProduct(BaseModel):
+    product_id: int
+    name: Optional[str] = None
+    units: int
+    orders: int
+    last_order_at: Optional[datetime] = None
+
+
+class HourlySales(BaseModel):
+    bucket: datetime  # start of the hour, UTC
+    orders: int
+    units: int
+    revenue: float
+
+
+class LowStockItem(BaseModel):
+    product_id: int
+    name: Optional[str] = None
+    stock: int
+    updated_at: datetime
+
+
+class PricingRuleCreate(BaseModel):
+    name: str
+    kind: Literal["percent", "fixed", "buy_x_get_y"]
+    product_id: Optional[int] = None  # one product, or
+    category: Optional[str] = None  # one category, every product when both are left out
+    percent: Optional[float] = None  # percent: 15 takes 15% off the line
+    amount: Optional[float] = None  # fixed: taken off each unit
+    buy_quantity: Optional[int] = None  # buy_x_get_y: buy 2 ...
+    free_quantity: Optional[int] = None  # ... get 1 free
+    starts_at: Optional[datetime] = None
+    ends_at: Optional[datetime] = None
+
+
+class PricingRuleResponse(PricingRuleCreate):
+    id: int
+    status: str  # active, inactive
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+
+class QuoteLine(BaseModel):
+    product_id: int
+    quantity: int
+    unit_price: float
+    discount: float
+    rule_id: Optional[int] = None  # pricing rule that gave the discount
+    total_price: float  # after discount, tax included
+
+
+class OrderQuote(BaseModel):
+    products: List[QuoteLine]
+    subtotal: float
+    discount: float
+    tax: float
+    total_price: float
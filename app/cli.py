@@ -0,0 +1,68 @@
+import argparse
+import asyncio
+from datetime import datetime
+from pathlib import Path
+from sqlalchemy import insert
+from app.api.v1.models.api_keys import generate_api_key, hash_api_key
+from app.api.v1.models.base import ApiKey, dispose_engines, get_async_session_factory
+from app.api.v1.repositories.product_import import ProductImportRepository
+
+# Bytes read from the import file at a time
+READ_SIZE = 1 << 16
+
+
+async def read_file(path: Path):
+    with path.open("rb") as file:
+        while chunk := file.read(READ_SIZE):
+            yield chunk
+
+
+async def import_products(args):
+    path = Path(args.file)
+    fmt = args.format or ("csv" if path.suffix.lower() == ".csv" else "ndjson")
+    async with get_async_session_factory()() as db:
+        report = await ProductImportRepository.import_products(db, read_file(path), fmt, args.mode)
+    print(report.model_dump_json(indent=2))
+
+
+async def create_api_key(args):
+    key = generate_api_key()
+    async with get_async_session_factory()() as db:
+        await db.execute(insert(ApiKey).values(name=args.name, key_hash=hash_api_key(key), rate_limit=args.rate,
+                                               burst=args.burst, expires_at=args.expires_at))
+        await db.commit()
+    # Only the digest is stored, the key cannot be shown again
+    print(key)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="Ecommerce platform management commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import-products", help="Stream a NDJSON or CSV catalog into products")
+    import_parser.add_argument("file")
+    import_parser.add_argument("--format", choices=["ndjson", "csv"], help="Defaults to the file extension")
+    import_parser.add_argument("--mode", choices=["upsert", "copy"], help="Defaults to PRODUCT_IMPORT_MODE")
+    import_parser.set_defaults(handler=import_products)
+
+    key_parser = commands.add_parser("create-api-key", help="Issue an API key, read by API_KEYS_SOURCE=database")
+    key_parser.add_argument("name", help="Client or tenant the key is issued to")
+    key_parser.add_argument("--rate", type=float, help="Requests per second, defaults to API_RATE_LIMIT")
+    key_parser.add_argument("--burst", type=int, help="Defaults to API_RATE_LIMIT_BURST")
+    key_parser.add_argument("--expires-at", type=datetime.fromisoformat, help="ISO timestamp")
+    key_parser.set_defaults(handler=create_api_key)
+
+    args = parser.parse_args(argv)
+    asyncio.run(run(args))
+
+
+async def run(args):
+    try:
+        await args.handler(args)
+    finally:
+        # Pooled connections (and the aiosqlite worker thread) would keep the process alive
+        await dispose_engines()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import json
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+
+class CacheStats:
+    """Hit/miss/eviction counters of a cache backend"""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def as_dict(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class CacheBackend(ABC):
+    """Key/value cache with per entry TTL, values must be JSON serializable"""
+
+    def __init__(self, default_ttl):
+        self.default_ttl = default_ttl
+        self.counters = CacheStats()
+
+    @abstractmethod
+    async def get_many(self, keys: Iterable[str]) -> Dict:
+        """
+        Look keys up in one round trip
+        :return: values of the keys found, missing and expired keys are left out
+        """
+
+    @abstractmethod
+    async def set_many(self, items: Dict, ttl: Optional[float] = None):
+        """Store values by key, expiring after ttl seconds or default_ttl"""
+
+    @abstractmethod
+    async def delete_many(self, keys: Iterable[str]):
+        """Drop keys, unknown keys are ignored"""
+
+    @abstractmethod
+    async def clear(self):
+        """Drop every entry of this cache"""
+
+    async def get(self, key):
+        return (await self.get_many([key])).get(key)
+
+    async def set(self, key, value, ttl: Optional[float] = None):
+        await self.set_many({key: value}, ttl)
+
+    def stats(self) -> Dict:
+        return {"backend": self.__class__.__name__, **self.counters.as_dict()}
+
+
+class NullCache(CacheBackend):
+    """Cache that never stores anything, every lookup goes to the source"""
+
+    async def get_many(self, keys):
+        self.counters.misses += len(list(keys))
+        return {}
+
+    async def set_many(self, items, ttl=None):
+        pass
+
+    async def delete_many(self, keys):
+        pass
+
+    async def clear(self):
+        pass
+
+
+class LRUCache(CacheBackend):
+    """In-process cache bounded by max_size, least recently used entries are evicted first"""
+
+    def __init__(self, max_size, default_ttl):
+        super().__init__(default_ttl)
+        self.max_size = max_size
+        self._data = OrderedDict()  # key -> (expires_at, value)
+
+    async def get_many(self, keys):
+        now = time.monotonic()
+        found = {}
+        for key in keys:
+            entry = self._data.get(key)
+            if entry is None:
+                self.counters.misses += 1
+                continue
+            if entry[0] <= now:
+                del self._data[key]
+                self.counters.expirations += 1
+                self.counters.misses += 1
+                continue
+            self._data.move_to_end(key)
+            self.counters.hits += 1
+            found[key] = entry[1]
+        return found
+
+    async def set_many(self, items, ttl=None):
+        expires_at = time.monotonic() + (self.default_ttl if ttl is None else ttl)
+        for key, value in items.items():
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.counters.evictions += 1
+
+    async def delete_many(self, keys):
+        for key in keys:
+            self._data.pop(key, None)
+
+    async def clear(self):
+        self._data.clear()
+
+    def stats(self):
+        return {**super().stats(), "size": len(self._data), "max_size": self.max_size}
+
+
+class RedisCache(CacheBackend):
+    """Cache shared by all workers, eviction is left to the redis maxmemory policy"""
+
+    def __init__(self, url, default_ttl, prefix="ecommerce:"):
+        super().__init__(default_ttl)
+        try:
+            from redis import asyncio as redis
+        except ImportError as err:
+            raise RuntimeError("The redis cache backend requires the 'redis' package") from err
+        self.prefix = prefix
+        self._client = redis.from_url(url)
+
+    async def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        values = await self._client.mget([self.prefix + key for key in keys])
+        found = {}
+        for key, value in zip(keys, values):
+            if value is None:
+                self.counters.misses += 1
+                continue
+            self.counters.hits += 1
+            found[key] = json.loads(value)
+        return found
+
+    async def set_many(self, items, ttl=None):
+        ttl = self.default_ttl if ttl is None else ttl
+        async with self._client.pipeline(transaction=False) as pipe:
+            for key, value in items.items():
+                pipe.set(self.prefix + key, json.dumps(value), px=int(ttl * 1000))
+            await pipe.execute()
+
+    async def delete_many(self, keys):
+        keys = [self.prefix + key for key in keys]
+        if keys:
+            await self._client.delete(*keys)
+
+    async def clear(self):
+        async for key in self._client.scan_iter(match=self.prefix + "*"):
+            await self._client.delete(key)
+
+
+def build_cache(backend, max_size, default_ttl, redis_url=None) -> CacheBackend:
+    """
+    Create the configured cache backend
+    :param backend: memory, redis or none
+    :param max_size: max entries of the in-process cache
+    :param default_ttl: seconds
+    :param redis_url:
+    :return: CacheBackend
+    """
+    if backend == "memory":
+        return LRUCache(max_size, default_ttl)
+    if backend == "redis":
+        return RedisCache(redis_url, default_ttl)
+    if backend == "none":
+        return NullCache(default_ttl)
+    raise ValueError(f"Unknown cache backend: {backend}")
@@ -0,0 +1,124 @@
+"""
+Adaptive concurrency limit. The limit follows AIMD on request latency: it grows by about one slot per limit's
+worth of fast requests while it is in use, and is cut by a factor, at most once per target latency, when requests
+get slower than the target or fail. Requests above the limit wait in a bounded priority queue.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from typing import List, Tuple
+
+
+class Overloaded(Exception):
+
+    def __init__(self, reason, retry_after):
+        super().__init__(reason)
+        self.reason = reason  # deadline, queue_full or evicted
+        self.retry_after = retry_after
+
+
+class AdaptiveLimiter:
+
+    def __init__(self, initial_limit, min_limit, max_limit, max_queue, target_latency, backoff=0.9, reserve=0.0):
+        """
+        :param target_latency: seconds, slower requests cut the limit
+        :param backoff: factor applied to the limit on a cut
+        :param reserve: share of the limit only priority 0 requests may use
+        """
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.target_latency = target_latency
+        self.backoff = backoff
+        self.reserve = reserve
+        self.in_flight = 0
+        self.latency = target_latency / 2  # moving average of served requests, estimates queue waits
+        self._queue: List[Tuple[int, int, asyncio.Future]] = []  # heap of (priority, arrival, waiter)
+        self._arrivals = itertools.count()
+        self._cut_at = 0.0
+
+    @property
+    def queued(self):
+        return len(self._queue)
+
+    def capacity(self, priority):
+        """Slots requests of a priority may fill, lower priorities leave the reserve to priority 0"""
+        return self.limit if priority == 0 else self.limit * (1 - self.reserve)
+
+    def estimated_wait(self, priority):
+        ahead = sum(1 for queued_priority, _, _ in self._queue if queued_priority <= priority)
+        return (ahead + 1) * self.latency / max(self.capacity(priority), 1)
+
+    async def acquire(self, priority, timeout):
+        """
+        Take a slot, waiting up to timeout seconds for one; priority 0 is served first
+        :raise Overloaded: when the request would not get a slot in time or the queue is full
+        """
+        if self.in_flight < self.capacity(priority) and not any(queued <= priority for queued, _, _ in self._queue):
+            self.in_flight += 1
+            return
+        wait = self.estimated_wait(priority)
+        if wait > timeout:
+            raise Overloaded("deadline", wait)
+        if len(self._queue) >= self.max_queue:
+            # A full queue makes room by dropping its latest, least important waiter, if it is less important
+            worst = max(self._queue)
+            if worst[0] <= priority:
+                raise Overloaded("queue_full", wait)
+            self._queue.remove(worst)
+            heapq.heapify(self._queue)
+            if not worst[2].done():
+                worst[2].set_result(False)
+
+        waiter = asyncio.get_running_loop().create_future()
+        entry = (priority, next(self._arrivals), waiter)
+        heapq.heappush(self._queue, entry)
+        try:
+            await asyncio.wait({waiter}, timeout=timeout)
+        except BaseException:
+            # Cancelled while waiting: give back a slot handed over meanwhile
+            if waiter.done() and waiter.result():
+                self.release(0.0, failed=False, measured=False)
+            else:
+                self._drop(entry)
+            raise
+        if not waiter.done():
+            self._drop(entry)
+            raise Overloaded("deadline", self.estimated_wait(priority))
+        if not waiter.result():
+            raise Overloaded("evicted", self.estimated_wait(priority))
+
+    def _drop(self, entry):
+        if entry in self._queue:
+            self._queue.remove(entry)
+            heapq.heapify(self._queue)
+        entry[2].cancel()
+
+    def release(self, latency, failed, measured=True):
+        """Give a slot back, with the latency of the request it served and whether it failed"""
+        self.in_flight -= 1
+        if measured:
+            self.latency += 0.1 * (latency - self.latency)
+            now = time.monotonic()
+            if failed or latency > self.target_latency:
+                if now - self._cut_at >= self.target_latency:
+                    self._cut_at = now
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+            elif self.in_flight + 1 >= self.limit / 2:
+                # Only grow a limit that is in use, an idle worker would otherwise drift to max_limit
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self._wake()
+
+    def _wake(self):
+        while self._queue:
+            priority, _, waiter = self._queue[0]
+            if waiter.done():
+                heapq.heappop(self._queue)
+                continue
+            if self.in_flight >= self.capacity(priority):
+                return
+            heapq.heappop(self._queue)
+            self.in_flight += 1
+            waiter.set_result(True)
@@ -32,7 +32,19 @@ async def log_entry_point(req):
 class Settings(BaseSettings):
 
     API_V1_STR: str = "/v1"
+    # JSON encoder of API responses: orjson or json
+    JSON_RESPONSE_BACKEND: str = os.environ.get("JSON_RESPONSE_BACKEND", "orjson")
     API_KEY: str = os.environ.get("API_KEY")
+    # Issued API keys: settings (API_KEY only), file or database; API_KEY is accepted with every source
+    API_KEYS_SOURCE: str = os.environ.get("API_KEYS_SOURCE", "settings")
+    API_KEYS_FILE: str = os.environ.get("API_KEYS_FILE", "api_keys.json")
+    # Seconds the in-memory key registry is served before it is reloaded from its source
+    API_KEYS_REFRESH_SECONDS: float = float(os.environ.get("API_KEYS_REFRESH_SECONDS", 60))
+    # Token bucket per API key: requests per second (0 disables) and burst, keys can override both
+    API_RATE_LIMIT: float = float(os.environ.get("API_RATE_LIMIT", 0))
+    API_RATE_LIMIT_BURST: int = int(os.environ.get("API_RATE_LIMIT_BURST", 0))
+    # Where buckets live: memory (per worker) or redis (shared by all workers)
+    API_RATE_LIMIT_BACKEND: str = os.environ.get("API_RATE_LIMIT_BACKEND", "memory")
     POSTGRES_DB: str = os.environ.get("POSTGRES_DB")
     POSTGRES_HOST: str = os.environ.get("POSTGRES_HOST")
     POSTGRES_TEST_DB: str = os.environ.get("POSTGRES_TEST_DB")
@@ -43,6 +55,106 @@ class Settings(BaseSettings):
     TEST_DATABASE_URL: str = os.environ.get("TEST_DATABASE_URL")
     ENV: str = os.environ.get("ENV")
 
+    # Warm-up of a starting worker, /health/ready answers 503 until it finished: pool connections opened
+    # and products loaded into the product cache
+    WARMUP_ENABLED: bool = os.environ.get("WARMUP_ENABLED", "true").lower() == "true"
+    WARMUP_POOL_CONNECTIONS: int = int(os.environ.get("WARMUP_POOL_CONNECTIONS", os.environ.get("DB_POOL_SIZE", 5)))
+    WARMUP_PRODUCTS: int = int(os.environ.get("WARMUP_PRODUCTS", 1000))
+
+    # Connection pool, sized per uvicorn worker
+    DB_POOL_SIZE: int = int(os.environ.get("DB_POOL_SIZE", 5))
+    DB_MAX_OVERFLOW: int = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+    DB_POOL_TIMEOUT: float = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+    DB_POOL_RECYCLE: int = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+    DB_POOL_PRE_PING: bool = os.environ.get("DB_POOL_PRE_PING", "true").lower() == "true"
+
+    # Max orders accepted by one POST /orders:batch request
+    ORDER_BATCH_MAX_SIZE: int = int(os.environ.get("ORDER_BATCH_MAX_SIZE", 1000))
+    # Tax added to order totals as a fraction of the line amounts (0.2 is 20%)
+    ORDER_TAX_RATE: float = float(os.environ.get("ORDER_TAX_RATE", 0))
+
+    # Promotions applied to order lines before stock is reserved. Each worker compiles the active rules in memory
+    # and checks the rules table for changes every PRICING_REFRESH_SECONDS
+    PRICING_ENABLED: bool = os.environ.get("PRICING_ENABLED", "true").lower() == "true"
+    PRICING_REFRESH_SECONDS: float = float(os.environ.get("PRICING_REFRESH_SECONDS", 5))
+
+    # Bulk product import: rows per transaction, rejected rows listed in the report, upsert or copy
+    PRODUCT_IMPORT_CHUNK_SIZE: int = int(os.environ.get("PRODUCT_IMPORT_CHUNK_SIZE", 1000))
+    PRODUCT_IMPORT_MAX_REPORTED_REJECTS: int = int(os.environ.get("PRODUCT_IMPORT_MAX_REPORTED_REJECTS", 100))
+    PRODUCT_IMPORT_MODE: str = os.environ.get("PRODUCT_IMPORT_MODE", "upsert")
+
+    # Rows fetched per round trip by the catalog export cursor
+    PRODUCT_EXPORT_BATCH_SIZE: int = int(os.environ.get("PRODUCT_EXPORT_BATCH_SIZE", 1000))
+
+    # Product search: trigram fallback needs the pg_trgm extension on Postgres
+    SEARCH_TRIGRAM_ENABLED: bool = os.environ.get("SEARCH_TRIGRAM_ENABLED", "true").lower() == "true"
+    SEARCH_TRIGRAM_THRESHOLD: float = float(os.environ.get("SEARCH_TRIGRAM_THRESHOLD", 0.3))
+    # Matches ranked per query on Postgres, a broader query ranks only its matches of the lowest product ids
+    SEARCH_MAX_CANDIDATES: int = int(os.environ.get("SEARCH_MAX_CANDIDATES", 1000))
+
+    # Cache-Control sent with product reads, clients revalidate with If-None-Match. Reads require an API key, so
+    # shared caches are kept out unless they are set up to key on X-API-KEY
+    PRODUCT_CACHE_CONTROL: str = os.environ.get("PRODUCT_CACHE_CONTROL", "private, max-age=30")
+
+    # Product cache: memory, redis or none
+    PRODUCT_CACHE_BACKEND: str = os.environ.get("PRODUCT_CACHE_BACKEND", "memory")
+    PRODUCT_CACHE_SIZE: int = int(os.environ.get("PRODUCT_CACHE_SIZE", 10000))
+    PRODUCT_CACHE_TTL: float = float(os.environ.get("PRODUCT_CACHE_TTL", 300))
+    PRODUCT_STOCK_CACHE_TTL: float = float(os.environ.get("PRODUCT_STOCK_CACHE_TTL", 5))
+    REDIS_URL: str = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+
+    # Idempotency-Key store of POST /orders: database (shared by all workers) or memory (single worker)
+    IDEMPOTENCY_BACKEND: str = os.environ.get("IDEMPOTENCY_BACKEND", "database")
+    # Seconds a stored response is replayed for, and seconds an in-flight key stays locked if its worker dies
+    IDEMPOTENCY_TTL: float = float(os.environ.get("IDEMPOTENCY_TTL", 86400))
+    IDEMPOTENCY_LOCK_TTL: float = float(os.environ.get("IDEMPOTENCY_LOCK_TTL", 30))
+    # Seconds a duplicate waits for the in-flight request before answering 409
+    IDEMPOTENCY_WAIT_TIMEOUT: float = float(os.environ.get("IDEMPOTENCY_WAIT_TIMEOUT", 10))
+    IDEMPOTENCY_POLL_INTERVAL: float = float(os.environ.get("IDEMPOTENCY_POLL_INTERVAL", 0.05))
+
+    # SQL profiling: every request, or only requests sent with an X-SQL-Profile: 1 header. The header is off by
+    # default, any client could otherwise read statement counts and timings of the database
+    SQL_PROFILE_ENABLED: bool = os.environ.get("SQL_PROFILE_ENABLED", "false").lower() == "true"
+    SQL_PROFILE_HEADER_ENABLED: bool = os.environ.get("SQL_PROFILE_HEADER_ENABLED", "false").lower() == "true"
+    # Profiled requests slower than this are logged with their repeated statements and plans
+    SQL_PROFILE_SLOW_REQUEST_MS: float = float(os.environ.get("SQL_PROFILE_SLOW_REQUEST_MS", 500))
+    # EXPLAIN profiled SELECTs slower than SQL_PROFILE_SLOW_QUERY_MS: off, plan or analyze
+    SQL_PROFILE_EXPLAIN: str = os.environ.get("SQL_PROFILE_EXPLAIN", "off")
+    SQL_PROFILE_SLOW_QUERY_MS: float = float(os.environ.get("SQL_PROFILE_SLOW_QUERY_MS", 100))
+
+    # Adaptive concurrency limit of API requests per worker, requests above it queue or are answered 503
+    LOAD_SHED_ENABLED: bool = os.environ.get("LOAD_SHED_ENABLED", "true").lower() == "true"
+    LOAD_SHED_INITIAL_LIMIT: int = int(os.environ.get("LOAD_SHED_INITIAL_LIMIT", 32))
+    LOAD_SHED_MIN_LIMIT: int = int(os.environ.get("LOAD_SHED_MIN_LIMIT", 4))
+    LOAD_SHED_MAX_LIMIT: int = int(os.environ.get("LOAD_SHED_MAX_LIMIT", 256))
+    # Requests slower than this cut the limit
+    LOAD_SHED_TARGET_LATENCY_MS: float = float(os.environ.get("LOAD_SHED_TARGET_LATENCY_MS", 250))
+    LOAD_SHED_MAX_QUEUE: int = int(os.environ.get("LOAD_SHED_MAX_QUEUE", 128))
+    # Seconds a request may wait for a slot, requests expected to wait longer are rejected right away
+    LOAD_SHED_QUEUE_TIMEOUT: float = float(os.environ.get("LOAD_SHED_QUEUE_TIMEOUT", 2))
+    # Share of the limit kept for order placement
+    LOAD_SHED_ORDER_RESERVE: float = float(os.environ.get("LOAD_SHED_ORDER_RESERVE", 0.2))
+
+    # Counters the stock of a sharded product is split into, 0 disables stock sharding
+    STOCK_SHARDS: int = int(os.environ.get("STOCK_SHARDS", 0))
+
+    # Order outbox dispatcher: post-processing of placed orders, runs in every app worker
+    OUTBOX_DISPATCHER_ENABLED: bool = os.environ.get("OUTBOX_DISPATCHER_ENABLED", "true").lower() == "true"
+    OUTBOX_BATCH_SIZE: int = int(os.environ.get("OUTBOX_BATCH_SIZE", 100))
+    OUTBOX_WORKERS: int = int(os.environ.get("OUTBOX_WORKERS", 4))
+    # Events claimed but not yet dispatched, the dispatcher stops claiming when it is full
+    OUTBOX_QUEUE_SIZE: int = int(os.environ.get("OUTBOX_QUEUE_SIZE", 200))
+    OUTBOX_MAX_ATTEMPTS: int = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 5))
+    OUTBOX_RETRY_BACKOFF: float = float(os.environ.get("OUTBOX_RETRY_BACKOFF", 2))
+    OUTBOX_POLL_INTERVAL: float = float(os.environ.get("OUTBOX_POLL_INTERVAL", 1))
+    # Seconds a claimed event is hidden from other dispatchers
+    OUTBOX_LEASE_SECONDS: float = float(os.environ.get("OUTBOX_LEASE_SECONDS", 60))
+
+    # Sales analytics folded into precomputed tables by the outbox dispatcher
+    ANALYTICS_ENABLED: bool = os.environ.get("ANALYTICS_ENABLED", "true").lower() == "true"
+    # Ordered products with this stock or less are listed by the low stock watchlist
+    LOW_STOCK_THRESHOLD: int = int(os.environ.get("LOW_STOCK_THRESHOLD", 5))
+
     class Config:
         case_sensitive = True
 
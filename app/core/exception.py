@@ -10,13 +10,16 @@ class CustomHTTPException(HTTPException):
         self.errors = errors
 
 
-def custom_http_exception_handler(request, exc: HTTPException):
+def error_content(exc: HTTPException):
 
-    error_response = {
+    return {
         "status_code": exc.status_code,
         "message": exc.detail,
-        "request_payload": exc.payload,
-        "errors": exc.errors
+        "request_payload": getattr(exc, "payload", None),
+        "errors": getattr(exc, "errors", None)
     }
 
-    return JSONResponse(content=error_response, status_code=exc.status_code)
+
+def custom_http_exception_handler(request, exc: HTTPException):
+
+    return JSONResponse(content=error_content(exc), status_code=exc.status_code)
@@ -0,0 +1,30 @@
+import hashlib
+from typing import Iterable, Optional
+
+
+def make_etag(parts: Iterable) -> str:
+    """
+    Strong ETag over the values that make up a representation, any change to them changes the tag
+    :param parts: values in representation order
+    :return: quoted entity tag
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(repr(part).encode())
+        digest.update(b"\x1f")
+    return f'"{digest.hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    If-None-Match evaluation, which uses the weak comparison (RFC 9110 13.1.2)
+    :param if_none_match: header value, a list of entity tags or *
+    :param etag:
+    :return: bool
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag in candidates
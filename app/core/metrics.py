@@ -0,0 +1,206 @@
+"""
+Prometheus metrics without a client library. Every label set owns pre-allocated counters, recording a sample is a
+dict lookup plus an increment in place, no lock is taken: the event loop serializes async code, and a rare lost
+increment from threadpool code under the GIL is an accepted trade off for microsecond overhead.
+"""
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds in seconds, requests and database statements have different scales
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class CounterValue:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class GaugeValue(CounterValue):
+    __slots__ = ()
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class HistogramValue:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last slot is +Inf
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Metric(ABC):
+    type = "untyped"
+
+    def __init__(self, name, documentation, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple, object] = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    @abstractmethod
+    def _new_child(self):
+        """Value of one label set"""
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    @abstractmethod
+    def samples(self) -> Iterable[str]:
+        """Exposition lines of every label set"""
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}", *self.samples()]
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def _new_child(self):
+        return CounterValue()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            yield f"{self.name}{_labels(self.labelnames, values)} {_number(child.value)}"
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def _new_child(self):
+        return GaugeValue()
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames: Sequence[str] = (), buckets=LATENCY_BUCKETS):
+        self.bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return HistogramValue(self.bounds)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def samples(self):
+        names = self.labelnames + ("le",)
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.bounds + (float("inf"),), list(child.counts)):
+                cumulative += count
+                yield f"{self.name}_bucket{_labels(names, values + (_number(bound),))} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, values)} {_number(child.sum)}"
+            yield f"{self.name}_count{_labels(self.labelnames, values)} {cumulative}"
+
+
+class CallbackMetric(Metric):
+    """Metric read at scrape time from a callback returning {label values: value}, for stats kept elsewhere"""
+
+    def __init__(self, name, documentation, labelnames: Sequence[str], callback: Callable[[], Dict[Tuple, float]],
+                 type="gauge"):
+        self.callback = callback
+        self.type = type
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return None  # values live in the callback
+
+    def samples(self):
+        for values, value in self.callback().items():
+            yield f"{self.name}{_labels(self.labelnames, values)} {_number(value)}"
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name, documentation, labelnames, callback, type="gauge") -> CallbackMetric:
+        return self.register(CallbackMetric(name, documentation, labelnames, callback, type))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+HTTP_REQUEST_DURATION = registry.histogram("http_request_duration_seconds", "Request latency by route",
+                                           ("method", "route", "status"))
+HTTP_REQUESTS_IN_FLIGHT = registry.gauge("http_requests_in_flight", "Requests being served")
+DB_QUERY_DURATION = registry.histogram("db_query_duration_seconds", "Statement execution time by engine",
+                                       ("engine", "operation"), QUERY_BUCKETS)
+ORDERS_PLACED = registry.counter("orders_placed_total", "Orders placed")
+ORDERS_REJECTED = registry.counter("orders_rejected_total", "Orders rejected, invalid or out of stock", ("reason",))
+STOCK_RESERVED_UNITS = registry.counter("stock_reserved_units_total", "Units of stock reserved by placed orders")
+STOCK_RESERVATION_FAILURES = registry.counter("stock_reservation_failures_total",
+                                              "Order lines that could not be reserved")
+API_KEY_REJECTIONS = registry.counter("api_key_rejections_total", "Requests rejected before routing",
+                                      ("reason",))
+LOAD_SHED_REJECTIONS = registry.counter("load_shed_rejections_total", "Requests answered 503 by load shedding",
+                                        ("priority", "reason"))
+for reason in ("invalid", "stock"):
+    ORDERS_REJECTED.labels(reason)
+for reason in ("missing", "invalid", "rate_limited"):
+    API_KEY_REJECTIONS.labels(reason)
@@ -0,0 +1,83 @@
+"""
+Money: amounts are stored as exact decimals with two places and computed as integers of minor units (cents), so
+totals do not pick up float rounding drift. Amounts keep float as their API and JSON type, each amount is converted
+to minor units once and the result converted back once.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+from operator import mul
+from typing import List, Optional, Sequence
+from sqlalchemy import Numeric
+from sqlalchemy.types import TypeDecorator
+
+MONEY_SCALE = 2
+MINOR_UNITS = 10 ** MONEY_SCALE
+CENT = Decimal(1).scaleb(-MONEY_SCALE)
+BASIS_POINTS = 10000
+
+
+def to_minor(amount) -> int:
+    """Amount (float, str, Decimal or int) in minor units, rounded half up to the cent"""
+    if isinstance(amount, float):
+        # Amounts written with at most two decimals scale to a whole number of minor units give or take float
+        # error, only the others need the exact decimal rounding
+        scaled = amount * MINOR_UNITS
+        minor = round(scaled)
+        if abs(scaled - minor) < 1e-6:
+            return int(minor)
+        amount = repr(amount)  # shortest repr is the decimal the float was written as
+    return int(Decimal(amount).quantize(CENT, rounding=ROUND_HALF_UP).scaleb(MONEY_SCALE))
+
+
+def from_minor(minor: int) -> float:
+    return minor / MINOR_UNITS
+
+
+def to_decimal(amount) -> Decimal:
+    """Amount as the exact decimal it is stored as"""
+    return Decimal(to_minor(amount)).scaleb(-MONEY_SCALE)
+
+
+def basis_points(rate: float) -> int:
+    """Rate as a fraction (0.2 is 20%) in basis points"""
+    return int((Decimal(repr(rate)) * BASIS_POINTS).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+class Money(TypeDecorator):
+    """Exact NUMERIC(12, 2) column read back as float, amounts are rounded half up to the cent when written"""
+    impl = Numeric(12, MONEY_SCALE, asdecimal=False)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return to_decimal(value)
+
+
+def order_totals(prices: Sequence[int], quantities: Sequence[int], offsets: Sequence[int],
+                 discounts: Optional[Sequence[int]] = None, tax_basis_points=0) -> List[int]:
+    """
+    Totals of orders in minor units from their lines, all orders in one pass. A line costs price * quantity less its
+    discount (capped at the line amount), plus tax on the rest rounded half up to the cent.
+    :param prices: unit price of each line in minor units
+    :param quantities: quantity of each line
+    :param offsets: index of the first line of each order, lines are grouped by order and orders are not empty
+    :param discounts: discount of each line in minor units
+    :param tax_basis_points: tax rate in basis points (2000 is 20%)
+    :return: total of each order
+    """
+    ends = list(offsets[1:]) + [len(prices)]
+    totals = []
+    for start, end in zip(offsets, ends):
+        if discounts is None and not tax_basis_points:
+            totals.append(sum(map(mul, prices[start:end], quantities[start:end])))
+            continue
+        amounts = list(map(mul, prices[start:end], quantities[start:end]))
+        if discounts is not None:
+            amounts = [amount - min(max(discount, 0), amount)
+                       for amount, discount in zip(amounts, discounts[start:end])]
+        total = sum(amounts)
+        if tax_basis_points:
+            total += sum((amount * tax_basis_points + BASIS_POINTS // 2) // BASIS_POINTS for amount in amounts)
+        totals.append(total)
+    return totals
+
@@ -0,0 +1,45 @@
+import base64
+import json
+from http import HTTPStatus
+from app.core.exception import CustomHTTPException
+
+
+def encode_cursor(sort, key, last_id):
+    """
+    Build an opaque keyset cursor from the sort key and id of the last row of a page
+    :param sort: name of the sort column
+    :param key: sort column value of the last row
+    :param last_id: id of the last row
+    :return: str
+    """
+    payload = json.dumps({"s": sort, "k": key, "id": last_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, sort):
+    """
+    Decode a cursor built by encode_cursor, it must belong to the requested sort order
+    :param cursor:
+    :param sort:
+    :return: (key, last_id)
+    """
+    _, key, last_id = decode_cursor_any(cursor, (sort,))
+    return key, last_id
+
+
+def decode_cursor_any(cursor, sorts):
+    """
+    Decode a cursor built by encode_cursor for any of the given sort orders
+    :param cursor:
+    :param sorts:
+    :return: (sort, key, last_id)
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if payload["s"] not in sorts or not isinstance(payload["id"], int):
+            raise ValueError("cursor does not match sort order")
+        return payload["s"], payload["k"], payload["id"]
+    except (ValueError, KeyError, TypeError) as err:
+        raise CustomHTTPException(status_code=HTTPStatus.BAD_REQUEST, detail="Invalid pagination cursor",
+                                  errors=str(err))
@@ -0,0 +1,89 @@
+"""
+Per-request SQL profiling. The profile of the current request lives in a ContextVar read by the engine
+statement hooks; SQLAlchemy runs async driver calls in greenlets sharing the context of the awaiting task
+(greenlet_spawn copies gr_context), so statements of async sessions are attributed to the right request.
+"""
+import re
+from collections import Counter
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+# Driver placeholders: ?, $1 with its optional type cast, %s and %(name)s
+PLACEHOLDER = re.compile(r"\?|\$\d+(?:::\w+)?|%\(\w+\)s|%s")
+# IN lists are expanded per value, their length must not make two statements different shapes
+PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+WHITESPACE = re.compile(r"\s+")
+
+EXPLAIN_PREFIXES = {
+    "postgresql": {"plan": "EXPLAIN ", "analyze": "EXPLAIN (ANALYZE, BUFFERS) "},
+    "sqlite": {"plan": "EXPLAIN QUERY PLAN ", "analyze": "EXPLAIN QUERY PLAN "},
+}
+
+current_profile: ContextVar[Optional["QueryProfile"]] = ContextVar("current_profile", default=None)
+# Name of the background job running in this context, its statements do not belong to any request
+background_task: ContextVar[Optional[str]] = ContextVar("background_task", default=None)
+
+
+def statement_shape(statement: str) -> str:
+    """Statement text with placeholders normalized and IN lists folded, equal shapes are the same query"""
+    shape = PLACEHOLDER.sub("?", WHITESPACE.sub(" ", statement.strip()))
+    return PLACEHOLDER_LIST.sub("(?...)", shape)
+
+
+class QueryProfile:
+    """Statements sent while a request was served"""
+
+    def __init__(self, explain=None, slow_query_seconds=None):
+        """
+        :param explain: None, plan or analyze, plan slow SELECT statements on the connection that ran them
+        :param slow_query_seconds: statements slower than this are explained
+        """
+        self.explain = explain
+        self.slow_query_seconds = slow_query_seconds
+        self.statements = 0
+        self.db_time = 0.0
+        self.shapes = Counter()
+        self.shape_time = Counter()
+        self.plans: List[Dict] = []
+
+    def record(self, statement, elapsed, conn=None, parameters=None, executemany=False):
+        self.statements += 1
+        self.db_time += elapsed
+        shape = statement_shape(statement)
+        self.shapes[shape] += 1
+        self.shape_time[shape] += elapsed
+        if (self.explain and conn is not None and not executemany and self.slow_query_seconds is not None
+                and elapsed >= self.slow_query_seconds and shape[:6].upper() == "SELECT"):
+            self.plans.append({"statement": shape, "ms": round(elapsed * 1000, 3),
+                               "plan": self._explain(conn, statement, parameters)})
+
+    def _explain(self, conn, statement, parameters):
+        """Run EXPLAIN on the raw DBAPI connection so that it is neither profiled nor timed"""
+        prefix = EXPLAIN_PREFIXES.get(conn.dialect.name, {}).get(self.explain)
+        if prefix is None:
+            return None
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute(prefix + statement, parameters)
+            return [" ".join(str(column) for column in row) for row in cursor.fetchall()]
+        except Exception as err:
+            return [f"EXPLAIN failed: {err}"]
+        finally:
+            cursor.close()
+
+    def duplicates(self) -> Dict[str, int]:
+        """Shapes sent more than once, N+1 loops show up here"""
+        return {shape: count for shape, count in self.shapes.most_common() if count > 1}
+
+    def summary(self) -> str:
+        return (f"statements={self.statements}; db_ms={self.db_time * 1000:.3f}; "
+                f"duplicates={sum(count - 1 for count in self.shapes.values())}")
+
+    def report(self) -> Dict:
+        return {
+            "statements": self.statements,
+            "db_ms": round(self.db_time * 1000, 3),
+            "duplicates": [{"statement": shape, "count": count, "ms": round(self.shape_time[shape] * 1000, 3)}
+                           for shape, count in self.duplicates().items()],
+            "plans": self.plans,
+        }
@@ -0,0 +1,94 @@
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional
+from app.core.config import setup_logging
+
+logger = setup_logging(__name__)
+
+
+class RateLimiter(ABC):
+    """Token buckets by key: a bucket holds up to `burst` tokens, refilled at `rate` tokens per second"""
+
+    @abstractmethod
+    async def acquire(self, key, rate, burst) -> float:
+        """
+        Take one token from the bucket of key
+        :return: 0 when a token was taken, else seconds until the next token is available
+        """
+
+
+class MemoryRateLimiter(RateLimiter):
+    """Buckets of this worker only, the effective limit is multiplied by the number of workers"""
+
+    def __init__(self):
+        self._buckets: Dict[str, List[float]] = {}  # key -> [tokens, refilled_at]
+
+    async def acquire(self, key, rate, burst):
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [burst, now]
+        tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return 0.0
+        bucket[0] = tokens
+        return (1 - tokens) / rate
+
+
+# Refill and take in one round trip, atomic across workers. Returned as a string, redis truncates Lua numbers.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'refilled_at')
+local tokens = tonumber(bucket[1]) or burst
+local refilled_at = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(now - refilled_at, 0) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'refilled_at', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+class RedisRateLimiter(RateLimiter):
+    """Buckets shared by all workers. Requests are let through while redis is unreachable."""
+
+    def __init__(self, url, prefix="ecommerce:ratelimit:"):
+        try:
+            from redis import asyncio as redis
+        except ImportError as err:
+            raise RuntimeError("The redis rate limit backend requires the 'redis' package") from err
+        self.prefix = prefix
+        self._client = redis.from_url(url)
+        self._script = self._client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    async def acquire(self, key, rate, burst):
+        try:
+            return float(await self._script(keys=[self.prefix + key], args=[rate, burst, time.time()]))
+        except Exception as err:
+            logger.error(f"Rate limit check failed, request allowed | {err}")
+            return 0.0
+
+
+def build_rate_limiter(backend, redis_url=None) -> Optional[RateLimiter]:
+    """
+    Create the configured rate limiter
+    :param backend: memory, redis or none
+    :param redis_url:
+    :return: RateLimiter, None when rate limiting is off
+    """
+    if backend == "memory":
+        return MemoryRateLimiter()
+    if backend == "redis":
+        return RedisRateLimiter(redis_url)
+    if backend == "none":
+        return None
+    raise ValueError(f"Unknown rate limit backend: {backend}")
@@ -0,0 +1,42 @@
+import json
+from operator import itemgetter
+from fastapi.responses import JSONResponse, ORJSONResponse
+from app.core.config import settings
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional, the stdlib encoder is the fallback
+    orjson = None
+
+
+def json_response_class():
+    """Response class used app-wide, orjson unless disabled or not installed"""
+    if settings.JSON_RESPONSE_BACKEND == "orjson" and orjson is not None:
+        return ORJSONResponse
+    return JSONResponse
+
+
+def dumps(content) -> bytes:
+    """Encode JSON with the configured backend"""
+    if json_response_class() is ORJSONResponse:
+        return orjson.dumps(content)
+    return json.dumps(content, separators=(",", ":")).encode()
+
+
+def compile_row_serializer(fields):
+    """
+    Build a function turning a result row (tuple) into a dict with the given keys. The keys and the item getter
+    are prepared once, so each row costs one dict build instead of per field attribute lookups or model validation.
+    :param fields: column names in row order
+    :return: callable(row) -> dict
+    """
+    keys = tuple(fields)
+    if len(keys) == 1:
+        key = keys[0]
+        return lambda row: {key: row[0]}
+    values = itemgetter(*range(len(keys)))
+
+    def serialize(row):
+        return dict(zip(keys, values(row)))
+
+    return serialize
@@ -0,0 +1,86 @@
+import csv
+import json
+from typing import AsyncIterator, Dict, Tuple, Union
+
+
+def _decode(line: bytes) -> Union[str, ValueError]:
+    try:
+        return line.rstrip(b"\r").decode("utf-8")
+    except UnicodeDecodeError as err:
+        return ValueError(f"Invalid UTF-8 at byte {err.start}")
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[Union[str, ValueError]]:
+    """
+    Split a byte stream into decoded lines without holding more than one partial line in memory
+    :param chunks:
+    :return: lines without line terminator, lines that are not valid UTF-8 as ValueError
+    """
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield _decode(line)
+    if buffer:
+        yield _decode(buffer)
+
+
+async def iter_ndjson_records(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, Dict]]:
+    """
+    Parse newline delimited JSON, blank lines are skipped, malformed lines are yielded as ValueError
+    :param chunks:
+    :return: (line number, record or ValueError)
+    """
+    line_number = 0
+    async for line in iter_lines(chunks):
+        line_number += 1
+        if isinstance(line, ValueError):
+            yield line_number, line
+            continue
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("Line must be a JSON object")
+        except ValueError as err:
+            record = ValueError(str(err))
+        yield line_number, record
+
+
+async def iter_csv_records(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, Dict]]:
+    """
+    Parse CSV with a header row. A quoted field may span lines, the record is complete once its quotes balance.
+    :param chunks:
+    :return: (line number of the record start, record or ValueError)
+    """
+    header = None
+    pending, start = [], 0
+    line_number = 0
+    async for line in iter_lines(chunks):
+        line_number += 1
+        if not pending:
+            start = line_number
+        if isinstance(line, ValueError):
+            # The record the line belongs to is rejected
+            pending = []
+            yield start, line
+            continue
+        pending.append(line)
+        text = "\n".join(pending)
+        if text.count('"') % 2:
+            continue
+        pending = []
+        if not text.strip():
+            continue
+        values = next(csv.reader([text]))
+        if header is None:
+            header = [column.strip() for column in values]
+            continue
+        if len(values) != len(header):
+            yield start, ValueError(f"Expected {len(header)} columns, got {len(values)}")
+            continue
+        yield start, dict(zip(header, values))
+    if pending:
+        yield start, ValueError("Unterminated quoted field")
@@ -1,13 +1,25 @@
-import time
+import asyncio
 import traceback
+from contextlib import asynccontextmanager
 from pathlib import Path
-from fastapi import APIRouter, FastAPI, Request
+from fastapi import APIRouter, FastAPI, Request, Response
 import uvicorn
 from fastapi.exceptions import RequestValidationError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from starlette.responses import JSONResponse
 from app.api.api import api_router
+from app.api.v1.models.api_keys import api_key_registry
+from app.api.v1.models.base import dispose_engines, get_async_session_factory
+from app.api.v1.models.outbox import order_outbox
+from app.api.v1.models.warmup import readiness, warm_up
 from app.core.config import setup_logging, log_entry_point, settings
 from app.core.exception import CustomHTTPException, custom_http_exception_handler
+from app.core.metrics import CONTENT_TYPE, registry
+from app.middlewares.authentication import APIKeyMiddleware
+from app.middlewares.load_shedding import LoadSheddingMiddleware
+from app.middlewares.metrics import MetricsMiddleware
+from app.middlewares.profiling import SQLProfilingMiddleware
+from app.core.responses import json_response_class
 from fastapi.middleware.cors import CORSMiddleware
 from http import HTTPStatus
 
@@ -15,17 +27,52 @@ from http import HTTPStatus
 BASE_PATH = Path(__file__).resolve().parent
 
 router = APIRouter()
-app = FastAPI(title="Ecommerce Platform", version="1.0")
-
 logger = setup_logging(__name__)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Warm the worker up in the background and run the order outbox dispatcher for its lifetime. Startup does not
+    wait for the database: the server answers /health/live at once and /health/ready once warm-up finished.
+    """
+    readiness.start()
+    # Resolved like the request dependency so that an overridden session factory is used here too
+    session_factory = app.dependency_overrides.get(get_async_session_factory, get_async_session_factory)()
+    api_key_registry.session_factory = session_factory
+    if settings.OUTBOX_DISPATCHER_ENABLED:
+        order_outbox.start(session_factory)
+    warm_up_task = None
+    if settings.WARMUP_ENABLED:
+        warm_up_task = asyncio.create_task(warm_up(session_factory, readiness), name="warm-up")
+    else:
+        readiness.set_ready()
+    yield
+    # Fail readiness first so that the load balancer stops routing here while in-flight work drains
+    readiness.state = "stopping"
+    if warm_up_task is not None:
+        warm_up_task.cancel()
+    await order_outbox.stop()
+    await dispose_engines()
+
+
+app = FastAPI(title="Ecommerce Platform", version="1.0", default_response_class=json_response_class(),
+              lifespan=lifespan)
+
+# Added first so that they run inside CORS: preflights pass and rejections get CORS headers. Load shedding runs
+# after authentication, rejected keys never take a slot.
+app.add_middleware(LoadSheddingMiddleware)
+app.add_middleware(APIKeyMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
-    allow_headers=["*"]
+    allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "X-Process-Time", "X-SQL-Profile"]
 )
+app.add_middleware(SQLProfilingMiddleware)
+app.add_middleware(MetricsMiddleware)
 app.add_exception_handler(CustomHTTPException, custom_http_exception_handler)
 
 
@@ -47,15 +94,23 @@ async def root(req: Request) -> dict:
     }
 
 
-@app.middleware("http")
-async def add_process_time_header(request: Request, call_next):
-    """Add the request processing time to the header."""
-    start_time = time.time()
-    response = await call_next(request)
-    process_time = time.time() - start_time
-    response.headers["X-Process-Time"] = str(process_time)
-    logger.debug(f"X-Process-Time: {str(process_time)}")
-    return response
+@router.get("/health/live", include_in_schema=False)
+async def liveness():
+    """The worker is up and serving its event loop."""
+    return {"status": "alive"}
+
+
+@router.get("/health/ready", include_in_schema=False)
+async def readiness_probe():
+    """Ready to take traffic: warm-up finished and the worker is not shutting down."""
+    return JSONResponse(readiness.as_dict(),
+                        status_code=200 if readiness.ready else 503)
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint."""
+    return Response(registry.render(), media_type=CONTENT_TYPE)
 
 
 @app.exception_handler(TypeError)
@@ -70,6 +125,17 @@ async def type_error_handler(request: Request, exc: TypeError):
     )
 
 
+@app.exception_handler(PoolTimeoutError)
+async def pool_timeout_handler(request: Request, exc: PoolTimeoutError):
+    """Returns Service Unavailable when no database connection could be checked out in time."""
+    logger.error(f"Database pool exhausted | {request.method} {request.url.path} | {exc}")
+    return JSONResponse(
+        content={"message": "Service temporarily unavailable", "detail": "Database connection pool exhausted"},
+        status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+        headers={"Retry-After": str(max(int(settings.DB_POOL_TIMEOUT), 1))},
+    )
+
+
 @app.exception_handler(Exception)
 async def generic_exception_handler(request: Request, exc: Exception):
     """Returns Generic Exception Handler."""
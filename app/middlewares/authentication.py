@@ -1,27 +1,61 @@
-from http import HTTPStatus
-from fastapi import Depends, Request, Header
+import math
+from typing import Optional
+from fastapi.security import APIKeyHeader
+from starlette.types import ASGIApp, Receive, Scope, Send
+from app.api.v1.models.api_keys import ApiKeyRegistry, api_key_registry
 from app.core.config import settings
-from app.core.exception import CustomHTTPException
+from app.core.exception import CustomHTTPException, error_content
+from app.core.metrics import API_KEY_REJECTIONS
+from app.core.rate_limit import RateLimiter, build_rate_limiter
+from app.core.responses import json_response_class
 
+API_KEY_HEADER = b"x-api-key"
+JSONResponse = json_response_class()
 
-# Check for the request if X-API-KEY is present in the headers
-def get_api_key(request: Request):
-    api_key = request.headers.get("X_API_KEY", None)
-    if api_key is None:
-        raise CustomHTTPException(status_code=HTTPStatus.UNAUTHORIZED, detail="Missing API Key")
-    return api_key
+# Documents the X-API-KEY header in the OpenAPI schema, keys are checked by APIKeyMiddleware
+api_key_header = APIKeyHeader(name="X-API-KEY", description="Your API key", auto_error=False)
 
 
-# Validate the X-API-KEY with the value in the .env
-def validate_api_key(api_key: str = Depends(get_api_key)):
-    if api_key != settings.API_KEY:
-        raise CustomHTTPException(
-            status_code=HTTPStatus.UNAUTHORIZED, detail="Invalid API Key"
-        )
+class APIKeyMiddleware:
+    """
+    Pure ASGI middleware authenticating API requests by their X-API-KEY header against the in-memory key
+    registry and rate limiting them per key. Rejected requests are answered before routing and before their
+    body is read. Paths outside of prefix (/metrics, docs) are not checked.
+    """
 
+    def __init__(self, app: ASGIApp, registry: ApiKeyRegistry = api_key_registry,
+                 limiter: Optional[RateLimiter] = None, prefix=settings.API_V1_STR):
+        self.app = app
+        self.registry = registry
+        self.limiter = limiter or build_rate_limiter(settings.API_RATE_LIMIT_BACKEND, settings.REDIS_URL)
+        self.prefix = prefix
 
-# pass auth middleware to include routes
-def auth_middleware(
-    X_API_KEY: str = Header(..., description="Your X_API_KEY header for authentication")
-):
-    validate_api_key(X_API_KEY)
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefix):
+            await self.app(scope, receive, send)
+            return
+
+        key = next((value for name, value in scope["headers"] if name == API_KEY_HEADER), None)
+        if key is None:
+            await self._reject(scope, receive, send, "missing", 401, "Missing API Key")
+            return
+        record = await self.registry.lookup(key.decode("latin-1"))
+        if record is None:
+            await self._reject(scope, receive, send, "invalid", 401, "Invalid API Key")
+            return
+        if self.limiter is not None and record.rate > 0:
+            wait = await self.limiter.acquire(record.key_hash, record.rate, record.burst)
+            if wait > 0:
+                await self._reject(scope, receive, send, "rate_limited", 429,
+                                   "Rate limit exceeded", {"Retry-After": str(math.ceil(wait))})
+                return
+
+        # The record of the authenticated key, its key_hash identifies the client (names need not be unique)
+        scope.setdefault("state", {})["api_key"] = record
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    async def _reject(scope, receive, send, reason, status_code, detail, headers=None):
+        API_KEY_REJECTIONS.labels(reason).inc()
+        content = error_content(CustomHTTPException(status_code=status_code, detail=detail))
+        await JSONResponse(content, status_code=status_code, headers=headers)(scope, receive, send)
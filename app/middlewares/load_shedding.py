@@ -0,0 +1,78 @@
+import math
+import time
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.core.concurrency import AdaptiveLimiter, Overloaded
+from app.core.config import settings
+from app.core.exception import CustomHTTPException, error_content
+from app.core.metrics import LOAD_SHED_REJECTIONS, registry
+from app.core.responses import json_response_class
+
+JSONResponse = json_response_class()
+
+# Lower is served first: order placement, other writes, reads
+PRIORITY_ORDERS, PRIORITY_WRITES, PRIORITY_READS = 0, 1, 2
+PRIORITY_NAMES = ("orders", "writes", "reads")
+ORDERS_PATH = f"{settings.API_V1_STR}/ecommerce/orders"
+# Streaming imports and exports run for minutes and pace themselves, they would skew the latency signal
+EXEMPT_SUFFIXES = (":import", ":export")
+
+
+class LoadSheddingMiddleware:
+    """
+    Pure ASGI middleware bounding the API requests a worker serves at once by an adaptive limit. Requests over
+    the limit wait in a priority queue, order placement first, and are answered 503 with Retry-After when the
+    queue is full or they would wait longer than LOAD_SHED_QUEUE_TIMEOUT, instead of piling up on the pool.
+    """
+
+    def __init__(self, app: ASGIApp, limiter: AdaptiveLimiter = None, timeout=None, prefix=settings.API_V1_STR):
+        self.app = app
+        self.limiter = limiter or request_limiter
+        self.timeout = settings.LOAD_SHED_QUEUE_TIMEOUT if timeout is None else timeout
+        self.prefix = prefix
+
+    @staticmethod
+    def priority(scope: Scope):
+        if scope["method"] in ("GET", "HEAD"):
+            return PRIORITY_READS
+        if scope["path"].startswith(ORDERS_PATH):
+            return PRIORITY_ORDERS
+        return PRIORITY_WRITES
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if (scope["type"] != "http" or not settings.LOAD_SHED_ENABLED or not scope["path"].startswith(self.prefix)
+                or scope["path"].endswith(EXEMPT_SUFFIXES)):
+            await self.app(scope, receive, send)
+            return
+
+        priority = self.priority(scope)
+        try:
+            await self.limiter.acquire(priority, self.timeout)
+        except Overloaded as err:
+            LOAD_SHED_REJECTIONS.labels(PRIORITY_NAMES[priority], err.reason).inc()
+            content = error_content(CustomHTTPException(status_code=503, detail="Service overloaded, retry later"))
+            response = JSONResponse(content, status_code=503,
+                                    headers={"Retry-After": str(max(math.ceil(err.retry_after), 1))})
+            await response(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        failed = True
+
+        async def send_with_status(message: Message):
+            nonlocal failed
+            if message["type"] == "http.response.start":
+                failed = message["status"] >= 500
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.limiter.release(time.perf_counter() - start, failed)
+
+
+request_limiter = AdaptiveLimiter(settings.LOAD_SHED_INITIAL_LIMIT, settings.LOAD_SHED_MIN_LIMIT,
+                                  settings.LOAD_SHED_MAX_LIMIT, settings.LOAD_SHED_MAX_QUEUE,
+                                  settings.LOAD_SHED_TARGET_LATENCY_MS / 1000, reserve=settings.LOAD_SHED_ORDER_RESERVE)
+registry.callback("load_shed_requests", "Adaptive concurrency limit, requests served and queued", ("state",),
+                  lambda: {("limit",): round(request_limiter.limit, 2), ("in_flight",): request_limiter.in_flight,
+                           ("queued",): request_limiter.queued})
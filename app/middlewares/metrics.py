@@ -0,0 +1,40 @@
+import time
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.core.metrics import HTTP_REQUEST_DURATION, HTTP_REQUESTS_IN_FLIGHT
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording request latency by route template and status, and requests in flight.
+    Latency is measured with a monotonic clock and also sent back in the X-Process-Time header.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.in_flight = HTTP_REQUESTS_IN_FLIGHT.labels()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_with_timing(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                MutableHeaders(scope=message).append("X-Process-Time", f"{time.perf_counter() - start:.6f}")
+            await send(message)
+
+        self.in_flight.inc()
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            self.in_flight.dec()
+            # Routes are labelled by their template so that path parameters do not explode the label set
+            route = scope.get("route")
+            HTTP_REQUEST_DURATION.labels(scope["method"], getattr(route, "path", "unmatched"), str(status_code)) \
+                .observe(time.perf_counter() - start)
@@ -0,0 +1,52 @@
+import json
+import time
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.core.config import settings, setup_logging
+from app.core.profiling import QueryProfile, current_profile
+
+logger = setup_logging(__name__)
+
+PROFILE_HEADER = b"x-sql-profile"
+
+
+class SQLProfilingMiddleware:
+    """
+    Profile the statements of a request when SQL_PROFILE_ENABLED is set, or when the request asks for it with
+    an X-SQL-Profile: 1 header. The summary is sent back in the X-SQL-Profile response header and slow requests
+    are logged with their repeated statement shapes and query plans.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    def _requested(self, scope: Scope):
+        if settings.SQL_PROFILE_ENABLED:
+            return True
+        if not settings.SQL_PROFILE_HEADER_ENABLED:
+            return False
+        return any(name == PROFILE_HEADER and value in (b"1", b"true") for name, value in scope["headers"])
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not self._requested(scope):
+            await self.app(scope, receive, send)
+            return
+
+        explain = settings.SQL_PROFILE_EXPLAIN if settings.SQL_PROFILE_EXPLAIN != "off" else None
+        profile = QueryProfile(explain, settings.SQL_PROFILE_SLOW_QUERY_MS / 1000)
+        start = time.perf_counter()
+
+        async def send_with_summary(message: Message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append("X-SQL-Profile", profile.summary())
+            await send(message)
+
+        token = current_profile.set(profile)
+        try:
+            await self.app(scope, receive, send_with_summary)
+        finally:
+            current_profile.reset(token)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if elapsed_ms >= settings.SQL_PROFILE_SLOW_REQUEST_MS:
+                logger.warning(f"Slow request | {scope['method']} {scope['path']} | {elapsed_ms:.1f} ms | "
+                               f"{json.dumps(profile.report())}")
@@ -0,0 +1,38 @@
+from logging.config import fileConfig
+from alembic import context
+from sqlalchemy import create_engine
+from sqlalchemy.pool import NullPool
+from app.api.v1.models.base import Base
+from app.core.config import settings
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+target_metadata = Base.metadata
+database_url = context.get_x_argument(as_dictionary=True).get("database_url") or settings.DATABASE_URL
+
+
+def run_migrations_offline():
+    """Print the SQL of the migrations instead of running them: alembic upgrade head --sql"""
+    context.configure(url=database_url, target_metadata=target_metadata, literal_binds=True,
+                      dialect_opts={"paramstyle": "named"})
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    engine = create_engine(database_url, poolclass=NullPool)
+    with engine.connect() as connection:
+        # sqlite cannot alter tables in place, batch mode recreates them
+        context.configure(connection=connection, target_metadata=target_metadata,
+                          render_as_batch=connection.dialect.name == "sqlite")
+        with context.begin_transaction():
+            context.run_migrations()
+    engine.dispose()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,60 @@
+"""initial schema
+
+The schema create_all made at import before the app had migrations: products, orders and their items. Databases
+created that way are marked with `alembic stamp 0001` and then upgraded to head.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 19:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def timestamps():
+    return [
+        sa.Column("created_at", sa.TIMESTAMP(timezone=True), nullable=False, server_default=sa.func.now()),
+        sa.Column("updated_at", sa.TIMESTAMP(timezone=True), nullable=False, server_default=sa.func.now()),
+    ]
+
+
+def upgrade():
+    op.create_table(
+        "products",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("name", sa.String()),
+        sa.Column("description", sa.String()),
+        sa.Column("price", sa.Float()),
+        sa.Column("stock", sa.Integer()),
+        *timestamps(),
+    )
+    op.create_index("ix_products_id", "products", ["id"])
+    op.create_index("ix_products_name", "products", ["name"])
+
+    op.create_table(
+        "orders",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("total_price", sa.Float()),
+        sa.Column("status", sa.String()),
+        *timestamps(),
+    )
+    op.create_index("ix_orders_id", "orders", ["id"])
+
+    op.create_table(
+        "order_items",
+        sa.Column("order_id", sa.Integer(), sa.ForeignKey("orders.id"), primary_key=True),
+        sa.Column("product_id", sa.Integer(), sa.ForeignKey("products.id"), primary_key=True),
+        sa.Column("quantity", sa.Integer()),
+    )
+    op.create_index("ix_order_items_order_id", "order_items", ["order_id"])
+    op.create_index("ix_order_items_product_id", "order_items", ["product_id"])
+
+
+def downgrade():
+    for table in ("order_items", "orders", "products"):
+        op.drop_table(table)
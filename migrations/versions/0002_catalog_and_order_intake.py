@@ -0,0 +1,105 @@
+"""catalog and order intake
+
+Tables, columns and indexes added on top of the create_all schema before the app had migrations: product skus
+with the search, keyset and export indexes, stock shards, the order outbox, idempotency keys and API keys.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 19:30:00
+"""
+from alembic import op
+import sqlalchemy as sa
+from app.core.config import settings
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+# Same expression as product_search_vector, the search query must match it to use the index
+PRODUCT_SEARCH_VECTOR = (
+    "(setweight(to_tsvector('english'::regconfig, coalesce(name, '')), 'A') "
+    "|| setweight(to_tsvector('english'::regconfig, coalesce(description, '')), 'B') "
+    "|| to_tsvector('simple'::regconfig, coalesce(name, '')) "
+    "|| to_tsvector('simple'::regconfig, coalesce(description, '')))"
+)
+
+
+def upgrade():
+    postgresql = op.get_bind().dialect.name == "postgresql"
+    trigram = postgresql and settings.SEARCH_TRIGRAM_ENABLED
+    if trigram:
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    # SQLite cannot add a unique constraint to a table, batch mode copies the table there
+    with op.batch_alter_table("products") as batch_op:
+        batch_op.add_column(sa.Column("sku", sa.String(), nullable=True))
+        batch_op.create_unique_constraint("products_sku_key", ["sku"])
+    op.create_index("ix_products_price_id", "products", ["price", "id"])
+    op.create_index("ix_products_name_id", "products", ["name", "id"])
+    op.create_index("ix_products_updated_at_id", "products", ["updated_at", "id"])
+    if postgresql:
+        op.create_index("ix_products_search_vector", "products", [sa.text(PRODUCT_SEARCH_VECTOR)],
+                        postgresql_using="gin")
+    if trigram:
+        op.create_index("ix_products_name_trgm", "products", ["name"], postgresql_using="gin",
+                        postgresql_ops={"name": "gin_trgm_ops"})
+
+    op.create_table(
+        "product_stock_shards",
+        sa.Column("product_id", sa.Integer(), sa.ForeignKey("products.id"), primary_key=True),
+        sa.Column("shard", sa.Integer(), primary_key=True),
+        sa.Column("stock", sa.Integer(), nullable=False),
+    )
+
+    op.create_table(
+        "order_outbox",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("order_id", sa.Integer(), sa.ForeignKey("orders.id"), nullable=False),
+        sa.Column("event", sa.String(), nullable=False),
+        sa.Column("payload", sa.Text(), nullable=False),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("available_at", sa.TIMESTAMP(timezone=True), nullable=False, server_default=sa.func.now()),
+        sa.Column("last_error", sa.Text()),
+        sa.Column("created_at", sa.TIMESTAMP(timezone=True), nullable=False, server_default=sa.func.now()),
+        sa.Column("dispatched_at", sa.TIMESTAMP(timezone=True)),
+    )
+    op.create_index("ix_order_outbox_order_id", "order_outbox", ["order_id"])
+    op.create_index("ix_order_outbox_pending", "order_outbox", ["available_at", "id"],
+                    postgresql_where=sa.text("status = 'pending'"), sqlite_where=sa.text("status = 'pending'"))
+
+    op.create_table(
+        "idempotency_keys",
+        sa.Column("key", sa.String(), primary_key=True),
+        sa.Column("fingerprint", sa.String(), nullable=False),
+        sa.Column("status_code", sa.Integer()),
+        sa.Column("response", sa.Text()),
+        sa.Column("expires_at", sa.TIMESTAMP(timezone=True), nullable=False),
+        sa.Column("created_at", sa.TIMESTAMP(timezone=True), nullable=False, server_default=sa.func.now()),
+    )
+    op.create_index("ix_idempotency_keys_expires_at", "idempotency_keys", ["expires_at"])
+
+    op.create_table(
+        "api_keys",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("key_hash", sa.String(), nullable=False, unique=True),
+        sa.Column("rate_limit", sa.Float()),
+        sa.Column("burst", sa.Integer()),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("expires_at", sa.TIMESTAMP(timezone=True)),
+        sa.Column("created_at", sa.TIMESTAMP(timezone=True), nullable=False, server_default=sa.func.now()),
+    )
+
+
+def downgrade():
+    for table in ("api_keys", "idempotency_keys", "order_outbox", "product_stock_shards"):
+        op.drop_table(table)
+    for index in ("ix_products_name_trgm", "ix_products_search_vector"):
+        op.execute(f"DROP INDEX IF EXISTS {index}")
+    for index in ("ix_products_updated_at_id", "ix_products_name_id", "ix_products_price_id"):
+        op.drop_index(index, table_name="products")
+    with op.batch_alter_table("products") as batch_op:
+        batch_op.drop_constraint("products_sku_key", type_="unique")
+        batch_op.drop_column("sku")
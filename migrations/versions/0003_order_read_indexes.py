@@ -0,0 +1,54 @@
+"""order read indexes
+
+Order listings by status and time, orders carry their item count, order items of a page of orders are read from
+a covering index that replaces the single column order_id index. On Postgres the indexes are built concurrently,
+outside of the migration transaction, so placing orders is not blocked while they build. The item counts are
+backfilled in batches of order ids, each committed on its own, so only the orders of one batch are locked at a
+time instead of the whole table until the migration ends.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 21:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH_SIZE = 10000
+
+
+def upgrade():
+    postgresql = op.get_bind().dialect.name == "postgresql"
+    op.add_column("orders", sa.Column("item_count", sa.Integer(), nullable=False, server_default="0"))
+
+    with op.get_context().autocommit_block():
+        last_id = op.get_bind().execute(sa.text("SELECT max(id) FROM orders")).scalar() or 0
+        for start in range(0, last_id, BACKFILL_BATCH_SIZE):
+            op.execute(sa.text("UPDATE orders SET item_count = "
+                               "(SELECT count(*) FROM order_items WHERE order_items.order_id = orders.id) "
+                               "WHERE orders.id > :start AND orders.id <= :end")
+                       .bindparams(start=start, end=start + BACKFILL_BATCH_SIZE))
+
+        op.create_index("ix_orders_status_created_at_id", "orders", ["status", "created_at", "id"],
+                        postgresql_include=["total_price", "item_count"], postgresql_concurrently=True)
+        op.create_index("ix_orders_created_at_id", "orders", ["created_at", "id"], postgresql_concurrently=True)
+        if postgresql:
+            op.create_index("ix_order_items_order_id_covering", "order_items", ["order_id", "product_id"],
+                            postgresql_include=["quantity"], postgresql_concurrently=True)
+        # Served by the primary key (order_id, product_id) and the covering index
+        op.drop_index("ix_order_items_order_id", "order_items", postgresql_concurrently=True)
+
+
+def downgrade():
+    postgresql = op.get_bind().dialect.name == "postgresql"
+    op.create_index("ix_order_items_order_id", "order_items", ["order_id"])
+    if postgresql:
+        op.drop_index("ix_order_items_order_id_covering", "order_items")
+    op.drop_index("ix_orders_created_at_id", "orders")
+    op.drop_index("ix_orders_status_created_at_id", "orders")
+    with op.batch_alter_table("orders") as batch:
+        batch.drop_column("item_count")
@@ -0,0 +1,77 @@
+"""sales analytics
+
+Precomputed sales aggregates and the low stock watchlist. They are backfilled from the orders whose outbox event is
+finished; orders with a pending event are added by the dispatcher once it finishes them.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19 10:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+from app.core.config import settings
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+FINISHED_ORDERS = "NOT EXISTS (SELECT 1 FROM order_outbox e WHERE e.order_id = o.id AND e.status = 'pending')"
+HOUR_BUCKET = {
+    "postgresql": "date_trunc('hour', o.created_at AT TIME ZONE 'UTC') AT TIME ZONE 'UTC'",
+    # Same text format as the timestamps SQLAlchemy writes, so that upserts of the dispatcher hit these rows
+    "sqlite": "strftime('%Y-%m-%d %H:00:00.000000', o.created_at)",
+}
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    op.create_table(
+        "product_sales",
+        sa.Column("product_id", sa.Integer(), sa.ForeignKey("products.id"), primary_key=True),
+        sa.Column("units", sa.Integer(), nullable=False),
+        sa.Column("orders", sa.Integer(), nullable=False),
+        sa.Column("last_order_at", sa.TIMESTAMP(timezone=True)),
+    )
+    op.create_index("ix_product_sales_units", "product_sales", ["units", "product_id"])
+    op.create_table(
+        "sales_by_hour",
+        sa.Column("bucket", sa.TIMESTAMP(timezone=True), primary_key=True),
+        sa.Column("orders", sa.Integer(), nullable=False),
+        sa.Column("units", sa.Integer(), nullable=False),
+        sa.Column("revenue", sa.Float(), nullable=False),
+    )
+    op.create_table(
+        "low_stock_products",
+        sa.Column("product_id", sa.Integer(), sa.ForeignKey("products.id"), primary_key=True),
+        sa.Column("name", sa.String()),
+        sa.Column("stock", sa.Integer(), nullable=False),
+        sa.Column("updated_at", sa.TIMESTAMP(timezone=True), nullable=False, server_default=sa.func.now()),
+    )
+
+    op.execute(
+        "INSERT INTO product_sales (product_id, units, orders, last_order_at) "
+        "SELECT i.product_id, sum(i.quantity), count(*), max(o.created_at) "
+        f"FROM order_items i JOIN orders o ON o.id = i.order_id WHERE {FINISHED_ORDERS} GROUP BY i.product_id"
+    )
+    op.execute(
+        "INSERT INTO sales_by_hour (bucket, orders, units, revenue) "
+        f"SELECT {HOUR_BUCKET[dialect]} AS bucket, count(*), "
+        "sum((SELECT coalesce(sum(i.quantity), 0) FROM order_items i WHERE i.order_id = o.id)), "
+        "coalesce(sum(o.total_price), 0) "
+        f"FROM orders o WHERE {FINISHED_ORDERS} GROUP BY 1"
+    )
+    op.execute(sa.text(
+        "INSERT INTO low_stock_products (product_id, name, stock) "
+        "SELECT p.id, p.name, p.stock + coalesce((SELECT sum(s.stock) FROM product_stock_shards s "
+        "WHERE s.product_id = p.id), 0) AS stock "
+        "FROM products p JOIN product_sales ps ON ps.product_id = p.id "
+        "WHERE p.stock + coalesce((SELECT sum(s.stock) FROM product_stock_shards s "
+        "WHERE s.product_id = p.id), 0) <= :threshold"
+    ).bindparams(threshold=settings.LOW_STOCK_THRESHOLD))
+
+
+def downgrade():
+    op.drop_table("low_stock_products")
+    op.drop_table("sales_by_hour")
+    op.drop_table("product_sales")
@@ -0,0 +1,43 @@
+"""money numeric
+
+Product prices, order totals and hourly revenue become exact NUMERIC(12, 2) amounts instead of floats, existing
+amounts are rounded half up to the cent. On Postgres the columns are rewritten in place, which holds an exclusive
+lock on products, orders and sales_by_hour while it runs; sqlite copies the tables.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19 14:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+MONEY_COLUMNS = (("products", "price", True), ("orders", "total_price", True), ("sales_by_hour", "revenue", False))
+
+
+def upgrade():
+    postgresql = op.get_bind().dialect.name == "postgresql"
+    for table, column, nullable in MONEY_COLUMNS:
+        if postgresql:
+            # round() of double precision is round half even, of numeric round half up
+            op.alter_column(table, column, type_=sa.Numeric(12, 2), existing_nullable=nullable,
+                            postgresql_using=f"round({column}::numeric, 2)")
+        else:
+            op.execute(f"UPDATE {table} SET {column} = round({column}, 2)")
+            with op.batch_alter_table(table) as batch:
+                batch.alter_column(column, type_=sa.Numeric(12, 2), existing_nullable=nullable)
+
+
+def downgrade():
+    postgresql = op.get_bind().dialect.name == "postgresql"
+    for table, column, nullable in MONEY_COLUMNS:
+        if postgresql:
+            op.alter_column(table, column, type_=sa.Float(), existing_nullable=nullable,
+                            postgresql_using=f"{column}::double precision")
+        else:
+            with op.batch_alter_table(table) as batch:
+                batch.alter_column(column, type_=sa.Float(), existing_nullable=nullable)
@@ -0,0 +1,43 @@
+"""pricing rules
+
+Promotion rules evaluated by the pricing engine, and the product category targeted by category sales. The category
+is nullable, adding it does not rewrite products.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-19 18:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("products", sa.Column("category", sa.String()))
+    op.create_table(
+        "pricing_rules",
+        sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("kind", sa.String(), nullable=False),
+        sa.Column("product_id", sa.Integer(), sa.ForeignKey("products.id")),
+        sa.Column("category", sa.String()),
+        sa.Column("percent", sa.Float()),
+        sa.Column("amount", sa.Numeric(12, 2)),
+        sa.Column("buy_quantity", sa.Integer()),
+        sa.Column("free_quantity", sa.Integer()),
+        sa.Column("starts_at", sa.TIMESTAMP(timezone=True)),
+        sa.Column("ends_at", sa.TIMESTAMP(timezone=True)),
+        sa.Column("status", sa.String(), nullable=False),
+        sa.Column("created_at", sa.TIMESTAMP(timezone=True), nullable=False, server_default=sa.func.now()),
+        sa.Column("updated_at", sa.TIMESTAMP(timezone=True), nullable=False, server_default=sa.func.now()),
+    )
+
+
+def downgrade():
+    op.drop_table("pricing_rules")
+    with op.batch_alter_table("products") as batch:
+        batch.drop_column("category")
@@ -0,0 +1,64 @@
+import json
+import os
+import tempfile
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from app.api.v1.models.base import Base
+from app.api.v1.models.database import build_async_engine
+
+
+def default_database_url():
+    """Benchmarks run against a throwaway sqlite file unless BENCH_DATABASE_URL points elsewhere"""
+    return os.environ.get("BENCH_DATABASE_URL") or f"sqlite:///{tempfile.mkdtemp()}/bench.db"
+
+
+class StatementCounter:
+    """Count statements and commits sent over an engine, i.e. database round trips"""
+
+    def __init__(self, engine):
+        self.statements = 0
+        self.commits = 0
+        event.listen(engine.sync_engine, "before_cursor_execute", self._on_execute)
+        event.listen(engine.sync_engine, "commit", self._on_commit)
+
+    def _on_execute(self, *args):
+        self.statements += 1
+
+    def _on_commit(self, *args):
+        self.commits += 1
+
+    def reset(self):
+        self.statements = 0
+        self.commits = 0
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def latency_summary(latencies):
+    """Latency percentiles in milliseconds from a list of durations in seconds"""
+    return {
+        "count": len(latencies),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+async def setup_database(database_url):
+    """Fresh schema on a dedicated engine, returns (engine, sessionmaker)"""
+    engine = build_async_engine(database_url, name="bench")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    return engine, async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+
+def print_report(report):
+    print(json.dumps(report, indent=2))
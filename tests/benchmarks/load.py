@@ -0,0 +1,265 @@
+"""
+Load test of the HTTP API: seeds a catalog through POST /products:import, then drives a weighted mix of product
+reads, searches and orders from --concurrency concurrent clients, with a share of orders on a few hot products to
+measure stock row contention. Reports latency percentiles, throughput, status codes and database statements per
+request (from the X-SQL-Profile response header, a server run with --url needs SQL_PROFILE_HEADER_ENABLED=true)
+for every workload as JSON.
+
+The app runs in process over ASGI on a throwaway sqlite file (or BENCH_DATABASE_URL, its schema is recreated),
+or against a running server with --url:
+
+    python -m tests.benchmarks.load --products 2000 --requests 5000 --concurrency 32
+    python -m tests.benchmarks.load --mix get=40,list=20,search=10,order=20,hot_order=10 --hot-skus 3
+    python -m tests.benchmarks.load --url http://localhost:8000 --api-key $API_KEY
+    STOCK_SHARDS=8 python -m tests.benchmarks.load --mix hot_order=100 --shard-hot-skus
+
+Save a run with --output and gate a later run on it with --baseline: the command exits with status 1 when the p95
+latency of a workload grew, or its throughput dropped, by more than --max-regression (a ratio).
+"""
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import time
+import uuid
+from collections import Counter, defaultdict
+import httpx
+from app.core.config import settings
+from tests.benchmarks.common import default_database_url, latency_summary, print_report, setup_database
+
+DEFAULT_MIX = "get=40,list=20,search=10,order=20,hot_order=10"
+WORDS = ("red", "blue", "green", "wireless", "smart", "compact", "classic", "sport", "travel", "premium")
+ITEMS = ("phone", "laptop", "headphones", "watch", "camera", "speaker", "charger", "keyboard", "monitor", "backpack")
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in WORKLOADS:
+            raise ValueError(f"Unknown workload {name}, expected one of {sorted(WORKLOADS)}")
+        weights[name] = float(weight)
+    return weights
+
+
+def list_products(rng, catalog):
+    return "GET", "/v1/ecommerce/products", {"params": {"skip": rng.randrange(0, 200), "limit": 20}}
+
+
+def get_product(rng, catalog):
+    return "GET", f"/v1/ecommerce/products/{rng.choice(catalog['ids'])}", {}
+
+
+def search_products(rng, catalog):
+    query = f"{rng.choice(WORDS)} {rng.choice(ITEMS)[:rng.randint(2, 5)]}"
+    return "GET", "/v1/ecommerce/products/search", {"params": {"q": query, "limit": 10}}
+
+
+def place_order(rng, catalog):
+    lines = rng.sample(catalog["ids"], rng.randint(1, 3))
+    return "POST", "/v1/ecommerce/orders", {"json": {"products": [{"product_id": product_id, "quantity": 1}
+                                                                  for product_id in lines]}}
+
+
+def place_hot_order(rng, catalog):
+    return "POST", "/v1/ecommerce/orders", {"json": {"products": [{"product_id": rng.choice(catalog["hot_ids"]),
+                                                                   "quantity": 1}]}}
+
+
+WORKLOADS = {
+    "list": list_products,
+    "get": get_product,
+    "search": search_products,
+    "order": place_order,
+    "hot_order": place_hot_order,
+}
+
+
+async def seed(client, headers, products, hot_skus, stock):
+    """Import the catalog and read back the ids of this run's products, hot products come first"""
+    run_id = uuid.uuid4().hex[:8]
+    body = "\n".join(json.dumps({"sku": f"load-{run_id}-{i}", "name": f"{WORDS[i % 10]} {ITEMS[i // 10 % 10]} {i}",
+                                 "description": f"{WORDS[i * 7 % 10]} {ITEMS[i * 3 % 10]} for load tests",
+                                 "price": round(5 + i % 500 * 1.5, 2), "stock": stock})
+                     for i in range(products))
+    response = await client.post("/v1/ecommerce/products:import", params={"format": "ndjson"},
+                                 content=body.encode(), headers={**headers, "Content-Type": "application/x-ndjson"})
+    response.raise_for_status()
+
+    skus = {}
+    async with client.stream("GET", "/v1/ecommerce/products:export", headers=headers) as export:
+        async for line in export.aiter_lines():
+            if line:
+                row = json.loads(line)
+                if (row["sku"] or "").startswith(f"load-{run_id}-"):
+                    skus[int(row["sku"].rsplit("-", 1)[1])] = row["id"]
+    ids = [skus[i] for i in sorted(skus)]
+    return {"ids": ids, "hot_ids": ids[:max(hot_skus, 1)]}
+
+
+def statements_of(response):
+    """Statement count from the X-SQL-Profile summary, None when the server does not profile"""
+    summary = response.headers.get("X-SQL-Profile")
+    if not summary:
+        return None
+    return int(summary.split(";")[0].split("=")[1])
+
+
+async def drive(client, headers, catalog, weights, requests, concurrency, seed_value, results=None):
+    names = list(weights)
+    cumulative = [weights[name] for name in names]
+    remaining = [requests]
+
+    async def worker(index):
+        rng = random.Random(seed_value * 1000 + index)
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            name = rng.choices(names, cumulative)[0]
+            method, path, options = WORKLOADS[name](rng, catalog)
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path, headers=headers, **options)
+                status, statements = response.status_code, statements_of(response)
+            except httpx.HTTPError:
+                status, statements = "error", None
+            if results is not None:
+                result = results[name]
+                result["latencies"].append(time.perf_counter() - start)
+                result["statuses"][str(status)] += 1
+                if statements is not None:
+                    result["statements"] += statements
+                    result["profiled"] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(index) for index in range(concurrency)))
+    return time.perf_counter() - start
+
+
+def summarize(results, elapsed):
+    workloads = {}
+    for name, result in sorted(results.items()):
+        latencies = result["latencies"]
+        workloads[name] = {
+            "rps": round(len(latencies) / elapsed, 2),
+            "statuses": dict(result["statuses"]),
+            "statements_per_request": round(result["statements"] / result["profiled"], 2)
+            if result["profiled"] else None,
+            **latency_summary(latencies),
+        }
+    latencies = [latency for result in results.values() for latency in result["latencies"]]
+    statements = sum(result["statements"] for result in results.values())
+    profiled = sum(result["profiled"] for result in results.values())
+    overall = {
+        "rps": round(len(latencies) / elapsed, 2),
+        "elapsed_s": round(elapsed, 3),
+        "server_errors": sum(count for result in results.values() for status, count in result["statuses"].items()
+                             if status == "error" or int(status) >= 500),
+        "statements_per_request": round(statements / profiled, 2) if profiled else None,
+        **latency_summary(latencies),
+    }
+    return overall, workloads
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def regressions(report, baseline, max_regression):
+    """Workloads whose p95 latency or throughput got worse than the baseline by more than max_regression"""
+    found = []
+    for name, current in {"overall": report["overall"], **report["workloads"]}.items():
+        previous = baseline["overall"] if name == "overall" else baseline.get("workloads", {}).get(name)
+        if not previous:
+            continue
+        if previous["p95_ms"] and current["p95_ms"] > previous["p95_ms"] * (1 + max_regression):
+            found.append(f"{name}: p95 {previous['p95_ms']} ms -> {current['p95_ms']} ms")
+        if previous["rps"] and current["rps"] < previous["rps"] * (1 - max_regression):
+            found.append(f"{name}: {previous['rps']} rps -> {current['rps']} rps")
+    return found
+
+
+async def run(args):
+    weights = parse_mix(args.mix)
+    headers = {"X-API-KEY": args.api_key or settings.API_KEY or "", "X-SQL-Profile": "1"}
+    engine = None
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+        target = args.url
+    else:
+        from app.main import app
+        from app.api.v1.models.base import get_async_db, get_async_session_factory
+
+        engine, session_factory = await setup_database(args.database_url or default_database_url())
+
+        async def get_bench_db():
+            async with session_factory() as db:
+                yield db
+
+        app.dependency_overrides[get_async_db] = get_bench_db
+        app.dependency_overrides[get_async_session_factory] = lambda: session_factory
+        settings.SQL_PROFILE_HEADER_ENABLED = True
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench",
+                                   timeout=args.timeout)
+        target = f"in-process {engine.url.get_backend_name()}"
+
+    async with client:
+        catalog = await seed(client, headers, args.products, args.hot_skus, args.stock)
+        if args.shard_hot_skus:
+            for product_id in catalog["hot_ids"]:
+                response = await client.post(f"/v1/ecommerce/products/{product_id}/stock:shard", headers=headers)
+                response.raise_for_status()
+        await drive(client, headers, catalog, weights, args.warmup, args.concurrency, args.seed)
+        results = defaultdict(lambda: {"latencies": [], "statuses": Counter(), "statements": 0, "profiled": 0})
+        elapsed = await drive(client, headers, catalog, weights, args.requests, args.concurrency, args.seed, results)
+    if engine is not None:
+        await engine.dispose()
+
+    overall, workloads = summarize(results, elapsed)
+    return {
+        "commit": git_commit(),
+        "target": target,
+        "config": {"products": args.products, "requests": args.requests, "warmup": args.warmup,
+                   "concurrency": args.concurrency, "mix": weights, "hot_skus": args.hot_skus,
+                   "shard_hot_skus": args.shard_hot_skus, "seed": args.seed},
+        "overall": overall,
+        "workloads": workloads,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=200, help="Requests sent before measuring")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Workload weights")
+    parser.add_argument("--hot-skus", type=int, default=3, help="Products receiving all hot_order traffic")
+    parser.add_argument("--shard-hot-skus", action="store_true",
+                        help="Split the stock of hot products over STOCK_SHARDS counters, the server must enable it")
+    parser.add_argument("--stock", type=int, default=1_000_000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--url", default=None, help="Load a running server instead of the in-process app")
+    parser.add_argument("--api-key", default=None)
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--output", default=None, help="Also write the report to this file")
+    parser.add_argument("--baseline", default=None, help="Report of a previous run to compare with")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            report["regressions"] = regressions(report, json.load(baseline_file), args.max_regression)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+    if report.get("regressions"):
+        sys.exit(1)
@@ -0,0 +1,99 @@
+"""
+Order totaling benchmark: milliseconds to total --orders orders of --lines lines each with the original float loop
+(total_price += price * quantity) and with the money engine (integer minor units), and the cents the float totals
+drifted from the exact ones.
+
+    python -m tests.benchmarks.money --orders 20 --lines 10000 --rounds 5 --tax-rate 0.0825
+
+The engine timings include converting the catalog prices to minor units and the totals back to floats, as
+create_orders does. No database is involved.
+"""
+import argparse
+import random
+import time
+from decimal import Decimal
+from app.core.money import basis_points, from_minor, order_totals, to_minor
+from tests.benchmarks.common import print_report
+
+
+def generate_orders(orders, lines, products):
+    prices = {product_id: round(random.uniform(0.5, 500), 2) for product_id in range(products)}
+    return prices, [[(random.randrange(products), random.randint(1, 20)) for _ in range(lines)]
+                    for _ in range(orders)]
+
+
+def legacy_totals(prices, orders, tax_rate):
+    """Totals as originally computed, with the tax added the same way"""
+    totals = []
+    for order in orders:
+        total_price = 0.0
+        for product_id, quantity in order:
+            total_price += prices[product_id] * quantity * (1 + tax_rate)
+        totals.append(total_price)
+    return totals
+
+
+def exact_totals(prices, orders, tax_rate):
+    """The float loop computed with exact decimals, rounded to the cent once per order"""
+    rate = 1 + Decimal(repr(tax_rate))
+    return [sum(Decimal(repr(prices[product_id])) * quantity * rate for product_id, quantity in order)
+            for order in orders]
+
+
+def engine_lines(prices, orders):
+    unit_prices = {product_id: to_minor(price) for product_id, price in prices.items()}
+    line_prices, quantities, offsets = [], [], []
+    for order in orders:
+        offsets.append(len(line_prices))
+        line_prices += [unit_prices[product_id] for product_id, _ in order]
+        quantities += [quantity for _, quantity in order]
+    return line_prices, quantities, offsets
+
+
+def engine_totals(prices, orders, tax_rate):
+    totals = order_totals(*engine_lines(prices, orders), tax_basis_points=basis_points(tax_rate))
+    return [from_minor(total) for total in totals]
+
+
+def measure(function, prices, orders, tax_rate, rounds):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        totals = function(prices, orders, tax_rate)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return totals, round(best * 1000, 3)
+
+
+def run(orders, lines, products, rounds, tax_rate):
+    prices, generated = generate_orders(orders, lines, products)
+    report = {"orders": orders, "lines_per_order": lines, "rounds": rounds, "tax_rate": tax_rate}
+
+    legacy, report["float_loop_ms"] = measure(legacy_totals, prices, generated, tax_rate, rounds)
+    # Arithmetic alone, on lines already converted to minor units
+    lines = engine_lines(prices, generated)
+
+    def only_totals(*args):
+        return order_totals(*lines, tax_basis_points=basis_points(tax_rate))
+
+    _, report["engine_ms"] = measure(engine_totals, prices, generated, tax_rate, rounds)
+    _, report["engine_arithmetic_ms"] = measure(only_totals, prices, generated, tax_rate, rounds)
+
+    exact = exact_totals(prices, generated, tax_rate)
+    drift = [abs(to_minor(legacy_total) - to_minor(exact_total)) for legacy_total, exact_total in zip(legacy, exact)]
+    report["float_loop_drift"] = {"orders_off_by_cents": sum(1 for cents in drift if cents),
+                                  "max_cents": max(drift),
+                                  "max_raw": float(max(abs(Decimal(legacy_total) - exact_total)
+                                                       for legacy_total, exact_total in zip(legacy, exact)))}
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=20)
+    parser.add_argument("--lines", type=int, default=10000)
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--tax-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    print_report(run(args.orders, args.lines, args.products, args.rounds, args.tax_rate))
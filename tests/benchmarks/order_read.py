@@ -0,0 +1,145 @@
+"""
+Order read benchmark: latency percentiles of reading an order with its items, of the first page and of deep keyset
+pages of the order listing (with items, and summaries only) in a table of --orders orders, and the plan Postgres
+picks for each. With --compare the new order read indexes are dropped and the reads measured again.
+
+    python -m tests.benchmarks.order_read --orders 10000000 --lines 3 --reads 1000 --compare
+
+Orders and items are generated by the database (generate_series / a recursive CTE), 10M orders with 3 lines take
+a few minutes and about 3 GB on Postgres. Set BENCH_DATABASE_URL to run against Postgres instead of a throwaway
+sqlite file, its schema is recreated.
+"""
+import argparse
+import asyncio
+import random
+import time
+from sqlalchemy import insert, text
+from app.api.v1.models.base import Product
+from app.api.v1.repositories.order import OrderRepository
+from app.core.pagination import encode_cursor
+from tests.benchmarks.common import default_database_url, latency_summary, print_report, setup_database
+
+NEW_INDEXES = ("ix_orders_status_created_at_id", "ix_orders_created_at_id", "ix_order_items_order_id_covering")
+
+SEED_SQL = {
+    "postgresql": [
+        """INSERT INTO orders (id, total_price, status, item_count, created_at, updated_at)
+           SELECT i, :lines * 9.99, CASE WHEN i % 10 = 0 THEN 'placed' ELSE 'completed' END, :lines,
+                  now() - (:orders - i) * interval '1 second', now()
+           FROM generate_series(1, :orders) AS i""",
+        """INSERT INTO order_items (order_id, product_id, quantity)
+           SELECT i, p, 1 FROM generate_series(1, :orders) AS i, generate_series(1, :lines) AS p""",
+        "SELECT setval(pg_get_serial_sequence('orders', 'id'), :orders)",
+    ],
+    "sqlite": [
+        """WITH RECURSIVE seq(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM seq WHERE i < :orders)
+           INSERT INTO orders (id, total_price, status, item_count, created_at, updated_at)
+           SELECT i, :lines * 9.99, CASE WHEN i % 10 = 0 THEN 'placed' ELSE 'completed' END, :lines,
+                  datetime('now', '-' || (:orders - i) || ' seconds'), datetime('now')
+           FROM seq""",
+        """WITH RECURSIVE seq(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM seq WHERE i < :orders),
+                lines(p) AS (SELECT 1 UNION ALL SELECT p + 1 FROM lines WHERE p < :lines)
+           INSERT INTO order_items (order_id, product_id, quantity) SELECT i, p, 1 FROM seq, lines""",
+    ],
+}
+
+
+async def seed(engine, session_factory, orders, lines):
+    """Orders one second apart, one in ten still placed, each with `lines` items"""
+    dialect = engine.url.get_backend_name()
+    async with session_factory() as db:
+        await db.execute(insert(Product), [{"name": f"Product {i}", "description": "Benchmark product",
+                                            "price": 9.99, "stock": 0} for i in range(lines)])
+        for statement in SEED_SQL[dialect]:
+            await db.execute(text(statement), {"orders": orders, "lines": lines})
+        await db.commit()
+    if dialect == "postgresql":
+        # Index-only scans need the visibility map of freshly loaded tables
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            await conn.execute(text("VACUUM ANALYZE orders, order_items"))
+    else:
+        async with engine.begin() as conn:
+            await conn.execute(text("ANALYZE"))
+
+
+SCENARIOS = {
+    "get_order": lambda db, order_id: OrderRepository.get_order(db, order_id),
+    "first_page": lambda db, order_id: OrderRepository.get_orders(db, 50, status="placed"),
+    "deep_page": lambda db, order_id: OrderRepository.get_orders(db, 50, status="placed",
+                                                                 after=cursor(order_id)),
+    "deep_page_all_statuses": lambda db, order_id: OrderRepository.get_orders(db, 50, after=cursor(order_id)),
+    "deep_page_summaries": lambda db, order_id: OrderRepository.get_orders(db, 50, status="placed",
+                                                                           after=cursor(order_id),
+                                                                           with_items=False),
+}
+
+
+def cursor(order_id):
+    return encode_cursor("created_at", None, order_id)
+
+
+async def measure(engine, session_factory, orders, reads):
+    results = {}
+    for name, scenario in SCENARIOS.items():
+        order_ids = [random.randint(1, orders) for _ in range(reads)]
+        latencies = []
+        async with session_factory() as db:
+            for order_id in order_ids:
+                start = time.perf_counter()
+                await scenario(db, order_id)
+                latencies.append(time.perf_counter() - start)
+        results[name] = latency_summary(latencies)
+    if engine.url.get_backend_name() == "postgresql":
+        results["plans"] = await plans(engine, orders)
+    return results
+
+
+async def plans(engine, orders):
+    """Top plan nodes of the listing queries, shows which index serves them"""
+    statements = {
+        "deep_page": "SELECT id FROM orders WHERE status = 'placed' AND (created_at, id) < "
+                     "(SELECT created_at, id FROM orders WHERE id = :id) ORDER BY created_at DESC, id DESC LIMIT 51",
+        "deep_page_summaries": "SELECT id, total_price, status, item_count, created_at FROM orders "
+                               "WHERE status = 'placed' AND (created_at, id) < "
+                               "(SELECT created_at, id FROM orders WHERE id = :id) "
+                               "ORDER BY created_at DESC, id DESC LIMIT 51",
+        "page_items": "SELECT order_id, product_id, quantity FROM order_items "
+                      "WHERE order_id IN (SELECT generate_series(:id, :id + 49))",
+    }
+    found = {}
+    async with engine.connect() as conn:
+        for name, statement in statements.items():
+            rows = await conn.execute(text(f"EXPLAIN {statement}"), {"id": orders // 2})
+            found[name] = [row[0].strip() for row in rows if "Scan" in row[0]]
+    return found
+
+
+async def run(orders, lines, reads, compare, database_url):
+    engine, session_factory = await setup_database(database_url)
+    start = time.perf_counter()
+    await seed(engine, session_factory, orders, lines)
+    report = {"orders": orders, "lines_per_order": lines, "reads": reads, "database": engine.url.get_backend_name(),
+              "seed_s": round(time.perf_counter() - start, 1)}
+    report["indexed"] = await measure(engine, session_factory, orders, reads)
+    if compare:
+        async with engine.begin() as conn:
+            for index in NEW_INDEXES:
+                await conn.execute(text(f"DROP INDEX IF EXISTS {index}"))
+            # The single column index the covering index replaced
+            await conn.execute(text("CREATE INDEX ix_order_items_order_id ON order_items (order_id)"))
+        report["without_order_read_indexes"] = await measure(engine, session_factory, orders, max(reads // 20, 10))
+    await engine.dispose()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=100000)
+    parser.add_argument("--lines", type=int, default=3)
+    parser.add_argument("--reads", type=int, default=500)
+    parser.add_argument("--compare", action="store_true", help="Measure again without the order read indexes")
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args()
+    print_report(asyncio.run(run(args.orders, args.lines, args.reads, args.compare,
+                                 args.database_url or default_database_url())))
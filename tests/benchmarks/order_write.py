@@ -0,0 +1,100 @@
+"""
+Order write benchmark: database round trips and latency per order for the original ORM write path
+(add + commit + refresh, bulk_save_objects, second commit + refresh) and the current single transaction pipeline
+(conditional stock reservation, INSERT ... RETURNING, multi-row item INSERT, one commit), plus the same orders
+sent through POST /orders:batch in batches of --batch-size.
+
+    python -m tests.benchmarks.order_write --orders 500 --lines 3 --batch-size 100
+
+Set BENCH_DATABASE_URL to run against Postgres instead of a throwaway sqlite file, its schema is recreated.
+"""
+import argparse
+import asyncio
+import time
+from sqlalchemy import insert, select
+from app.api.v1.models.base import Product, Order, OrderItem
+from app.api.v1.repositories.order import OrderRepository
+from app.api.v1.schemas.ecommerce import OrderCreate
+from tests.benchmarks.common import (StatementCounter, default_database_url, latency_summary, print_report,
+                                     setup_database)
+
+
+async def legacy_place_order(db, order_data: OrderCreate):
+    """Order write as originally implemented, kept here as the baseline"""
+    product_ids = [item.product_id for item in order_data.products]
+    products = {p.id: p for p in (await db.execute(select(Product).filter(Product.id.in_(product_ids)))).scalars()}
+    total_price = 0.0
+    for item in order_data.products:
+        product = products[item.product_id]
+        total_price += product.price * item.quantity
+        product.stock -= item.quantity
+
+    order = Order(total_price=total_price, status="placed")
+    db.add(order)
+    await db.commit()
+    await db.refresh(order)
+
+    db.add_all([OrderItem(order_id=order.id, product_id=item.product_id, quantity=item.quantity)
+                for item in order_data.products])
+    await db.commit()
+    await db.refresh(order)
+    return order
+
+
+STRATEGIES = {
+    "legacy": legacy_place_order,
+    "pipeline": OrderRepository.place_order,
+}
+
+
+async def run(orders, lines, batch_size, database_url):
+    engine, session_factory = await setup_database(database_url)
+    counter = StatementCounter(engine)
+    async with session_factory() as db:
+        await db.execute(insert(Product), [{"name": f"Product {i}", "description": "Benchmark product",
+                                            "price": 9.99, "stock": orders * 3} for i in range(lines)])
+        await db.commit()
+        product_ids = list((await db.execute(select(Product.id))).scalars())
+
+    order_data = OrderCreate(products=[{"product_id": product_id, "quantity": 1} for product_id in product_ids])
+    report = {"orders": orders, "lines_per_order": lines, "database": engine.url.get_backend_name()}
+    for name, place_order in STRATEGIES.items():
+        latencies = []
+        counter.reset()
+        for _ in range(orders):
+            async with session_factory() as db:
+                start = time.perf_counter()
+                await place_order(db, order_data)
+                latencies.append(time.perf_counter() - start)
+        report[name] = {
+            "statements_per_order": round(counter.statements / orders, 2),
+            "commits_per_order": round(counter.commits / orders, 2),
+            **latency_summary(latencies),
+        }
+
+    latencies = []
+    counter.reset()
+    for start_index in range(0, orders, batch_size):
+        batch = [order_data] * min(batch_size, orders - start_index)
+        async with session_factory() as db:
+            start = time.perf_counter()
+            await OrderRepository.place_orders(db, batch)
+            latencies += [(time.perf_counter() - start) / len(batch)] * len(batch)
+    report["batch"] = {
+        "batch_size": batch_size,
+        "statements_per_order": round(counter.statements / orders, 2),
+        "commits_per_order": round(counter.commits / orders, 2),
+        **latency_summary(latencies),
+    }
+    await engine.dispose()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=200)
+    parser.add_argument("--lines", type=int, default=3)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args()
+    print_report(asyncio.run(run(args.orders, args.lines, args.batch_size, args.database_url or default_database_url())))
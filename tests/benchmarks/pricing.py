@@ -0,0 +1,107 @@
+"""
+Pricing benchmark: microseconds per order line to price orders of --lines lines against --rules promotions, with
+the compiled index (rules looked up by product and category), by evaluating every rule for every line as a naive
+engine would, and with no promotions at all. Also reports the time to compile the rules and to rebuild the index
+when a time window passes.
+
+    python -m tests.benchmarks.pricing --rules 10000 --products 50000 --orders 200 --lines 50
+
+Rules are generated in memory (80% product rules, 15% category sales, 5% store wide, a third of them with a time
+window), no database is involved.
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from app.api.v1.models.pricing import PriceIndex, compile_rule, rule_discount
+from app.api.v1.schemas.ecommerce import OrderItemBase
+from app.core.money import to_minor
+from tests.benchmarks.common import print_report
+
+
+def generate_rules(rules, products, categories):
+    now = datetime.now(timezone.utc)
+    rows = []
+    for rule_id in range(1, rules + 1):
+        target = random.random()
+        kind = random.choice(("percent", "fixed", "buy_x_get_y"))
+        starts_at = ends_at = None
+        if random.random() < 1 / 3:
+            starts_at = now - timedelta(hours=random.randint(0, 48))
+            ends_at = now + timedelta(hours=random.randint(-24, 48))
+        rows.append(SimpleNamespace(
+            id=rule_id, kind=kind,
+            product_id=random.randrange(products) if target < 0.8 else None,
+            category=f"category-{random.randrange(categories)}" if 0.8 <= target < 0.95 else None,
+            percent=random.choice((5, 10, 15, 25)) if kind == "percent" else None,
+            amount=round(random.uniform(0.5, 5), 2) if kind == "fixed" else None,
+            buy_quantity=2 if kind == "buy_x_get_y" else None, free_quantity=1 if kind == "buy_x_get_y" else None,
+            starts_at=starts_at, ends_at=ends_at))
+    return rows
+
+
+def naive_price_lines(rules, items, products, now):
+    """Every rule is checked against every line"""
+    discounts = []
+    for item in items:
+        product = products[item.product_id]
+        unit_price = to_minor(product["price"])
+        discount = 0
+        for rule in rules:
+            if not rule.starts_at <= now < rule.ends_at:
+                continue
+            if rule.product_id is not None and rule.product_id != item.product_id:
+                continue
+            if rule.category is not None and rule.category != product["category"]:
+                continue
+            discount = max(discount, rule_discount(rule, unit_price, item.quantity))
+        discounts.append(min(discount, unit_price * item.quantity))
+    return discounts
+
+
+def per_line_us(function, orders, lines):
+    start = time.perf_counter()
+    results = [function(order) for order in orders]
+    return results, round((time.perf_counter() - start) / (len(orders) * lines) * 1e6, 3)
+
+
+def run(rules, products, categories, orders, lines):
+    catalog = {product_id: {"price": round(random.uniform(1, 200), 2),
+                            "category": f"category-{random.randrange(categories)}"} for product_id in range(products)}
+    generated = [[OrderItemBase(product_id=product_id, quantity=random.randint(1, 6))
+                  for product_id in random.sample(range(products), lines)] for _ in range(orders)]
+    rows = generate_rules(rules, products, categories)
+    report = {"rules": rules, "products": products, "orders": orders, "lines_per_order": lines}
+
+    start = time.perf_counter()
+    compiled = [compile_rule(row) for row in rows]
+    report["compile_ms"] = round((time.perf_counter() - start) * 1000, 3)
+    now = time.time()
+    start = time.perf_counter()
+    index = PriceIndex(compiled, now)
+    report["index_build_ms"] = round((time.perf_counter() - start) * 1000, 3)
+
+    indexed, report["index_us_per_line"] = per_line_us(lambda items: index.price_lines(items, catalog),
+                                                       generated, lines)
+    empty = PriceIndex([], now)
+    _, report["no_rules_us_per_line"] = per_line_us(lambda items: empty.price_lines(items, catalog),
+                                                    generated, lines)
+    # The naive engine is slow, it prices a tenth of the orders
+    sample = generated[:max(orders // 10, 1)]
+    naive, report["naive_us_per_line"] = per_line_us(lambda items: naive_price_lines(compiled, items, catalog, now),
+                                                     sample, lines)
+    assert naive == [[line.discount for line in priced] for priced in indexed[:len(sample)]]
+    report["discounted_lines"] = sum(1 for priced in indexed for line in priced if line.discount)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rules", type=int, default=10000)
+    parser.add_argument("--products", type=int, default=50000)
+    parser.add_argument("--categories", type=int, default=50)
+    parser.add_argument("--orders", type=int, default=200)
+    parser.add_argument("--lines", type=int, default=50)
+    args = parser.parse_args()
+    print_report(run(args.rules, args.products, args.categories, args.orders, args.lines))
@@ -0,0 +1,87 @@
+"""
+Product list serialization benchmark: microseconds per row to load and render a page of products, comparing the
+original path (ORM entities, ProductResponse validation, jsonable_encoder, json.dumps) with the current one
+(column tuples, compiled row serializer, orjson).
+
+    python -m tests.benchmarks.serialization --products 5000 --page-size 100 --rounds 50
+
+Set BENCH_DATABASE_URL to run against Postgres instead of a throwaway sqlite file, its schema is recreated.
+"""
+import argparse
+import asyncio
+import json
+import time
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import insert, select
+from app.api.v1.models.base import Product
+from app.api.v1.models.product_cache import product_columns, product_row_to_dict
+from app.api.v1.schemas.ecommerce import ProductResponse
+from app.core.responses import dumps
+from tests.benchmarks.common import default_database_url, print_report, setup_database
+
+
+async def load_entities(db, page_size):
+    return (await db.execute(select(Product).order_by(Product.id).limit(page_size))).scalars().all()
+
+
+def render_entities(products):
+    return json.dumps(jsonable_encoder([ProductResponse.model_validate(product) for product in products])).encode()
+
+
+async def load_rows(db, page_size):
+    return (await db.execute(select(*product_columns()).order_by(Product.id).limit(page_size))).all()
+
+
+def render_rows(rows):
+    return dumps([product_row_to_dict(row) for row in rows])
+
+
+STRATEGIES = {
+    "orm_pydantic_json": (load_entities, render_entities),
+    "rows_compiled_orjson": (load_rows, render_rows),
+}
+
+
+async def run(products, page_size, rounds, database_url):
+    engine, session_factory = await setup_database(database_url)
+    async with session_factory() as db:
+        await db.execute(insert(Product), [{"sku": f"SKU-{i}", "name": f"Product {i}",
+                                            "description": "Benchmark product with a longer description " * 3,
+                                            "price": 9.99 + i, "stock": 100} for i in range(products)])
+        await db.commit()
+
+    report = {"products": products, "page_size": page_size, "rounds": rounds,
+              "database": engine.url.get_backend_name()}
+    for name, (load, render) in STRATEGIES.items():
+        load_time = render_time = 0.0
+        size = 0
+        for _ in range(rounds):
+            # A fresh session per round so entities are never served from the identity map
+            async with session_factory() as db:
+                start = time.perf_counter()
+                loaded = await load(db, page_size)
+                loaded_at = time.perf_counter()
+                body = render(loaded)
+                render_time += time.perf_counter() - loaded_at
+                load_time += loaded_at - start
+                size = len(body)
+        rows = rounds * page_size
+        report[name] = {
+            "load_us_per_row": round(load_time / rows * 1e6, 3),
+            "render_us_per_row": round(render_time / rows * 1e6, 3),
+            "total_us_per_row": round((load_time + render_time) / rows * 1e6, 3),
+            "body_bytes": size,
+        }
+    await engine.dispose()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--database-url", default=None)
+    args = parser.parse_args()
+    print_report(asyncio.run(run(args.products, args.page_size, args.rounds,
+                                 args.database_url or default_database_url())))
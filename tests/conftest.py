@@ -1,7 +1,12 @@
 import pytest
-from sqlalchemy import create_engine
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
-from app.api.v1.models.base import Base, get_db
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from app.api.v1.models.base import Base, get_db, get_async_db, get_async_session_factory
+from app.api.v1.models.database import build_async_engine
+from app.core.config import settings
+from app.core.profiling import QueryProfile, background_task
 from fastapi.testclient import TestClient
 import os
 from app.main import app
@@ -25,6 +30,8 @@ TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
 
 engine = create_engine(TEST_DATABASE_URL)
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = build_async_engine(TEST_DATABASE_URL, name="test")
+TestingAsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
 
 
 def create_test_database():
@@ -102,12 +109,48 @@ def override_get_db(test_db):
         finally:
             test_db.rollback()
 
+    async def _get_async_db():
+        async with TestingAsyncSessionLocal() as db:
+            yield db
+
     app.dependency_overrides[get_db] = _get_db
+    app.dependency_overrides[get_async_db] = _get_async_db
+    app.dependency_overrides[get_async_session_factory] = lambda: TestingAsyncSessionLocal
     return test_db
 
 
 @pytest.fixture(scope="session")
 def client(override_get_db):
-    """Set up test client for FastAPI"""
+    """
+    Set up test client for FastAPI. The outbox dispatcher stays off: its writes would race the test requests,
+    tests dispatch order events themselves
+    """
+    settings.OUTBOX_DISPATCHER_ENABLED = False
     with TestClient(app) as c:
         yield c
+
+
+@pytest.fixture
+def query_budget():
+    """Fail the test when a block sends more statements to the test database than its budget"""
+
+    @contextmanager
+    def budget(max_statements, max_duplicates=None):
+        profile = QueryProfile()
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if background_task.get() is None:
+                profile.record(statement, 0.0)
+
+        event.listen(async_engine.sync_engine, "after_cursor_execute", record)
+        try:
+            yield profile
+        finally:
+            event.remove(async_engine.sync_engine, "after_cursor_execute", record)
+        assert profile.statements <= max_statements, \
+            f"{profile.statements} statements, budget {max_statements}: {list(profile.shapes)}"
+        if max_duplicates is not None:
+            repeated = sum(count - 1 for count in profile.shapes.values())
+            assert repeated <= max_duplicates, f"{repeated} repeated statements: {profile.duplicates()}"
+
+    return budget
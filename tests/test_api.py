@@ -1,7 +1,14 @@
+import json
 import os
+import time
 import pytest
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from app.api.v1.models.api_keys import ApiKeyRecord, api_key_registry, hash_api_key
+from app.api.v1.models.database import build_async_engine
+from app.api.v1.models.ecommerce import EcommerceDBLayer
+from app.api.v1.models.outbox import ORDER_EVENT_HANDLERS
 
 
 # Define test database connection URL
@@ -14,6 +21,23 @@ headers = {
 }
 
 
+async def dispatch_order_events():
+    """Do the outbox dispatcher's work once: claim the pending order events, run their handlers, finish them"""
+    # The app's engine belongs to the test client's event loop
+    async_engine = build_async_engine(TEST_DATABASE_URL, name="test-dispatcher")
+    db_layer = EcommerceDBLayer()
+    try:
+        async with async_sessionmaker(bind=async_engine, expire_on_commit=False)() as db:
+            events = await db_layer.claim_outbox_events(db, 1000, lease_seconds=60)
+            for event in events:
+                for handler in ORDER_EVENT_HANDLERS[event.event]:
+                    await handler(json.loads(event.payload))
+            await db_layer.finish_outbox_events(db, {event.id: event.order_id for event in events}, {})
+    finally:
+        await async_engine.dispose()
+    return events
+
+
 @pytest.mark.asyncio
 async def test_get_products_no_product(client):
     """Test retrieving all products API"""
@@ -98,3 +122,500 @@ async def test_create_order_invalid_product(client):
                            json={"products": [{"product_id": 100, "quantity": 2}]})
     assert response.status_code == 400
     assert "Invalid details" in response.json()["message"]
+
+
+@pytest.mark.asyncio
+async def test_get_pool_stats(client):
+    """Test connection pool stats API"""
+    response = client.get("/v1/system/pool", headers=headers)
+    assert response.status_code == 200
+    assert "checked_out" in response.json()["test"]
+
+
+@pytest.mark.asyncio
+async def test_get_products_cursor_pagination(client):
+    """Test keyset pagination of products API follows X-Next-Cursor without repeating rows"""
+    for price in (50, 20, 20):
+        client.post("/v1/ecommerce/products", headers=headers,
+                    json={"name": "Cable", "description": "USB-C cable", "price": price, "stock": 10})
+
+    all_ids = [p["id"] for p in client.get("/v1/ecommerce/products?sort=price&limit=100", headers=headers).json()]
+    seen_ids, cursor = [], None
+    while True:
+        params = {"sort": "price", "limit": 2}
+        if cursor:
+            params["after"] = cursor
+        response = client.get("/v1/ecommerce/products", headers=headers, params=params)
+        assert response.status_code == 200
+        seen_ids += [p["id"] for p in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert seen_ids == all_ids
+
+
+@pytest.mark.asyncio
+async def test_get_products_invalid_cursor(client):
+    """Test products API rejects a malformed cursor"""
+    response = client.get("/v1/ecommerce/products?after=not-a-cursor", headers=headers)
+    assert response.status_code == 400
+    assert response.json()["message"] == "Invalid pagination cursor"
+
+
+@pytest.mark.asyncio
+async def test_get_products_served_from_cache(client):
+    """Test repeated product page reads hit the product cache and see stock changes after an order"""
+    product = client.post("/v1/ecommerce/products", headers=headers,
+                          json={"name": "Mouse", "description": "Wireless mouse", "price": 25, "stock": 3}).json()
+    client.get("/v1/ecommerce/products?limit=100", headers=headers)
+    hits = client.get("/v1/system/cache", headers=headers).json()["hits"]
+
+    client.post("/v1/ecommerce/orders", headers=headers,
+                json={"products": [{"product_id": product["id"], "quantity": 2}]})
+    response = client.get("/v1/ecommerce/products?limit=100", headers=headers)
+    assert client.get("/v1/system/cache", headers=headers).json()["hits"] > hits
+    assert [p["stock"] for p in response.json() if p["id"] == product["id"]] == [1]
+
+
+@pytest.mark.asyncio
+async def test_create_order_partial_reservation_rolled_back(client):
+    """Test an order failing on one line reports that line and leaves stock of the other lines untouched"""
+    available = client.post("/v1/ecommerce/products", headers=headers,
+                            json={"name": "Desk", "description": "Standing desk", "price": 400, "stock": 4}).json()
+    scarce = client.post("/v1/ecommerce/products", headers=headers,
+                         json={"name": "Chair", "description": "Office chair", "price": 150, "stock": 1}).json()
+
+    response = client.post("/v1/ecommerce/orders", headers=headers,
+                           json={"products": [{"product_id": available["id"], "quantity": 2},
+                                              {"product_id": scarce["id"], "quantity": 1},
+                                              {"product_id": scarce["id"], "quantity": 1}]})
+    assert response.status_code == 400
+    assert response.json()["errors"] == [f"Insufficient stock for product - {scarce['id']}, name - Chair, "
+                                         f"stock - 1, requested - 2"]
+
+    response = client.post("/v1/ecommerce/orders", headers=headers,
+                           json={"products": [{"product_id": available["id"], "quantity": 4}]})
+    assert response.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_create_orders_batch_partial_failure(client):
+    """Test batch order API places what it can and rejects the rest per order"""
+    product = client.post("/v1/ecommerce/products", headers=headers,
+                          json={"name": "Lamp", "description": "Desk lamp", "price": 30, "stock": 3}).json()
+
+    response = client.post("/v1/ecommerce/orders:batch", headers=headers, json={"orders": [
+        {"products": [{"product_id": product["id"], "quantity": 2}]},
+        {"products": [{"product_id": product["id"], "quantity": 2}]},
+        {"products": [{"product_id": product["id"], "quantity": 1}]},
+        {"products": []},
+    ]})
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["placed"], body["rejected"]) == (2, 2)
+    assert [result["status"] for result in body["results"]] == ["placed", "rejected", "placed", "rejected"]
+    assert body["results"][0]["order"]["total_price"] == 60
+    assert body["results"][3]["errors"] == ["Order must contain at least one product"]
+
+
+@pytest.mark.asyncio
+async def test_import_products_csv(client):
+    """Test bulk import streams CSV rows, upserts by sku and reports rejected rows"""
+    body = (b'sku,name,description,price,stock,category\n'
+            b'SKU-1,Keyboard,"Mechanical, ""TKL""\nswitches",80,5,peripherals\n'
+            b'SKU-2,Monitor,27 inch,-1,5,\n'
+            b'SKU-1,Keyboard,Mechanical,75,7,peripherals\n'
+            b'SKU-3,Caf\xe9 mug,Latin-1,9,1,\n')
+    response = client.post("/v1/ecommerce/products:import?format=csv", headers=headers, content=body)
+    assert response.status_code == 200
+    report = response.json()
+    assert (report["processed"], report["imported"], report["rejected"]) == (4, 1, 2)
+    assert report["rejected_rows"] == [{"line": 4, "errors": ["Price must be greater than zero"]},
+                                       {"line": 6, "errors": ["Malformed row - Invalid UTF-8 at byte 9"]}]
+
+    response = client.post("/v1/ecommerce/products:import", headers=headers,
+                           content='{"sku": "SKU-1", "name": "Keyboard", "description": "TKL", "price": 70, '
+                                   '"stock": 9, "category": "keyboards"}\n')
+    assert response.json()["imported"] == 1
+    products = client.get("/v1/ecommerce/products?limit=100", headers=headers).json()
+    assert [(p["price"], p["stock"], p["category"])
+            for p in products if p["sku"] == "SKU-1"] == [(70, 9, "keyboards")]
+
+    # A row without a category keeps the product's category, an empty CSV cell clears it
+    client.post("/v1/ecommerce/products:import", headers=headers,
+                content='{"sku": "SKU-1", "name": "Keyboard", "description": "TKL", "price": 65, "stock": 9}\n')
+    products = client.get("/v1/ecommerce/products?limit=100", headers=headers).json()
+    assert [(p["price"], p["category"]) for p in products if p["sku"] == "SKU-1"] == [(65, "keyboards")]
+    client.post("/v1/ecommerce/products:import?format=csv", headers=headers,
+                content='sku,name,description,price,stock,category\nSKU-1,Keyboard,TKL,65,9,\n')
+    products = client.get("/v1/ecommerce/products?limit=100", headers=headers).json()
+    assert [p["category"] for p in products if p["sku"] == "SKU-1"] == [None]
+
+
+@pytest.mark.asyncio
+async def test_export_products(client):
+    """Test catalog export streams every product as NDJSON and CSV"""
+    product_count = len(client.get("/v1/ecommerce/products?limit=100", headers=headers).json())
+
+    response = client.get("/v1/ecommerce/products:export", headers=headers)
+    assert response.status_code == 200
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rows) == product_count
+    assert [row["id"] for row in rows] == sorted(row["id"] for row in rows)
+
+    response = client.get("/v1/ecommerce/products:export?format=csv", headers=headers)
+    assert response.text.splitlines()[0] == "id,sku,name,description,price,stock,updated_at"
+
+    response = client.get("/v1/ecommerce/products:export", headers=headers,
+                          params={"since": rows[-1]["updated_at"]})
+    assert all(json.loads(line)["updated_at"] > rows[-1]["updated_at"] for line in response.text.splitlines())
+
+
+@pytest.mark.asyncio
+async def test_search_products(client):
+    """Test product search ranks name matches first, matches prefixes and applies filters"""
+    for name, description, price, stock in (("Trail runner", "Lightweight running shoe", 90, 4),
+                                            ("Sandal", "Beach sandal for running errands", 20, 0),
+                                            ("Running socks", "Merino socks", 15, 10)):
+        client.post("/v1/ecommerce/products", headers=headers,
+                    json={"name": name, "description": description, "price": price, "stock": stock})
+
+    response = client.get("/v1/ecommerce/products/search", headers=headers, params={"q": "runn"})
+    assert response.status_code == 200
+    assert [p["name"] for p in response.json()][:1] in (["Trail runner"], ["Running socks"])
+    assert {"Trail runner", "Sandal", "Running socks"} <= {p["name"] for p in response.json()}
+
+    response = client.get("/v1/ecommerce/products/search", headers=headers,
+                          params={"q": "running", "in_stock": True, "max_price": 50})
+    assert [p["name"] for p in response.json()] == ["Running socks"]
+
+    first = client.get("/v1/ecommerce/products/search", headers=headers, params={"q": "runn", "limit": 1})
+    second = client.get("/v1/ecommerce/products/search", headers=headers,
+                        params={"q": "runn", "limit": 1, "after": first.headers["X-Next-Cursor"]})
+    assert second.json()[0]["id"] != first.json()[0]["id"]
+
+
+@pytest.mark.asyncio
+async def test_get_product_conditional_get(client):
+    """Test product reads send an ETag, answer a matching If-None-Match with 304 and change after an order"""
+    product = client.post("/v1/ecommerce/products", headers=headers,
+                          json={"name": "Tablet", "description": "10 inch tablet", "price": 300, "stock": 5}).json()
+
+    response = client.get(f"/v1/ecommerce/products/{product['id']}", headers=headers)
+    assert response.status_code == 200
+    assert response.json()["name"] == "Tablet"
+    assert response.headers["Cache-Control"].startswith("private")
+    assert response.headers["Vary"] == "X-API-KEY"
+    etag = response.headers["ETag"]
+
+    response = client.get(f"/v1/ecommerce/products/{product['id']}", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+    page = client.get("/v1/ecommerce/products?limit=100", headers=headers)
+    assert client.get("/v1/ecommerce/products?limit=100",
+                      headers={**headers, "If-None-Match": page.headers["ETag"]}).status_code == 304
+
+    client.post("/v1/ecommerce/orders", headers=headers,
+                json={"products": [{"product_id": product["id"], "quantity": 1}]})
+    response = client.get(f"/v1/ecommerce/products/{product['id']}", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["stock"] == 4
+
+
+@pytest.mark.asyncio
+async def test_get_product_not_found(client):
+    """Test product API returns 404 for an unknown id"""
+    response = client.get("/v1/ecommerce/products/999999", headers=headers)
+    assert response.status_code == 404
+    assert response.json()["message"] == "Product not found"
+
+
+@pytest.mark.asyncio
+async def test_create_order_idempotency_key(client, monkeypatch):
+    """Test an order retried with the same Idempotency-Key is placed once and answered with the first response"""
+    product = client.post("/v1/ecommerce/products", headers=headers,
+                          json={"name": "Charger", "description": "USB-C charger", "price": 25, "stock": 5}).json()
+    order = {"products": [{"product_id": product["id"], "quantity": 2}]}
+    retry_headers = {**headers, "Idempotency-Key": "order-retry-1"}
+
+    first = client.post("/v1/ecommerce/orders", headers=retry_headers, json=order)
+    assert first.status_code == 200
+    assert first.headers["Idempotent-Replayed"] == "false"
+
+    second = client.post("/v1/ecommerce/orders", headers=retry_headers, json=order)
+    assert second.status_code == 200
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert second.json() == first.json()
+    assert client.get(f"/v1/ecommerce/products/{product['id']}", headers=headers).json()["stock"] == 3
+
+    other = {"products": [{"product_id": product["id"], "quantity": 1}]}
+    response = client.post("/v1/ecommerce/orders", headers=retry_headers, json=other)
+    assert response.status_code == 422
+
+    # The same Idempotency-Key sent with another client's API key is another key
+    other_key = ApiKeyRecord("tenant-b", hash_api_key("tenant-b-key"))
+    monkeypatch.setattr(api_key_registry, "_keys", {**api_key_registry._keys, other_key.key_hash: other_key})
+    monkeypatch.setattr(api_key_registry, "_loaded_at", time.monotonic())
+    response = client.post("/v1/ecommerce/orders", json=other,
+                           headers={**retry_headers, "X-API-KEY": "tenant-b-key"})
+    assert response.status_code == 200
+    assert response.headers["Idempotent-Replayed"] == "false"
+
+
+@pytest.mark.asyncio
+async def test_metrics(client):
+    """Test the Prometheus endpoint exposes route latency, database and order metrics"""
+    client.get("/v1/ecommerce/products/999999", headers=headers)
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert ('http_request_duration_seconds_count{method="GET",route="/v1/ecommerce/products/{product_id}",'
+            'status="404"}') in response.text
+    assert "db_query_duration_seconds_count" in response.text
+    assert "orders_placed_total" in response.text
+
+
+@pytest.mark.asyncio
+async def test_query_budgets(client, query_budget):
+    """Test product reads and order placement stay within their statement budgets"""
+    product = client.post("/v1/ecommerce/products", headers=headers,
+                          json={"name": "Cable", "description": "HDMI cable", "price": 10, "stock": 10}).json()
+    with query_budget(2):
+        client.get(f"/v1/ecommerce/products/{product['id']}", headers=headers)
+    with query_budget(1):
+        client.get("/v1/ecommerce/products?limit=5", headers=headers)
+    # The pricing rules were checked for changes moments ago
+    client.post("/v1/ecommerce/orders:quote", headers=headers,
+                json={"products": [{"product_id": product["id"], "quantity": 1}]})
+    # Catalog fields are cached by now: stock reservation, order, items and outbox inserts
+    with query_budget(4, max_duplicates=0):
+        client.post("/v1/ecommerce/orders", headers=headers,
+                    json={"products": [{"product_id": product["id"], "quantity": 1}]})
+
+
+@pytest.mark.asyncio
+async def test_sql_profile_header(client, monkeypatch):
+    """Test a request sent with X-SQL-Profile gets its statement summary back once the header is enabled"""
+    response = client.get("/v1/ecommerce/products?limit=5", headers={**headers, "X-SQL-Profile": "1"})
+    assert "X-SQL-Profile" not in response.headers
+
+    monkeypatch.setattr("app.core.config.settings.SQL_PROFILE_HEADER_ENABLED", True)
+    response = client.get("/v1/ecommerce/products?limit=5", headers={**headers, "X-SQL-Profile": "1"})
+    assert response.headers["X-SQL-Profile"].startswith("statements=")
+    assert "X-SQL-Profile" not in client.get("/v1/ecommerce/products?limit=5", headers=headers).headers
+
+
+@pytest.mark.asyncio
+async def test_order_completed_by_outbox_dispatcher(client):
+    """Test a placed order is completed in the background once its outbox event was dispatched"""
+    product = client.post("/v1/ecommerce/products", headers=headers,
+                          json={"name": "Mouse", "description": "Wireless mouse", "price": 20, "stock": 5}).json()
+    order = client.post("/v1/ecommerce/orders", headers=headers,
+                        json={"products": [{"product_id": product["id"], "quantity": 1}]}).json()
+    assert order["status"] == "placed"
+
+    events = await dispatch_order_events()
+    assert order["id"] in {event.order_id for event in events}
+    with engine.connect() as conn:
+        status = conn.execute(text("SELECT status FROM orders WHERE id = :id"), {"id": order["id"]}).scalar()
+        event_status = conn.execute(text("SELECT status FROM order_outbox WHERE order_id = :id"),
+                                    {"id": order["id"]}).scalar()
+    assert status == "completed"
+    assert event_status == "done"
+    assert order["id"] not in {event.order_id for event in await dispatch_order_events()}
+
+
+@pytest.mark.asyncio
+async def test_sharded_stock(client, monkeypatch):
+    """Test orders of a product with sharded stock deduct from its shards and never oversell"""
+    monkeypatch.setattr("app.core.config.settings.STOCK_SHARDS", 4)
+    product = client.post("/v1/ecommerce/products", headers=headers,
+                          json={"name": "Console", "description": "Game console", "price": 500, "stock": 10}).json()
+
+    response = client.post(f"/v1/ecommerce/products/{product['id']}/stock:shard", headers=headers)
+    assert response.status_code == 200
+    assert response.json() == {"product_id": product["id"], "stock": 10, "shards": [3, 3, 2, 2]}
+
+    for quantity in (3, 3, 3):
+        response = client.post("/v1/ecommerce/orders", headers=headers,
+                               json={"products": [{"product_id": product["id"], "quantity": quantity}]})
+        assert response.status_code == 200
+    response = client.post("/v1/ecommerce/orders", headers=headers,
+                           json={"products": [{"product_id": product["id"], "quantity": 2}]})
+    assert response.status_code == 400
+    # Read while sharded: the shards hold the stock, the product row is empty
+    assert client.get(f"/v1/ecommerce/products/{product['id']}", headers=headers).json()["stock"] == 1
+
+    # Merging still works once sharding is turned off
+    monkeypatch.setattr("app.core.config.settings.STOCK_SHARDS", 0)
+    response = client.post(f"/v1/ecommerce/products/{product['id']}/stock:merge", headers=headers)
+    assert response.json() == {"product_id": product["id"], "stock": 1, "shards": []}
+    assert client.get(f"/v1/ecommerce/products/{product['id']}", headers=headers).json()["stock"] == 1
+
+
+@pytest.mark.asyncio
+async def test_import_replaces_sharded_stock(client, monkeypatch):
+    """Test re-importing a product with sharded stock spreads the imported stock over its shards, not on top"""
+    monkeypatch.setattr("app.core.config.settings.STOCK_SHARDS", 4)
+    line = '{"sku": "SKU-SHARDED", "name": "Headset", "description": "Gaming headset", "price": 90, "stock": 10}\n'
+    assert client.post("/v1/ecommerce/products:import", headers=headers, content=line).json()["imported"] == 1
+    product = [p for p in client.get("/v1/ecommerce/products?limit=100", headers=headers).json()
+               if p["sku"] == "SKU-SHARDED"][0]
+    client.post(f"/v1/ecommerce/products/{product['id']}/stock:shard", headers=headers)
+
+    assert client.post("/v1/ecommerce/products:import", headers=headers, content=line).json()["imported"] == 1
+    assert client.get(f"/v1/ecommerce/products/{product['id']}", headers=headers).json()["stock"] == 10
+    response = client.post(f"/v1/ecommerce/products/{product['id']}/stock:shard", headers=headers)
+    assert response.json() == {"product_id": product["id"], "stock": 10, "shards": [3, 3, 2, 2]}
+
+
+@pytest.mark.asyncio
+async def test_shard_stock_disabled(client, monkeypatch):
+    """Test stock sharding is rejected while STOCK_SHARDS is 0"""
+    monkeypatch.setattr("app.core.config.settings.STOCK_SHARDS", 0)
+    response = client.post("/v1/ecommerce/products/1/stock:shard", headers=headers)
+    assert response.status_code == 400
+    assert response.json()["message"] == "Stock sharding is disabled"
+
+
+@pytest.mark.asyncio
+async def test_api_key_required(client):
+    """Test API requests are rejected before routing without a valid X-API-KEY, metrics stay public"""
+    response = client.get("/v1/ecommerce/products")
+    assert response.status_code == 401
+    assert response.json()["message"] == "Missing API Key"
+    response = client.get("/v1/ecommerce/products", headers={"X-API-KEY": "not-a-key"})
+    assert response.status_code == 401
+    assert response.json()["message"] == "Invalid API Key"
+    assert client.get("/metrics").status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_health_probes(client):
+    """Test liveness answers at once and readiness turns 200 once warm-up finished"""
+    assert client.get("/health/live").json() == {"status": "alive"}
+    for _ in range(50):
+        response = client.get("/health/ready")
+        if response.status_code == 200:
+            break
+        time.sleep(0.1)
+    assert response.status_code == 200
+    assert response.json()["status"] == "ready"
+    assert set(response.json()["warm_up_ms"]) == {"database", "api_keys", "product_cache", "pricing_rules"}
+
+
+@pytest.mark.asyncio
+async def test_get_orders(client, query_budget):
+    """Test reading an order with its items and paging through orders newest first"""
+    product = client.post("/v1/ecommerce/products", headers=headers,
+                          json={"name": "Pen", "description": "Ballpoint pen", "price": 2, "stock": 50}).json()
+    other = client.post("/v1/ecommerce/products", headers=headers,
+                        json={"name": "Ink", "description": "Pen refill", "price": 1, "stock": 50}).json()
+    placed = [client.post("/v1/ecommerce/orders", headers=headers,
+                          json={"products": [{"product_id": product["id"], "quantity": 2},
+                                             {"product_id": other["id"], "quantity": quantity}]}).json()
+              for quantity in (1, 2, 3)]
+
+    with query_budget(2):
+        response = client.get(f"/v1/ecommerce/orders/{placed[1]['id']}", headers=headers)
+    assert response.status_code == 200
+    order = response.json()
+    assert order["item_count"] == 2
+    assert order["total_price"] == 6
+    assert sorted(order["products"], key=lambda item: item["product_id"]) == [
+        {"product_id": product["id"], "quantity": 2}, {"product_id": other["id"], "quantity": 2}]
+    assert client.get("/v1/ecommerce/orders/999999", headers=headers).status_code == 404
+
+    pages, after = [], None
+    while True:
+        # One query for the page of orders, one for the items of the whole page
+        with query_budget(2):
+            response = client.get("/v1/ecommerce/orders", headers=headers,
+                                  params={"limit": 2, **({"after": after} if after else {})})
+        pages.extend(response.json())
+        after = response.headers.get("X-Next-Cursor")
+        if after is None:
+            break
+    ids = [order["id"] for order in pages]
+    assert len(ids) == len(set(ids))
+    assert [order["id"] for order in placed][::-1] == [order_id for order_id in ids if order_id in
+                                                       {order["id"] for order in placed}]
+    assert all(len(order["products"]) == order["item_count"] for order in pages)
+
+    summaries = client.get("/v1/ecommerce/orders", headers=headers, params={"items": "false", "limit": 100}).json()
+    assert [order["id"] for order in summaries] == ids
+    assert "products" not in summaries[0]
+    statuses = client.get("/v1/ecommerce/orders", headers=headers, params={"status": "placed", "limit": 100}).json()
+    assert all(order["status"] == "placed" for order in statuses)
+    assert client.get("/v1/ecommerce/orders?after=bogus", headers=headers).status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_sales_analytics(client):
+    """Test finished orders are counted once in the analytics tables and low stock products are listed"""
+    product = client.post("/v1/ecommerce/products", headers=headers,
+                          json={"name": "Lamp", "description": "Desk lamp", "price": 30, "stock": 6}).json()
+    order = client.post("/v1/ecommerce/orders", headers=headers,
+                        json={"products": [{"product_id": product["id"], "quantity": 2}]}).json()
+
+    await dispatch_order_events()
+    top = client.get("/v1/ecommerce/analytics/top-products?limit=100", headers=headers).json()
+    sales = {row["product_id"]: row for row in top}
+    assert sales[product["id"]]["units"] == 2
+    assert sales[product["id"]]["orders"] == 1
+    hours = client.get("/v1/ecommerce/analytics/sales-by-hour", headers=headers).json()
+    assert sum(hour["revenue"] for hour in hours) >= 60
+    low_stock = {row["product_id"]: row for row in
+                 client.get("/v1/ecommerce/analytics/low-stock", headers=headers).json()}
+    assert low_stock[product["id"]]["stock"] == 4
+
+    # A dispatcher finishing the event again, after its lease expired, does not count the order twice
+    with engine.connect() as conn:
+        event_id = conn.execute(text("SELECT id FROM order_outbox WHERE order_id = :id"), {"id": order["id"]}).scalar()
+    # The app's engine belongs to the test client's event loop
+    async_engine = build_async_engine(TEST_DATABASE_URL, name="test-dispatcher")
+    async with async_sessionmaker(bind=async_engine, expire_on_commit=False)() as db:
+        await EcommerceDBLayer().finish_outbox_events(db, {event_id: order["id"]}, {})
+    await async_engine.dispose()
+    top = client.get("/v1/ecommerce/analytics/top-products?limit=100", headers=headers).json()
+    assert {row["product_id"]: row for row in top}[product["id"]]["units"] == 2
+
+
+@pytest.mark.asyncio
+async def test_pricing_rules(client):
+    """Test promotions are applied to quotes and orders alike, and stop applying once deactivated"""
+    mug = client.post("/v1/ecommerce/products", headers=headers,
+                      json={"name": "Mug", "description": "Tea mug", "price": 12.5, "stock": 20,
+                            "category": "kitchen"}).json()
+    pen = client.post("/v1/ecommerce/products", headers=headers,
+                      json={"name": "Pen", "description": "Ballpoint pen", "price": 1.99, "stock": 20}).json()
+    response = client.post("/v1/ecommerce/pricing-rules", headers=headers,
+                           json={"name": "Kitchen sale", "kind": "percent", "category": "kitchen", "percent": 10,
+                                 "amount": 1})
+    assert response.status_code == 400
+    assert response.json()["message"] == "Invalid pricing rule"
+    kitchen_sale = client.post("/v1/ecommerce/pricing-rules", headers=headers,
+                               json={"name": "Kitchen sale", "kind": "percent", "category": "kitchen",
+                                     "percent": 10}).json()
+    pens = client.post("/v1/ecommerce/pricing-rules", headers=headers,
+                       json={"name": "Pens 2+1", "kind": "buy_x_get_y", "product_id": pen["id"], "buy_quantity": 2,
+                             "free_quantity": 1}).json()
+    order = {"products": [{"product_id": mug["id"], "quantity": 3}, {"product_id": pen["id"], "quantity": 7}]}
+
+    quote = client.post("/v1/ecommerce/orders:quote", headers=headers, json=order).json()
+    lines = {line["product_id"]: line for line in quote["products"]}
+    assert lines[mug["id"]]["discount"] == 3.75 and lines[mug["id"]]["rule_id"] == kitchen_sale["id"]
+    assert lines[pen["id"]]["discount"] == 3.98 and lines[pen["id"]]["rule_id"] == pens["id"]
+    assert quote["subtotal"] == 51.43
+    assert quote["total_price"] == 43.7
+    placed = client.post("/v1/ecommerce/orders", headers=headers, json=order).json()
+    assert placed["total_price"] == quote["total_price"]
+
+    response = client.post(f"/v1/ecommerce/pricing-rules/{kitchen_sale['id']}:deactivate", headers=headers)
+    assert response.json()["status"] == "inactive"
+    assert kitchen_sale["id"] not in [rule["id"] for rule in
+                                      client.get("/v1/ecommerce/pricing-rules", headers=headers).json()]
+    quote = client.post("/v1/ecommerce/orders:quote", headers=headers, json=order).json()
+    assert quote["total_price"] == 47.45
+    client.post(f"/v1/ecommerce/pricing-rules/{pens['id']}:deactivate", headers=headers)
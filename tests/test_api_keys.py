@@ -0,0 +1,46 @@
+import asyncio
+import json
+import pytest
+from app.api.v1.models.api_keys import ApiKeyRegistry, hash_api_key
+from app.core.rate_limit import MemoryRateLimiter
+
+
+@pytest.mark.asyncio
+async def test_registry_loads_file_keys(tmp_path):
+    """Test keys of the file source are matched by digest, expired keys are refused and API_KEY stays valid"""
+    path = tmp_path / "api_keys.json"
+    path.write_text(json.dumps([
+        {"name": "tenant-a", "key_hash": hash_api_key("key-a"), "rate": 5},
+        {"name": "tenant-b", "key": "key-b", "expires_at": "2000-01-01T00:00:00+00:00"},
+    ]))
+    registry = ApiKeyRegistry("file", path, refresh_seconds=60, default_key="main-key", default_rate=1)
+    await registry.refresh()
+
+    record = await registry.lookup("key-a")
+    assert (record.name, record.rate, record.burst) == ("tenant-a", 5, 5)
+    assert await registry.lookup("key-b") is None
+    assert await registry.lookup("unknown") is None
+    assert (await registry.lookup("main-key")).name == "default"
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_allows_burst_then_limits():
+    """Test a bucket lets a burst through and then asks the client to wait for the next token"""
+    limiter = MemoryRateLimiter()
+    assert [await limiter.acquire("key", rate=1, burst=3) for _ in range(3)] == [0, 0, 0]
+    assert 0 < await limiter.acquire("key", rate=1, burst=3) <= 1
+    assert await limiter.acquire("other", rate=1, burst=3) == 0
+
+
+@pytest.mark.asyncio
+async def test_registry_first_load_is_shared_and_keeps_default_key(tmp_path):
+    """Test requests arriving during the first load wait for it, and the default key survives a failed load"""
+    path = tmp_path / "api_keys.json"
+    path.write_text(json.dumps([{"name": "tenant-a", "key": "key-a"}]))
+    registry = ApiKeyRegistry("file", path, refresh_seconds=60, default_key="main-key")
+    records = await asyncio.gather(*(registry.lookup("key-a") for _ in range(5)))
+    assert [record.name for record in records] == ["tenant-a"] * 5
+
+    broken = ApiKeyRegistry("file", tmp_path / "missing.json", refresh_seconds=60, default_key="main-key")
+    assert await broken.lookup("key-a") is None
+    assert (await broken.lookup("main-key")).name == "default"
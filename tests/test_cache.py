@@ -0,0 +1,24 @@
+import pytest
+from app.core.cache import LRUCache
+
+
+@pytest.mark.asyncio
+async def test_lru_cache_evicts_least_recently_used():
+    """Test the in-process cache evicts the least recently used key once full"""
+    cache = LRUCache(max_size=2, default_ttl=60)
+    await cache.set_many({"a": 1, "b": 2})
+    await cache.get("a")
+    await cache.set("c", 3)
+
+    assert await cache.get_many(["a", "b", "c"]) == {"a": 1, "c": 3}
+    assert cache.stats()["evictions"] == 1
+
+
+@pytest.mark.asyncio
+async def test_lru_cache_expires_entries():
+    """Test entries are not served past their TTL"""
+    cache = LRUCache(max_size=10, default_ttl=60)
+    await cache.set("a", 1, ttl=0)
+
+    assert await cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
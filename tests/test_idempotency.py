@@ -0,0 +1,48 @@
+import asyncio
+import pytest
+from app.api.v1.models.idempotency import IdempotencyGuard, MemoryIdempotencyStore
+
+
+@pytest.mark.asyncio
+async def test_concurrent_duplicate_waits_for_first_response():
+    """Test a duplicate sent while the first request is in flight waits for it instead of running again"""
+    guard = IdempotencyGuard(MemoryIdempotencyStore(), ttl=60, lock_ttl=30, wait_timeout=5, poll_interval=1)
+    calls = []
+
+    async def request():
+        record = await guard.begin(None, "key", "fingerprint")
+        if record is not None:
+            return record.body
+        try:
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            await guard.complete(None, "key", 200, {"id": 1})
+            return {"id": 1}
+        finally:
+            guard.finish("key")
+
+    assert await asyncio.gather(request(), request()) == [{"id": 1}, {"id": 1}]
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_released_key_runs_again():
+    """Test a key released after a server error can be claimed by the retry"""
+    store = MemoryIdempotencyStore()
+    guard = IdempotencyGuard(store, ttl=60, lock_ttl=30, wait_timeout=0, poll_interval=0)
+
+    assert await guard.begin(None, "key", "fingerprint") is None
+    await guard.fail(None, "key", RuntimeError())
+    guard.finish("key")
+    assert await guard.begin(None, "key", "fingerprint") is None
+
+
+@pytest.mark.asyncio
+async def test_completing_a_purged_key_is_a_no_op():
+    """Test a request outliving its lock completes without error once the key was purged"""
+    store = MemoryIdempotencyStore()
+    store.PURGE_INTERVAL = 0
+    assert await store.claim(None, "key", "fingerprint", lock_ttl=0) is None
+    assert await store.claim(None, "other", "fingerprint", lock_ttl=30) is None  # purges the expired lock
+    await store.complete(None, "key", 200, {"id": 1}, ttl=60)
+    assert await store.claim(None, "key", "fingerprint", lock_ttl=30) is None
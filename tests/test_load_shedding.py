@@ -0,0 +1,51 @@
+import asyncio
+import pytest
+from app.core.concurrency import AdaptiveLimiter, Overloaded
+
+
+@pytest.mark.asyncio
+async def test_orders_are_served_before_queued_reads():
+    """Test a freed slot goes to a queued order before reads that arrived earlier, and orders evict reads"""
+    limiter = AdaptiveLimiter(initial_limit=1, min_limit=1, max_limit=1, max_queue=2, target_latency=1)
+    await limiter.acquire(2, timeout=5)
+    served = []
+
+    async def request(priority):
+        await limiter.acquire(priority, timeout=5)
+        served.append(priority)
+
+    reads = [asyncio.create_task(request(2)) for _ in range(2)]
+    await asyncio.sleep(0)
+    order = asyncio.create_task(request(0))
+    await asyncio.sleep(0)
+    limiter.release(0.01, failed=False)
+    await order
+    limiter.release(0.01, failed=False)
+    results = await asyncio.gather(*reads, return_exceptions=True)
+    assert served == [0, 2]
+    assert isinstance(results[1], Overloaded) and results[1].reason == "evicted"
+
+
+@pytest.mark.asyncio
+async def test_limit_is_cut_on_slow_requests_and_grows_back():
+    """Test the limit backs off multiplicatively on slow requests and grows additively on fast ones"""
+    limiter = AdaptiveLimiter(initial_limit=10, min_limit=2, max_limit=20, max_queue=10, target_latency=0.1)
+    for _ in range(10):
+        await limiter.acquire(1, timeout=1)
+    limiter.release(0.5, failed=False)
+    assert limiter.limit == pytest.approx(9)
+    limiter.release(0.5, failed=False)
+    assert limiter.limit == pytest.approx(9)  # one cut per target latency
+    limiter.release(0.01, failed=False)
+    assert limiter.limit > 9
+
+
+@pytest.mark.asyncio
+async def test_request_over_its_deadline_is_rejected_at_once():
+    """Test a request expected to wait longer than its timeout is rejected without queueing"""
+    limiter = AdaptiveLimiter(initial_limit=1, min_limit=1, max_limit=1, max_queue=10, target_latency=10)
+    await limiter.acquire(1, timeout=1)
+    with pytest.raises(Overloaded) as err:
+        await limiter.acquire(1, timeout=1)
+    assert err.value.reason == "deadline"
+    assert limiter.queued == 0
@@ -0,0 +1,16 @@
+from app.core.metrics import MetricsRegistry
+
+
+def test_histogram_renders_cumulative_buckets():
+    """Test histogram samples are cumulative per upper bound with sum and count"""
+    registry = MetricsRegistry()
+    histogram = registry.histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.labels("/a").observe(value)
+
+    lines = registry.render().splitlines()
+    assert 'latency_seconds_bucket{route="/a",le="0.1"} 2' in lines
+    assert 'latency_seconds_bucket{route="/a",le="1.0"} 3' in lines
+    assert 'latency_seconds_bucket{route="/a",le="+Inf"} 4' in lines
+    assert 'latency_seconds_sum{route="/a"} 2.65' in lines
+    assert 'latency_seconds_count{route="/a"} 4' in lines
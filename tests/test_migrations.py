@@ -0,0 +1,83 @@
+from pathlib import Path
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.config import Config
+from alembic.migration import MigrationContext
+from sqlalchemy import (TIMESTAMP, Column, Float, ForeignKey, Integer, MetaData, String, Table, create_engine, func,
+                        insert)
+from app.api.v1.models.base import Base
+
+ROOT = Path(__file__).resolve().parent.parent
+# Created by the migrations on PostgreSQL only
+POSTGRESQL_INDEXES = {"ix_products_search_vector", "ix_products_name_trgm", "ix_order_items_order_id_covering"}
+
+
+def alembic_config(database_url):
+    config = Config(str(ROOT / "alembic.ini"))
+    config.set_main_option("script_location", str(ROOT / "migrations"))
+    config.cmd_opts = type("CmdOpts", (), {"x": [f"database_url={database_url}"]})()
+    return config
+
+
+def schema_diff(engine):
+    with engine.connect() as connection:
+        diff = compare_metadata(MigrationContext.configure(connection), Base.metadata)
+    return [change for change in diff
+            if not (change[0] in ("add_index", "remove_index") and change[1].name in POSTGRESQL_INDEXES)]
+
+
+def pre_migration_metadata():
+    """The models as create_all created them at import before the app had migrations"""
+    metadata = MetaData()
+
+    def timestamps():
+        return [Column("created_at", TIMESTAMP(timezone=True), nullable=False, server_default=func.now()),
+                Column("updated_at", TIMESTAMP(timezone=True), nullable=False, server_default=func.now())]
+
+    Table("products", metadata, Column("id", Integer, primary_key=True, index=True, autoincrement=True),
+          Column("name", String, index=True), Column("description", String), Column("price", Float),
+          Column("stock", Integer), *timestamps())
+    Table("orders", metadata, Column("id", Integer, primary_key=True, index=True, autoincrement=True),
+          Column("total_price", Float), Column("status", String), *timestamps())
+    Table("order_items", metadata,
+          Column("order_id", Integer, ForeignKey("orders.id"), primary_key=True, index=True),
+          Column("product_id", Integer, ForeignKey("products.id"), primary_key=True, index=True),
+          Column("quantity", Integer))
+    return metadata
+
+
+def test_migrations_match_models(tmp_path):
+    """Test that upgrading an empty database to head gives the schema of the models, and that it downgrades"""
+    database_url = f"sqlite:///{tmp_path / 'migrations.db'}"
+    config = alembic_config(database_url)
+
+    command.upgrade(config, "head")
+    engine = create_engine(database_url)
+    try:
+        assert schema_diff(engine) == []
+
+        command.downgrade(config, "base")
+        with engine.connect() as connection:
+            assert compare_metadata(MigrationContext.configure(connection), Base.metadata)
+    finally:
+        engine.dispose()
+
+
+def test_stamped_pre_migration_database_upgrades(tmp_path):
+    """Test that a database created before migrations, stamped 0001, upgrades to the schema of the models"""
+    database_url = f"sqlite:///{tmp_path / 'legacy.db'}"
+    config = alembic_config(database_url)
+    engine = create_engine(database_url)
+    try:
+        metadata = pre_migration_metadata()
+        metadata.create_all(engine)
+        with engine.begin() as connection:
+            connection.execute(insert(metadata.tables["products"]).values(name="Legacy", price=10.005, stock=3))
+
+        command.stamp(config, "0001")
+        command.upgrade(config, "head")
+        assert schema_diff(engine) == []
+        with engine.connect() as connection:
+            assert connection.exec_driver_sql("SELECT name, price, stock FROM products").one() == ("Legacy", 10.01, 3)
+    finally:
+        engine.dispose()
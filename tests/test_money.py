@@ -0,0 +1,33 @@
+from app.core.money import basis_points, order_totals, to_minor
+
+
+def test_amounts_round_half_up_to_the_cent():
+    """Test floats are taken as the decimal they were written as, not as their binary value"""
+    assert to_minor(0.1 + 0.2) == 30
+    assert to_minor(1.005) == 101  # 1.00499999999999989... as a binary float
+    assert to_minor(2.675) == 268
+    assert to_minor("19.99") == 1999
+    assert basis_points(0.0825) == 825
+
+
+def test_order_totals_add_lines_without_drift():
+    """Test a large order totals exactly where summing float line amounts drifts"""
+    lines = 10000
+    float_total = 0.0
+    for _ in range(lines):
+        float_total += 0.1 * 3
+    assert float_total != 3000.0
+    assert order_totals([10] * lines, [3] * lines, [0]) == [300000]
+
+
+def test_order_totals_discounts_and_tax():
+    """Test discounts are capped at the line amount and tax is rounded half up per line"""
+    prices, quantities, discounts = [999, 250, 1000, 5], [2, 4, 1, 1], [100, 5000, 0, 0]
+    totals = order_totals(prices, quantities, [0, 2, 3], discounts=discounts, tax_basis_points=825)
+    # 1898 + 157 tax (156.585) and a line discounted to nothing, 1000 + 83 tax (82.5), 5 + 0 tax (0.4125)
+    assert totals == [2055, 1083, 5]
+
+
+def test_order_totals_are_exact_for_large_amounts():
+    """Test totals past the range of 64 bit integers stay exact"""
+    assert order_totals([10 ** 15, 1], [10 ** 4, 1], [0], tax_basis_points=2000) == [12 * 10 ** 18 + 1]
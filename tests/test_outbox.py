@@ -0,0 +1,14 @@
+import pytest
+from datetime import datetime, timezone
+from app.api.v1.models.outbox import OutboxDispatcher
+
+
+@pytest.mark.asyncio
+async def test_retry_backoff_until_dead():
+    """Test failed events are retried with exponential backoff and given up after max_attempts"""
+    dispatcher = OutboxDispatcher({}, batch_size=10, workers=1, queue_size=10, max_attempts=4, retry_backoff=1,
+                                  poll_interval=1, lease_seconds=60)
+    now = datetime.now(timezone.utc)
+    delays = [round((dispatcher._retry_at(attempts) - now).total_seconds()) for attempts in (1, 2, 3)]
+    assert delays == [1, 2, 4]
+    assert dispatcher._retry_at(4) is None
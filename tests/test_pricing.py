@@ -0,0 +1,34 @@
+import math
+from app.api.v1.models.pricing import CompiledRule, PriceIndex
+from app.api.v1.schemas.ecommerce import OrderItemBase
+
+
+def rule(rule_id, kind, product_id=None, category=None, percent=0, amount=0, buy=0, free=0, starts_at=-math.inf,
+         ends_at=math.inf):
+    return CompiledRule(rule_id, kind, product_id, category, percent, amount, buy, free, starts_at, ends_at)
+
+
+PRODUCTS = {1: {"price": 10.0, "category": "toys"}, 2: {"price": 4.0, "category": None}}
+
+
+def test_best_rule_wins_and_discount_is_capped():
+    """Test a line gets the largest discount of its product, category and store wide rules, at most its amount"""
+    index = PriceIndex([rule(1, "percent", category="toys", percent=2000), rule(2, "fixed", product_id=1, amount=300),
+                        rule(3, "fixed", product_id=2, amount=900), rule(4, "percent", percent=500),
+                        rule(5, "percent", percent=300)], now=0)
+    assert index.everywhere == (rule(4, "percent", percent=500),)  # rule 5 can never win
+    lines = index.price_lines([OrderItemBase(product_id=1, quantity=2), OrderItemBase(product_id=2, quantity=1),
+                               OrderItemBase(product_id=3, quantity=1)], PRODUCTS)
+    assert [(line.product_id, line.discount, line.rule_id) for line in lines] == [(1, 600, 2), (2, 400, 3)]
+
+
+def test_index_covers_one_time_window():
+    """Test rules outside their window are left out and the index expires at the next start or end"""
+    rules = [rule(1, "percent", percent=1000, starts_at=100, ends_at=200),
+             rule(2, "buy_x_get_y", buy=1, free=1, starts_at=150)]
+    before, during, later = PriceIndex(rules, now=50), PriceIndex(rules, now=120), PriceIndex(rules, now=160)
+    assert before.empty and before.valid_until == 100
+    assert during.covers(149) and not during.covers(150)
+    items = [OrderItemBase(product_id=1, quantity=3)]
+    assert during.price_lines(items, PRODUCTS)[0].discount == 300
+    assert later.price_lines(items, PRODUCTS)[0].discount == 1000 and later.valid_until == 200
@@ -0,0 +1,20 @@
+from app.core.profiling import QueryProfile, statement_shape
+
+
+def test_statement_shape_folds_in_lists():
+    """Test statements differing only by IN list length or placeholder style share a shape"""
+    assert statement_shape("SELECT * FROM products WHERE id IN (?, ?, ?)") == \
+        statement_shape("SELECT * FROM products\n WHERE id IN (?)") == \
+        statement_shape("SELECT * FROM products WHERE id IN ($1::INTEGER, $2::INTEGER)")
+
+
+def test_profile_reports_repeated_statements():
+    """Test a statement sent once per row is reported as repeated"""
+    profile = QueryProfile()
+    for product_id in range(3):
+        profile.record("SELECT * FROM products WHERE id = ?", 0.001)
+    profile.record("SELECT * FROM orders", 0.002)
+
+    assert profile.statements == 4
+    assert profile.duplicates() == {"SELECT * FROM products WHERE id = ?": 3}
+    assert profile.summary() == "statements=4; db_ms=5.000; duplicates=2"